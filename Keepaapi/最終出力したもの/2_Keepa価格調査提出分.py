@@ -4,26 +4,26 @@
 # In[3]:
 
 
-import requests
-import time
-import pandas as pd
 import tkinter as tk
 from tkinter import messagebox, filedialog
 import threading
-import datetime
 import traceback
 import ctypes
 import os
+from shared.gui_log import LogPump
+from keepa_cache import REFRESH_STALE, CACHE_MODE_LABELS
+from keepa_core import (
+    PriceLookup, load_input, journal_input_path, default_output_dir, run_name, save_simple,
+)
 
 # ============================================================
 # 設定値
 # ============================================================
-DOMAIN_JP = 5
 STOP_FLAG = False
-MAX_TOKENS_PER_ITEM = 10
-MAX_SECONDS_ALLOWED = 10       # タイムアウト：10秒
-ERROR_WAIT_TIME = 1800          # エラー時の待機時間（秒）＝5分
-SAVE_INTERVAL = 10             # ✅ 10件ごとに保存
+MAX_TOKENS_PER_ITEM = 10       # トークン見込みの初期値（実績で自動補正）
+CONCURRENCY = 4                # 同時に投げるリクエスト数
+CACHE_TTL_HOURS = 24           # キャッシュの有効期限（時間）
+CACHE_MAX_ENTRIES = 1_000_000  # キャッシュ件数の上限（超えたら古い参照から削除）
 
 # ============================================================
 # スリープ防止（Windows）
@@ -43,156 +43,89 @@ def allow_sleep():
     except Exception:
         pass
 
-# ============================================================
-# Keepa API呼び出し
-# ============================================================
-def fetch_top_display_price(api_key: str, code: str):
-    url = (
-        f"https://api.keepa.com/product?key={api_key}"
-        f"&domain={DOMAIN_JP}&code={code}"
-        "&history=0&offers=20&onlyLiveOffers=0&buybox=1&stats=0"
-    )
-    start_time = time.time()
-    try:
-        resp = requests.get(url, timeout=MAX_SECONDS_ALLOWED)
-        if resp.status_code == 429:
-            return None, None, "トークン枯渇", 0
-        data = resp.json()
-    except Exception as e:
-        return None, None, f"通信エラー: {e}", 0
-
-    if time.time() - start_time > MAX_SECONDS_ALLOWED:
-        return None, None, f"処理時間超過（{MAX_SECONDS_ALLOWED}秒）", 0
-    if not data or "products" not in data:
-        return None, None, "データなし", 0
-
-    products = data["products"]
-    if not products:
-        return None, None, "商品が見つからない", 0
-
-    product = products[0]
-    title = product.get("title", "")
-    stats = product.get("stats") or {}
-
-    # ✅ BuyBox優先
-    for key in ("buyBoxPrice", "buyBoxShippingPrice", "current_BUY_BOX_SHIPPING"):
-        v = stats.get(key)
-        if isinstance(v, (int, float)) and v > 0:
-            return title, int(v), None, 0
-
-    # ✅ Prime優先（なければ最初の出品）
-    offers = product.get("offers") or []
-    order = product.get("liveOffersOrder") or []
-    ordered = [offers[i] for i in order if isinstance(i, int) and i < len(offers)]
-    if not ordered and offers:
-        ordered = offers
-
-    prime_offer = next((o for o in ordered if o.get("isPrime")), None)
-    chosen = prime_offer or (ordered[0] if ordered else None)
-
-    if chosen:
-        price = chosen.get("price")
-        ship = chosen.get("shipping") or 0
-        if price and price > 0:
-            total = int(price) + int(ship)
-            return title, total, None, 0
-
-    hit_count = len(offers)
-    if hit_count > 0:
-        return title, None, f"価格取得失敗（{hit_count}件ヒット）", 0
-    else:
-        return title, None, "商品が見つからない", 0
-
-# ============================================================
-# ログ出力まとめ
-# ============================================================
-def flush_logs(log_box, buffer):
-    if not buffer:
-        return
-    log_box.insert(tk.END, "".join(buffer))
-    log_box.see(tk.END)
-    buffer.clear()
-
 # ============================================================
 # メイン処理
 # ============================================================
-def start_process(api_key, filepath, log_box, start_button):
+def start_process(api_key, filepath, log, start_button, cache_mode=REFRESH_STALE, resume_journal=None,
+                  concurrency=CONCURRENCY):
+    """
+    GUI から呼ぶ取得処理（本体は keepa_core.PriceLookup）。
+    resume_journal に前回のジャーナル（結果_*.jsonl）を渡すと、
+    記録済みの行を飛ばして続きから取得し、同じ結果ファイルへ出力する。
+    log は gui_log.LogPump（ワーカースレッドから呼んでよい。ボタン・ダイアログも log.call で GUI スレッドに回す）。
+    ログは結果_*.log にも残る。
+    計測値は結果_*.metrics.json / .prom に定期的に書き出す（実行中に外から確認できる）。
+    再試行しても取れなかったJANは結果_*_再取得用.csv に出す（次回そのまま選択できる）。
+    """
     global STOP_FLAG
     STOP_FLAG = False
     prevent_sleep()
-    start_button.config(state="disabled")
+    log.call(start_button.config, state="disabled")
+
+    if resume_journal:
+        journal_path = resume_journal
+        filepath = journal_input_path(journal_path) or filepath
+        output_file = os.path.splitext(journal_path)[0] + ".xlsx"
+    else:
+        output_file = os.path.join(default_output_dir(), run_name() + ".xlsx")
+        journal_path = os.path.splitext(output_file)[0] + ".jsonl"
 
     try:
-        df = pd.read_excel(filepath, header=None)
+        rows, total = load_input(filepath)
     except Exception as e:
-        messagebox.showerror("読込エラー", f"Excelファイルを開けませんでした。\n{e}")
-        start_button.config(state="normal")
+        log.call(messagebox.showerror, "読込エラー", f"JANファイルを開けませんでした。\n{e}")
+        log.call(start_button.config, state="normal")
         allow_sleep()
         return
 
-    total = len(df)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-    output_file = os.path.join(desktop_path, f"結果_{timestamp}.xlsx")
-
-    log_box.insert(tk.END, f"📘 ファイル読込完了: {filepath}\n🔢 全{total}件の処理を開始します。\n\n")
-    log_box.see(tk.END)
-
-    results = []
-    log_buffer = []
+    log.spool_to(os.path.splitext(journal_path)[0] + ".log")
+    of_total = f"/{total}" if total is not None else ""      # 件数が分からない入力（xls など）は件数なしで表示
+    log(f"📘 ファイル読込完了: {filepath}\n🔢 全{total if total is not None else ''}件の処理を開始します。\n\n")
+
+    # ✅ 1件ごとにジャーナルへ追記（Excel は最後に1回だけ作る）
+    #    通信エラー等の行は記録せずに飛ばし、再開時に取り直す
+    lookup = PriceLookup(
+        api_key, journal_path,
+        concurrency=concurrency,
+        cache_mode=cache_mode,
+        tokens_per_item=MAX_TOKENS_PER_ITEM,
+        cache_ttl_hours=CACHE_TTL_HOURS,
+        cache_max_entries=CACHE_MAX_ENTRIES,
+        keep_failed=False,
+        metrics_path=os.path.splitext(journal_path)[0] + ".metrics",
+        dead_letter_path=os.path.splitext(journal_path)[0] + "_再取得用.csv",
+        log=log,
+        stop=lambda: STOP_FLAG,
+    )
 
     try:
-        for i, row in df.iterrows():
-            if STOP_FLAG:
-                log_box.insert(tk.END, "🛑 強制停止を検出 → 現在の結果を保存中...\n")
-                pd.DataFrame(results).to_excel(output_file, index=False)
-                log_box.insert(tk.END, f"💾 中断時の結果を保存しました → {output_file}\n")
-                break
-
-            jan = str(row.iloc[0]).strip() if len(row) > 0 else ""
-            if not jan or jan.lower() == "nan":
-                continue
-
-            title, price, error, _ = fetch_top_display_price(api_key, jan)
-
-            if error:
-                if "トークン枯渇" in error:
-                    log_box.insert(tk.END, f"🪙 {i+1}/{total} {jan} → トークン枯渇。30分待機。\n")
-                    log_box.see(tk.END)
-                    time.sleep(1800)
-                    continue
-                elif "通信エラー" in error:
-                    log_box.insert(tk.END, f"⚠️ {i+1}/{total} {jan} → 処理時間超過のためスキップ\n")
-                    log_box.see(tk.END)
-                    time.sleep(10)
-                    continue
-
-            results.append({
-                "JANコード": jan,
-                "価格": price if price is not None else "Null",
-                "商品名": title or "",
-                "備考": error or ""
-            })
-
-            log_buffer.append(f"🕐 {i+1}/{total} 件処理完了\n")
-            if len(log_buffer) >= 1:
-                flush_logs(log_box, log_buffer)
-
-            if (i + 1) % SAVE_INTERVAL == 0:
-                pd.DataFrame(results).to_excel(output_file, index=False)
-                log_box.insert(tk.END, f"💾 {i+1}件完了 → 一時保存しました。\n")
-                log_box.see(tk.END)
-
-        pd.DataFrame(results).to_excel(output_file, index=False)
-        log_box.insert(tk.END, f"\n🎉 完了！結果を「{output_file}」に保存しました。\n")
-        messagebox.showinfo("完了", f"処理が完了しました！\n結果ファイル: {output_file}")
+        for record in lookup.run(rows, total, input_path=filepath, resume=bool(resume_journal)):
+            log(f"🕐 {record['row']+1}{of_total} 件処理完了\n")
+
+        if lookup.stopped:
+            log("🛑 強制停止を検出 → 現在の結果を保存中...\n")
+            save_simple(journal_path, output_file, lookup.metrics)
+            log(f"💾 中断時の結果を保存しました → {output_file}\n")
+            log(f"↩ 続きは「再開」で {os.path.basename(journal_path)} を選択してください。\n")
+        else:
+            save_simple(journal_path, output_file, lookup.metrics)
+            log(f"💽 キャッシュ利用 {lookup.cache_hits}件 / キャッシュ外 {lookup.cache_misses}件\n")
+            log(f"🪙 {lookup.token_report()}\n")
+            log(f"🧮 {lookup.dedup_report()}\n")
+            log(f"⏱ {lookup.metrics_report()}\n")
+            log(f"🔁 {lookup.retry_report()}\n")
+            if lookup.dead_letters:
+                log(f"♻️ 取れなかったJANは {lookup.dead_letter_path} に出力しました（そのまま入力ファイルに使えます）。\n")
+            log(f"\n🎉 完了！結果を「{output_file}」に保存しました。\n")
+            log.call(messagebox.showinfo, "完了", f"処理が完了しました！\n結果ファイル: {output_file}")
 
     except Exception as e:
-        log_box.insert(tk.END, f"⚠️ エラー発生: {e}\n{traceback.format_exc()}")
-        messagebox.showerror("エラー", f"処理中に問題が発生しました。\n{output_file}")
+        log(f"⚠️ エラー発生: {e}\n{traceback.format_exc()}")
+        log.call(messagebox.showerror, "エラー", f"処理中に問題が発生しました。\n途中までの結果: {journal_path}")
 
     finally:
-        start_button.config(state="normal")
+        log.spool_to(None)
+        log.call(start_button.config, state="normal")
         allow_sleep()
 
 # ============================================================
@@ -201,13 +134,14 @@ def start_process(api_key, filepath, log_box, start_button):
 def create_gui():
     root = tk.Tk()
     root.title("Keepa価格取得ツール")
-    root.geometry("420x330")
+    root.geometry("420x390")
     root.configure(bg="#f5f0e6")
     root.resizable(False, False)
 
     def on_close():
         if messagebox.askyesno("確認", "本当に終了しますか？"):
             allow_sleep()
+            log.stop()
             root.destroy()
     root.protocol("WM_DELETE_WINDOW", on_close)
 
@@ -218,7 +152,7 @@ def create_gui():
     chk_top.pack(anchor="e", padx=10, pady=(3, 0))
     root.attributes("-topmost", True)
 
-    tk.Label(root, text="Keepa APIキー：", bg="#f5f0e6", font=("Meiryo", 10, "bold")).pack(anchor="w", padx=10, pady=2)
+    tk.Label(root, text="Keepa APIキー（複数はカンマ区切り）：", bg="#f5f0e6", font=("Meiryo", 10, "bold")).pack(anchor="w", padx=10, pady=2)
     api_entry = tk.Entry(root, width=55, show="*")
     api_entry.pack(padx=10)
 
@@ -228,13 +162,21 @@ def create_gui():
     file_label.pack(padx=10, pady=2)
 
     def select_file():
-        filepath = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx *.xls")])
+        filepath = filedialog.askopenfilename(
+            filetypes=[("JANリスト", "*.xlsx *.xlsm *.xls *.csv *.txt"), ("Excel files", "*.xlsx *.xls")]
+        )
         if filepath:
             file_label.config(text=filepath)
             file_label.filepath = filepath
 
     tk.Button(root, text="ファイルを選択", command=select_file, font=("Meiryo", 9), width=18).pack(pady=3)
 
+    frame_cache = tk.Frame(root, bg="#f5f0e6")
+    frame_cache.pack(anchor="w", padx=10)
+    tk.Label(frame_cache, text="キャッシュ：", bg="#f5f0e6", font=("Meiryo", 9, "bold")).pack(side="left")
+    var_cache_mode = tk.StringVar(value=next(iter(CACHE_MODE_LABELS)))
+    tk.OptionMenu(frame_cache, var_cache_mode, *CACHE_MODE_LABELS).pack(side="left")
+
     frame_log = tk.Frame(root, bg="#f5f0e6")
     frame_log.pack(padx=10, pady=(5, 0), fill="both", expand=True)
     log_box = tk.Text(frame_log, height=6, width=55, font=("Meiryo", 8))
@@ -242,6 +184,8 @@ def create_gui():
     scrollbar = tk.Scrollbar(frame_log, command=log_box.yview)
     scrollbar.pack(side="right", fill="y")
     log_box.config(yscrollcommand=scrollbar.set)
+    log = LogPump(log_box)
+    log.start()
 
     frame_buttons = tk.Frame(root, bg="#f5f0e6")
     frame_buttons.pack(pady=5)
@@ -249,8 +193,7 @@ def create_gui():
     def force_stop():
         global STOP_FLAG
         STOP_FLAG = True
-        log_box.insert(tk.END, "\n🛑 強制終了ボタンが押されました。\n")
-        log_box.see(tk.END)
+        log("\n🛑 強制終了ボタンが押されました。\n")
 
     start_button = tk.Button(frame_buttons, text="▶ 開始", bg="#4CAF50", fg="white",
                              font=("Meiryo", 10, "bold"), width=14)
@@ -261,10 +204,27 @@ def create_gui():
 
     start_button.config(command=lambda: threading.Thread(
         target=start_process,
-        args=(api_entry.get().strip(), getattr(file_label, "filepath", None), log_box, start_button),
+        args=(api_entry.get().strip(), getattr(file_label, "filepath", None), log, start_button,
+              CACHE_MODE_LABELS[var_cache_mode.get()]),
         daemon=True
     ).start())
 
+    def resume():
+        journal_path = filedialog.askopenfilename(
+            title="再開するジャーナル（結果_*.jsonl）を選択",
+            filetypes=[("ジャーナル", "*.jsonl")]
+        )
+        if not journal_path:
+            return
+        threading.Thread(
+            target=start_process,
+            args=(api_entry.get().strip(), getattr(file_label, "filepath", None), log, start_button,
+                  CACHE_MODE_LABELS[var_cache_mode.get()], journal_path),
+            daemon=True
+        ).start()
+
+    tk.Button(root, text="↩ 中断した実行を再開", command=resume, font=("Meiryo", 9), width=18).pack(pady=(0, 5))
+
     root.mainloop()
 
 # ============================================================
@@ -4,33 +4,42 @@
 """
 フロー：
  1) Excelファイル（JANの1列リスト）を1つドロップ
- 2) Keepa APIキーを入力
+ 2) Keepa APIキーを入力（複数あればカンマ区切りで全部）
  3) 自動で価格取得開始（GUIログ表示・10件ごとに進捗表示）
  4) 完了後、「JAN整列結果.xlsx」「価格取得成功.xlsx」
     「価格取得失敗.xlsx」「商品が見つからなかったもの.xlsx」を出力
 
 出力先：
   デスクトップに「結果_YYYYMMDD_HHMMSS」フォルダを自動作成し、その中へ保存
+  画面のログは直近の分だけ表示し、全件は同じフォルダの「実行ログ.txt」に残す
+  実行中の計測値（所要時間・トークン・件/秒・残り時間）は「実行メトリクス.json / .prom」
+  再試行しても取れなかったJANは「再取得用JAN.csv」（そのままドロップして取り直せる）
 """
 
 import os
-import time
-import datetime
 import threading
 import traceback
 import ctypes
-import requests
-import pandas as pd
 import tkinter as tk
-from tkinter import messagebox, scrolledtext
+from tkinter import messagebox, scrolledtext, filedialog
 from tkinterdnd2 import TkinterDnD, DND_FILES
+from shared.gui_log import LogPump
+from keepa_cache import REFRESH_STALE, CACHE_MODE_LABELS
+from keepa_core import (
+    PriceLookup, load_input, journal_input_path, ensure_result_folder, save_classified,
+)
 
 # =========================
 # 設定
 # =========================
-DOMAIN_JP = 5
-MAX_SECONDS_ALLOWED = 10       # リクエストタイムアウト
-TOKEN_WAIT_SECONDS = 1800      # トークン枯渇時の待機（30分）
+TOKENS_PER_ITEM = 10           # トークン見込みの初期値（実績で自動補正）
+CONCURRENCY = 4                # 同時に投げるリクエスト数
+CACHE_TTL_HOURS = 24           # キャッシュの有効期限（時間）
+CACHE_MAX_ENTRIES = 1_000_000  # キャッシュ件数の上限（超えたら古い参照から削除）
+JOURNAL_NAME = "取得ジャーナル.jsonl"  # 結果フォルダ内の途中経過（再開用）
+LOG_NAME = "実行ログ.txt"          # 結果フォルダ内の全ログ（画面には末尾だけ残す）
+METRICS_NAME = "実行メトリクス"     # 結果フォルダ内の計測値（.json / .prom を定期更新）
+DEAD_LETTER_NAME = "再取得用JAN.csv"  # 再試行しても取れなかったJAN（次回の入力にそのまま使える）
 STOP_FLAG = False
 
 # =========================
@@ -52,185 +61,86 @@ def allow_sleep():
         pass
 
 # =========================
-# Keepa API
-# =========================
-def fetch_top_display_price(api_key: str, code: str):
-    """
-    価格決定ロジック（BuyBox > Prime > 先頭オファー）
-    戻り値: (title, total_price_or_None, error_message_or_None, hit_count)
-    """
-    url = (
-        f"https://api.keepa.com/product?key={api_key}"
-        f"&domain={DOMAIN_JP}&code={code}"
-        "&history=0&offers=20&onlyLiveOffers=0&buybox=1&stats=0"
-    )
-    start_time = time.time()
-
-    try:
-        resp = requests.get(url, timeout=MAX_SECONDS_ALLOWED)
-        if resp.status_code == 429:
-            return None, None, "トークン枯渇", 0
-        data = resp.json()
-    except Exception as e:
-        return None, None, f"通信エラー: {e}", 0
-
-    if time.time() - start_time > MAX_SECONDS_ALLOWED:
-        return None, None, f"処理時間超過（{MAX_SECONDS_ALLOWED}秒）", 0
-
-    if not data or "products" not in data:
-        return None, None, "データなし", 0
-
-    products = data["products"]
-    if not products:
-        return None, None, "商品が見つからない", 0
-
-    product = products[0]
-    title = product.get("title", "")
-    stats = product.get("stats") or {}
-
-    # ✅ BuyBox優先
-    for key in ("buyBoxPrice", "buyBoxShippingPrice", "current_BUY_BOX_SHIPPING"):
-        v = stats.get(key)
-        if isinstance(v, (int, float)) and v > 0:
-            return title, int(v), None, 0
-
-    # ✅ Prime優先 → なければ先頭
-    offers = product.get("offers") or []
-    order = product.get("liveOffersOrder") or []
-    ordered = [offers[i] for i in order if isinstance(i, int) and i < len(offers)]
-    if not ordered and offers:
-        ordered = offers
-
-    prime_offer = next((o for o in ordered if o.get("isPrime")), None)
-    chosen = prime_offer or (ordered[0] if ordered else None)
-
-    if chosen:
-        price = chosen.get("price")
-        ship = chosen.get("shipping") or 0
-        if price and price > 0:
-            total = int(price) + int(ship)
-            return title, total, None, len(offers)
-
-    hit_count = len(offers)
-    if hit_count > 0:
-        return title, None, f"価格取得失敗（{hit_count}件ヒット）", hit_count
-    else:
-        return title, None, "商品が見つからない", hit_count
-
-# =========================
-# 便利関数
+# メイン処理
 # =========================
-def ensure_result_folder():
-    desktop = os.path.join(os.path.expanduser("~"), "Desktop")
-    ts = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    folder = os.path.join(desktop, f"結果_{ts}")
-    os.makedirs(folder, exist_ok=True)
-    return folder
-
-def classify_and_save(df, result_folder):
+def run_keepa_then_align(api_key: str, jan_file_path: str, log: LogPump, start_button: tk.Button,
+                         cache_mode: str = REFRESH_STALE, resume_journal: str = None,
+                         concurrency: int = CONCURRENCY):
     """
-    df: 列(JANコード, 価格, 商品名, 備考)
-    価格を数値化して分類。3ファイル＋JAN整列結果.xlsx を保存
+    GUI から呼ぶ取得処理（本体は keepa_core.PriceLookup）。
+    resume_journal に前回の結果フォルダの取得ジャーナルを渡すと、
+    記録済みの行を飛ばして続きから取得し、同じフォルダへ出力する。
+    ログは log（gui_log.LogPump）に流し、結果フォルダの LOG_NAME にも全件残す。
+    ボタン・ダイアログはワーカーから触らず log.call で GUI スレッドに回す。
     """
-    df = df.copy()
-
-    rename_map = {}
-    for c in df.columns:
-        if "JAN" in str(c).upper():
-            rename_map[c] = "JANコード"
-    df.rename(columns=rename_map, inplace=True)
-
-    df["価格数値"] = pd.to_numeric(df["価格"], errors="coerce")
-
-    df_success = df[df["価格数値"].notna()].copy()
-    df_not_found = df[df["備考"].astype(str).str.contains("商品が見つからない", na=False)].copy()
-    df_fail = df[~df.index.isin(df_success.index) & ~df.index.isin(df_not_found.index)].copy()
-
-    for d in (df_success, df_fail, df_not_found):
-        if "価格数値" in d.columns:
-            d.drop(columns=["価格数値"], inplace=True)
-    df.drop(columns=["価格数値"], inplace=True)
-
-    df.to_excel(os.path.join(result_folder, "JAN整列結果.xlsx"), index=False)
-    df_success.to_excel(os.path.join(result_folder, "価格取得成功.xlsx"), index=False)
-    df_fail.to_excel(os.path.join(result_folder, "価格取得失敗.xlsx"), index=False)
-    df_not_found.to_excel(os.path.join(result_folder, "商品が見つからなかったもの.xlsx"), index=False)
-
-# =========================
-# メイン処理
-# =========================
-def run_keepa_then_align(api_key: str, jan_file_path: str, log_box: tk.Text, start_button: tk.Button):
     global STOP_FLAG
     STOP_FLAG = False
     prevent_sleep()
-    start_button.config(state="disabled")
+    log.call(start_button.config, state="disabled")
 
-    result_folder = ensure_result_folder()
+    if resume_journal:
+        result_folder = os.path.dirname(resume_journal)
+        journal_path = resume_journal
+        jan_file_path = journal_input_path(journal_path) or jan_file_path
+    else:
+        result_folder = ensure_result_folder()
+        journal_path = os.path.join(result_folder, JOURNAL_NAME)
 
     try:
-        df_in = pd.read_excel(jan_file_path, header=None)
+        rows, total = load_input(jan_file_path)
     except Exception as e:
-        messagebox.showerror("読込エラー", f"Excelファイルを開けませんでした。\n{e}")
-        start_button.config(state="normal")
+        log.call(messagebox.showerror, "読込エラー", f"JANファイルを開けませんでした。\n{e}")
+        log.call(start_button.config, state="normal")
         allow_sleep()
         return
 
-    df_in = df_in.iloc[:, :1].copy()
-    df_in.columns = ["JANコード"]
-    df_in["JANコード"] = df_in["JANコード"].astype(str).str.strip()
-    total = len(df_in)
-
-    log_box.insert(tk.END, f"📘 JANファイル読込: {jan_file_path}\n🔢 全{total}件の処理を開始します。\n\n")
-    log_box.see(tk.END)
-
-    results = []
+    log.spool_to(os.path.join(result_folder, LOG_NAME))
+    of_total = f"/{total}" if total is not None else ""      # 件数が分からない入力（xls など）は件数なしで表示
+    log(f"📘 JANファイル読込: {jan_file_path}\n🔢 全{total if total is not None else ''}件の処理を開始します。\n\n")
+
+    # ✅ 1件ごとにジャーナルへ追記（Excel は最後に1回だけ作る）
+    lookup = PriceLookup(
+        api_key, journal_path,
+        concurrency=concurrency,
+        cache_mode=cache_mode,
+        tokens_per_item=TOKENS_PER_ITEM,
+        cache_ttl_hours=CACHE_TTL_HOURS,
+        cache_max_entries=CACHE_MAX_ENTRIES,
+        keep_failed=True,
+        metrics_path=os.path.join(result_folder, METRICS_NAME),
+        dead_letter_path=os.path.join(result_folder, DEAD_LETTER_NAME),
+        log=log,
+        stop=lambda: STOP_FLAG,
+    )
 
     try:
-        for i, row in df_in.iterrows():
-            if STOP_FLAG:
-                log_box.insert(tk.END, "🛑 強制停止を検出 → 現在の結果を出力中...\n")
-                break
-
-            jan = str(row["JANコード"]).strip()
-            if not jan or jan.lower() == "nan":
-                continue
-
-            title, price, error, hit_count = fetch_top_display_price(api_key, jan)
-
-            if error:
-                if "トークン枯渇" in error:
-                    log_box.insert(tk.END, f"🪙 {i+1}/{total} {jan} → トークン枯渇。{TOKEN_WAIT_SECONDS//60}分待機。\n")
-                    log_box.see(tk.END)
-                    for sec in range(TOKEN_WAIT_SECONDS, 0, -1):
-                        if STOP_FLAG:
-                            break
-                        if sec % 60 == 0:
-                            log_box.insert(tk.END, f"⏳ 残り {sec//60} 分...\n")
-                            log_box.see(tk.END)
-                        time.sleep(1)
-                    if STOP_FLAG:
-                        break
-                    title, price, error, hit_count = fetch_top_display_price(api_key, jan)
-
-                elif "通信エラー" in error or "処理時間超過" in error:
-                    log_box.insert(tk.END, f"⚠️ {i+1}/{total} {jan} → {error} のためスキップ\n")
-                    log_box.see(tk.END)
-                    time.sleep(10)
-
-            results.append({
-                "JANコード": jan,
-                "価格": price if price is not None else "Null",
-                "商品名": title or "",
-                "備考": error or ""
-            })
-
-            log_box.insert(tk.END, f"🕐 {i+1}/{total} 件完了\n")
-            log_box.see(tk.END)
-
-        df_keepa = pd.DataFrame(results)
-        classify_and_save(df_keepa, result_folder)
-
-        messagebox.showinfo(
+        for record in lookup.run(rows, total, input_path=jan_file_path, resume=bool(resume_journal)):
+            log(f"🕐 {record['row']+1}{of_total} 件完了\n")
+
+        if lookup.stopped:
+            log("🛑 強制停止を検出 → 現在の結果を出力中...\n")
+
+        save_classified(journal_path, result_folder, lookup.metrics)
+        log(f"💽 キャッシュ利用 {lookup.cache_hits}件 / キャッシュ外 {lookup.cache_misses}件\n")
+        log(f"🪙 {lookup.token_report()}\n")
+        log(f"🧮 {lookup.dedup_report()}\n")
+        log(f"⏱ {lookup.metrics_report()}\n")
+        log(f"🔁 {lookup.retry_report()}\n")
+        if lookup.dead_letters:
+            log(f"♻️ 取れなかったJANは {DEAD_LETTER_NAME} に出力しました（そのままドロップで再取得できます）。\n")
+        if lookup.stopped:
+            log(f"↩ 続きは「再開」で {journal_path} を選択してください。\n")
+            log.call(
+                messagebox.showinfo,
+                "中断",
+                "処理を中断しました。\n途中までの結果を出力しました。\n\n"
+                f"📂 保存先フォルダ：\n{result_folder}\n\n"
+                f"↩ 続きは「再開」で {JOURNAL_NAME} を選択してください。"
+            )
+            return
+
+        log.call(
+            messagebox.showinfo,
             "完了",
             "処理が完了しました！\n\n"
             f"📂 保存先フォルダ：\n{result_folder}\n\n"
@@ -242,11 +152,12 @@ def run_keepa_then_align(api_key: str, jan_file_path: str, log_box: tk.Text, sta
         )
 
     except Exception as e:
-        log_box.insert(tk.END, f"⚠️ エラー発生: {e}\n{traceback.format_exc()}")
-        messagebox.showerror("エラー", f"処理中に問題が発生しました。\n{e}")
+        log(f"⚠️ エラー発生: {e}\n{traceback.format_exc()}")
+        log.call(messagebox.showerror, "エラー", f"処理中に問題が発生しました。\n{e}")
 
     finally:
-        start_button.config(state="normal")
+        log.spool_to(None)
+        log.call(start_button.config, state="normal")
         allow_sleep()
 
 # =========================
@@ -256,7 +167,7 @@ class App:
     def __init__(self):
         self.root = TkinterDnD.Tk()
         self.root.title("Amazon価格取得ツール（Keepa API使用）")
-        self.root.geometry("560x490")
+        self.root.geometry("560x520")
         self.root.configure(bg="#f5f0e6")
         self.root.resizable(False, False)
 
@@ -269,7 +180,7 @@ class App:
 
         self.drop_frame = tk.Label(
             self.root,
-            text="⬇️ ここにExcel（JAN1列）を1つドロップ ⬇️",
+            text="⬇️ ここにJANリスト（Excel / CSV / TXT の1列目）を1つドロップ ⬇️",
             bg="#ffffff", fg="#444",
             relief="ridge", width=62, height=4
         )
@@ -285,12 +196,19 @@ class App:
 
         api_row = tk.Frame(self.root, bg="#f5f0e6")
         api_row.pack(pady=(2, 2))
-        tk.Label(api_row, text="Keepa APIキー：", bg="#f5f0e6",
+        tk.Label(api_row, text="Keepa APIキー（複数可・カンマ区切り）：", bg="#f5f0e6",
                  font=("Meiryo", 10, "bold")).pack(side="left")
-        self.api_entry = tk.Entry(api_row, width=50, show="*")
+        self.api_entry = tk.Entry(api_row, width=40, show="*")
         self.api_entry.pack(side="left", padx=(4, 0))
         self.api_entry.bind("<Return>", self.try_auto_start)
 
+        cache_row = tk.Frame(self.root, bg="#f5f0e6")
+        cache_row.pack(pady=(2, 2))
+        tk.Label(cache_row, text="キャッシュ：", bg="#f5f0e6",
+                 font=("Meiryo", 10, "bold")).pack(side="left")
+        self.cache_mode = tk.StringVar(value=next(iter(CACHE_MODE_LABELS)))
+        tk.OptionMenu(cache_row, self.cache_mode, *CACHE_MODE_LABELS).pack(side="left", padx=(4, 0))
+
         frame_log = tk.Frame(self.root, bg="#f5f0e6")
         frame_log.pack(padx=10, pady=(6, 0), fill="both", expand=True)
         self.log_box = tk.Text(frame_log, height=13, width=70, font=("Meiryo", 9))
@@ -298,6 +216,8 @@ class App:
         scrollbar = tk.Scrollbar(frame_log, command=self.log_box.yview)
         scrollbar.pack(side="right", fill="y")
         self.log_box.config(yscrollcommand=scrollbar.set)
+        self.log = LogPump(self.log_box)
+        self.log.start()
 
         btn_row = tk.Frame(self.root, bg="#f5f0e6")
         btn_row.pack(pady=8)
@@ -313,12 +233,19 @@ class App:
         )
         self.stop_button.pack(side="left", padx=10)
 
+        self.resume_button = tk.Button(
+            btn_row, text="↩ 再開", bg="#5b8def", fg="white",
+            font=("Meiryo", 10, "bold"), width=10, command=self.resume
+        )
+        self.resume_button.pack(side="left", padx=10)
+
         self.jan_file_path = None
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def on_close(self):
         if messagebox.askyesno("確認", "本当に終了しますか？"):
             allow_sleep()
+            self.log.stop()
             self.root.destroy()
 
     def on_drop(self, event):
@@ -327,8 +254,7 @@ class App:
             return
         self.jan_file_path = files[0]
         self.file_label.config(text=self.jan_file_path)
-        self.log_box.insert(tk.END, "✅ ファイルを受け取りました。\n")
-        self.log_box.see(tk.END)
+        self.log("✅ ファイルを受け取りました。\n")
         self.api_entry.focus_set()
 
     def ready_to_start(self):
@@ -336,8 +262,7 @@ class App:
 
     def try_auto_start(self, _evt=None):
         if self.ready_to_start():
-            self.log_box.insert(tk.END, "🚀 APIキー入力を検知 → 自動開始します。\n")
-            self.log_box.see(tk.END)
+            self.log("🚀 APIキー入力を検知 → 自動開始します。\n")
             self.start_thread()
 
     def manual_start(self):
@@ -354,15 +279,33 @@ class App:
         api_key = self.api_entry.get().strip()
         threading.Thread(
             target=run_keepa_then_align,
-            args=(api_key, self.jan_file_path, self.log_box, self.start_button),
+            args=(api_key, self.jan_file_path, self.log, self.start_button,
+                  CACHE_MODE_LABELS[self.cache_mode.get()]),
+            daemon=True
+        ).start()
+
+    def resume(self):
+        if not self.api_entry.get().strip():
+            messagebox.showwarning("注意", "Keepa APIキーを入力してください。")
+            self.api_entry.focus_set()
+            return
+        journal_path = filedialog.askopenfilename(
+            title=f"再開する結果フォルダの {JOURNAL_NAME} を選択",
+            filetypes=[("ジャーナル", "*.jsonl")]
+        )
+        if not journal_path:
+            return
+        threading.Thread(
+            target=run_keepa_then_align,
+            args=(self.api_entry.get().strip(), self.jan_file_path, self.log, self.start_button,
+                  CACHE_MODE_LABELS[self.cache_mode.get()], journal_path),
             daemon=True
         ).start()
 
     def force_stop(self):
         global STOP_FLAG
         STOP_FLAG = True
-        self.log_box.insert(tk.END, "\n🛑 強制終了ボタンが押されました。\n")
-        self.log_box.see(tk.END)
+        self.log("\n🛑 強制終了ボタンが押されました。\n")
 
     def run(self):
         self.root.mainloop()
@@ -0,0 +1,135 @@
+# coding: utf-8
+"""
+価格決定のベンチマーク（APIは呼ばない）
+
+従来の1商品ずつ dict をたどる方式と、keepa_price の1商品ずつの方式（display_price_tuples）・
+配列方式（decode_products → select_prices → to_tuples）を
+同じ疑似データ（100件 / 10,000件 / 100,000件）で比べる。結果が一致することも確認する。
+倍率は従来方式の秒数 ÷ それぞれの秒数（1 より大きければ速い）。
+
+    python bench_keepa_price.py
+    python bench_keepa_price.py --sizes 100 10000 100000 --repeat 3
+"""
+
+import argparse
+import random
+import time
+
+from keepa_price import decode_products, display_price_tuples, select_prices
+
+
+# =========================
+# 従来方式（1商品ずつ）
+# =========================
+def legacy_select_display_price(product):
+    """
+    以前の select_display_price（BuyBox > Prime > 先頭オファー）。
+    比較のためそのまま残している。
+    """
+    title = product.get("title", "")
+    stats = product.get("stats") or {}
+
+    for key in ("buyBoxPrice", "buyBoxShippingPrice", "current_BUY_BOX_SHIPPING"):
+        v = stats.get(key)
+        if isinstance(v, (int, float)) and v > 0:
+            return title, int(v), None, 0
+
+    offers = product.get("offers") or []
+    order = product.get("liveOffersOrder") or []
+    ordered = [offers[i] for i in order if isinstance(i, int) and i < len(offers)]
+    if not ordered and offers:
+        ordered = offers
+
+    prime_offer = next((o for o in ordered if o.get("isPrime")), None)
+    chosen = prime_offer or (ordered[0] if ordered else None)
+
+    if chosen:
+        price = chosen.get("price")
+        ship = chosen.get("shipping") or 0
+        if price and price > 0:
+            total = int(price) + int(ship)
+            return title, total, None, len(offers)
+
+    hit_count = len(offers)
+    if hit_count > 0:
+        return title, None, f"価格取得失敗（{hit_count}件ヒット）", hit_count
+    else:
+        return title, None, "商品が見つからない", hit_count
+
+
+# =========================
+# 疑似データ
+# =========================
+def make_products(n, seed=0):
+    """
+    Keepa の products に似た疑似データ。
+    約6割に BuyBox、残りは0〜20件のオファー（offerCSV と price/shipping の両方を持つ）。
+    """
+    rnd = random.Random(seed)
+    products = []
+    for k in range(n):
+        product = {"title": f"商品{k}", "stats": {}}
+        if rnd.random() < 0.6:
+            product["stats"] = {"buyBoxPrice": rnd.randint(300, 30000), "buyBoxShipping": 0}
+        offers = []
+        for _ in range(rnd.choice((0, 1, 3, 5, 10, 20))):
+            price = rnd.choice((-1, rnd.randint(300, 30000)))
+            shipping = rnd.choice((0, 0, 350, 500))
+            offers.append({
+                "offerCSV": [rnd.randint(1, 9_000_000), price, shipping],
+                "price": price,
+                "shipping": shipping,
+                "isPrime": rnd.random() < 0.3,
+            })
+        if offers:
+            product["offers"] = offers
+            live = list(range(len(offers)))
+            rnd.shuffle(live)
+            product["liveOffersOrder"] = live[:max(1, len(live) * 3 // 4)]
+        products.append(product)
+    return products
+
+
+# =========================
+# 計測
+# =========================
+def _best(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def run(sizes, repeat):
+    print(f"{'件数':>8} {'従来(秒)':>10} {'1件ずつ(秒)':>11} {'倍率':>6} "
+          f"{'展開(秒)':>10} {'決定(秒)':>10} {'変換(秒)':>10} {'配列計(秒)':>10} {'倍率':>6}")
+    for n in sizes:
+        products = make_products(n)
+
+        t_legacy, legacy = _best(lambda: [legacy_select_display_price(p) for p in products], repeat)
+        t_scalar, scalar = _best(lambda: display_price_tuples(products), repeat)
+        t_decode, arrays = _best(lambda: decode_products(products), repeat)
+        t_select, columns = _best(lambda: select_prices(arrays), repeat)
+        t_tuples, vector = _best(columns.to_tuples, repeat)
+
+        if scalar != legacy or vector != legacy:
+            raise SystemExit(f"❌ {n}件: 従来方式と結果が一致しません")
+
+        t_vector = t_decode + t_select + t_tuples
+        print(f"{n:>8} {t_legacy:>10.4f} {t_scalar:>11.4f} {t_legacy / t_scalar:>5.1f}x "
+              f"{t_decode:>10.4f} {t_select:>10.4f} {t_tuples:>10.4f} {t_vector:>10.4f} "
+              f"{t_legacy / t_vector:>5.1f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="価格決定のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+    run(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
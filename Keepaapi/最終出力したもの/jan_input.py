@@ -0,0 +1,198 @@
+# coding: utf-8
+"""
+JAN リストの読み込み（先頭から1行ずつ・全体をメモリに載せない）
+
+    for row, jan in iter_jans("JAN.xlsx"):
+        ...
+
+・.xlsx / .xlsm … openpyxl の read_only モードで1列目を順に読む
+・.csv          … csv モジュールで1列目を順に読む（UTF-8 / BOM付き / CP932）
+・.txt など     … 1行1JAN のファイルを mmap で読む
+・.xls          … 旧形式は pandas で読む（ストリーミング不可）
+
+row は元ファイルの行番号（0始まり）。空行は飛ばすが行番号は元の位置のまま。
+
+normalize_jan() は Excel で崩れたJAN（4.9012345e+12、4901234567894.0、先頭ゼロ落ち（7桁 / 12桁）、
+全角数字やハイフン入り）を 8桁 / 13桁 に戻し、チェックディジットを確かめる。
+"""
+
+import csv
+import io
+import mmap
+import os
+import unicodedata
+from decimal import Decimal, InvalidOperation
+
+# =========================
+# 設定
+# =========================
+EXCEL_EXTS = (".xlsx", ".xlsm")
+CSV_EXTS = (".csv",)
+LEGACY_EXCEL_EXTS = (".xls",)
+CSV_ENCODINGS = ("utf-8-sig", "cp932")
+
+
+def cell_text(value):
+    """セルの値 → JAN 文字列（数値セルの 4901234567894.0 なども整数の文字列に戻す）"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if value != value:          # NaN
+            return ""
+        if value.is_integer():
+            return str(int(value))
+        return repr(value)
+    text = str(value).strip()
+    return "" if text.lower() == "nan" else text
+
+
+# =========================
+# JAN の正規化
+# =========================
+def check_digit_ok(code):
+    """JAN / EAN（8桁・13桁）のチェックディジットが正しいか"""
+    if not code.isdigit() or len(code) < 2:
+        return False
+    body = code[:-1]
+    total = sum(int(d) * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(body)))
+    return (10 - total % 10) % 10 == int(code[-1])
+
+def normalize_jan(value):
+    """
+    セルの値 → (JAN, 問題)。
+    問題が None なら 8桁 / 13桁 でチェックディジットの正しいJAN。
+    そうでなければ問題の内容（"数字以外" / "桁数不正" / "指数表記で桁落ち" / "チェックディジット不一致"）。
+    """
+    text = unicodedata.normalize("NFKC", cell_text(value))
+    text = text.replace("-", "").replace(" ", "")
+    if not text:
+        return "", "空"
+
+    exponent = False
+    if not text.isdigit():
+        # 4.9012345e+12 / 4901234567894.0 のような数値表記
+        try:
+            number = Decimal(text)
+        except InvalidOperation:
+            return text, "数字以外"
+        if not number.is_finite() or number < 0 or number != number.to_integral_value():
+            return text, "数字以外"
+        exponent = "e" in text.lower()
+        text = str(int(number))
+
+    # GTIN-14 の先頭ゼロ
+    if len(text) == 14 and text[0] == "0":
+        text = text[1:]
+    # Excel で落ちる先頭ゼロは1桁だけ（UPC-A の12桁も同じ）。それより短いものは補わない
+    # （短い数字を0で埋めるとチェックディジットが偶然合うことがあるため）
+    if len(text) in (7, 12):
+        text = "0" + text
+    if len(text) not in (8, 13):
+        return text, "桁数不正"
+    if check_digit_ok(text):
+        return text, None
+    return text, "指数表記で桁落ち" if exponent else "チェックディジット不一致"
+
+
+# =========================
+# 形式ごとの読み込み
+# =========================
+def _iter_xlsx(path):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        for row, values in enumerate(ws.iter_rows(min_col=1, max_col=1, values_only=True)):
+            yield row, cell_text(values[0] if values else None)
+    finally:
+        wb.close()
+
+def _detect_encoding(path):
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    for encoding in CSV_ENCODINGS:
+        try:
+            head.decode(encoding)
+            return encoding
+        except UnicodeDecodeError as e:
+            # 読んだ範囲の末尾で文字が切れただけなら、その手前まで読めていればよい
+            if e.start >= len(head) - 3:
+                return encoding
+    return CSV_ENCODINGS[-1]
+
+def _iter_csv(path):
+    with open(path, newline="", encoding=_detect_encoding(path), errors="replace") as f:
+        for row, values in enumerate(csv.reader(f)):
+            yield row, cell_text(values[0] if values else None)
+
+def _iter_lines(path):
+    if os.path.getsize(path) == 0:
+        return
+    encoding = _detect_encoding(path)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for row, line in enumerate(iter(mm.readline, b"")):
+            text = line.decode(encoding, errors="replace").strip()
+            if "," in text or "\t" in text:
+                # 「JAN,商品名」のような行は1列目だけ使う
+                text = text.split(",", 1)[0].split("\t", 1)[0].strip()
+            yield row, "" if text.lower() == "nan" else text
+
+def _iter_legacy_excel(path):
+    import pandas as pd
+
+    df = pd.read_excel(path, header=None, usecols=[0])
+    for row, value in enumerate(df.iloc[:, 0].tolist()):
+        yield row, cell_text(value)
+
+
+def _reader(path):
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext in EXCEL_EXTS:
+        return _iter_xlsx
+    if ext in LEGACY_EXCEL_EXTS:
+        return _iter_legacy_excel
+    if ext in CSV_EXTS:
+        return _iter_csv
+    return _iter_lines
+
+
+# =========================
+# 公開
+# =========================
+def iter_jans(path):
+    """(行番号, JAN) を先頭から順に返す（空行は飛ばす）"""
+    for row, jan in _reader(path)(path):
+        if jan:
+            yield row, jan
+
+def count_rows(path):
+    """
+    進捗表示用の行数（目安）。
+    xlsx はシートの範囲情報、txt / csv は改行の数から求め、ファイル全体は読み込まない。
+    """
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext in EXCEL_EXTS:
+        from openpyxl import load_workbook
+
+        wb = load_workbook(path, read_only=True)
+        try:
+            return wb.worksheets[0].max_row
+        finally:
+            wb.close()
+    if ext in LEGACY_EXCEL_EXTS:
+        return None
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        lines = 0
+        for start in range(0, size, io.DEFAULT_BUFFER_SIZE * 256):
+            lines += mm[start:start + io.DEFAULT_BUFFER_SIZE * 256].count(b"\n")
+        if mm[size - 1:size] != b"\n":
+            lines += 1
+        return lines
@@ -0,0 +1,395 @@
+# coding: utf-8
+"""
+Keepa API 呼び出し共通部分（2_Keepa価格調査提出分.py / 3.Keepa統合実験.py から利用）
+
+・/product の code= には最大100件のJANをカンマ区切りで渡せるため、
+  JANをまとめて1リクエストで問い合わせる
+・返ってきた商品は eanList / upcList で元のJANに対応付け、
+  レスポンスに含まれなかったJANは「商品が見つからない」とする
+・価格は keepa_price で1レスポンス分の商品をまとめて決める
+
+・iter_fetched_chunks() は接続を使い回すセッションとスレッドプールで
+  複数の塊を同時に問い合わせ、入力順のまま結果を返す
+  （処理時間超過・5xx・トークン枯渇などは keepa_retry.RetryQueue で時間をおいて取り直す）
+
+・問い合わせは2段階（PLAN_TIERED）:
+    1. stats + buybox だけの安い問い合わせ（オファーなし）で BuyBox 価格を決める
+    2. BuyBox が無く価格が決まらなかったJANだけ offers=20 で取り直す
+  PLAN_OFFERS を指定すると従来どおり最初から offers=20 で1回だけ問い合わせる
+
+結果タプルは従来どおり (title, total_price_or_None, error_message_or_None, hit_count)
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from keepa_cache import CACHE_ONLY, REFRESH_STALE
+from keepa_price import display_price_tuples, buybox_price_tuples, product_times
+from keepa_retry import RetryQueue, RETRY_POLICIES, classify_error
+from keepa_tokens import KeyPool
+from shared.run_metrics import timed
+
+# =========================
+# 設定
+# =========================
+DOMAIN_JP = 5
+# 環境変数で差し替え可能（ローカルのシミュレータ bench/api_simulator.py で計測するとき等）
+KEEPA_API_URL = os.environ.get("KEEPA_API_URL", "https://api.keepa.com/product")
+MAX_CODES_PER_REQUEST = 100    # Keepa /product の code= 上限
+MAX_SECONDS_ALLOWED = 10       # 1件あたりのタイムアウト
+BATCH_TIMEOUT_SECONDS = 60     # まとめ取得時のタイムアウト
+DEFAULT_CONCURRENCY = 4        # 同時に投げるリクエスト数の既定値
+AUTH_ERROR_STATUS = (401, 402, 403)    # キー無効・契約切れ
+# 入力が途切れたときの合図（行番号 None の行）。これが来たら100件に満たなくても今ある分で塊を送る
+# （キューから読む入力のように、次の行がいつ来るか分からない場合に使う）
+FLUSH = (None, None)
+PAUSED_WAIT_SECONDS = 1.0      # FLUSH の後、投げた塊が終わるのを待つ最長秒数（過ぎたら入力の続きを見る）
+
+# 問い合わせの段（TokenScheduler の kind としても使う）
+TIER_BUYBOX = "buybox"
+TIER_OFFERS = "offers"
+TIER_PARAMS = {
+    TIER_BUYBOX: {"history": 0, "stats": 1, "buybox": 1},
+    TIER_OFFERS: {"history": 0, "stats": 0, "offers": 20, "onlyLiveOffers": 0},
+}
+# 段ごとの1件あたりトークン見込み（初期値。実績で自動補正）
+TIER_TOKENS_PER_ITEM = {
+    TIER_BUYBOX: 3,     # 1 + buybox 2
+    TIER_OFFERS: 13,    # 1 + オファー10件ごとに6
+}
+
+PLAN_TIERED = "tiered"         # BuyBox → 決まらなかった分だけオファー
+PLAN_OFFERS = "offers"         # 最初からオファー付き（従来の問い合わせ）
+QUERY_PLANS = (PLAN_TIERED, PLAN_OFFERS)
+
+
+# =========================
+# 価格決定ロジック（本体は keepa_price）
+# =========================
+def select_display_prices(products):
+    """
+    価格決定ロジック（BuyBox > Prime > 先頭オファー）を products にまとめて適用する。
+    戻り値: 結果タプル (title, total_price_or_None, error_message_or_None, hit_count) のリスト
+    1レスポンス（最大100件）ごとに呼ぶので、配列方式（keepa_price.display_prices）ではなく
+    1商品ずつの方式を使う（配列への展開と戻しの分だけ遅くなるため。bench_keepa_price.py 参照）
+    """
+    return display_price_tuples(products)
+
+def select_buybox_prices(products):
+    """BuyBox（送料込み）だけで決める。決められない商品は None"""
+    return buybox_price_tuples(products)
+
+
+# =========================
+# JAN ⇔ 商品の対応付け
+# =========================
+def _code_key(code):
+    """先頭ゼロの有無（EAN-13 / UPC-12）を吸収した照合キー"""
+    return str(code).strip().lstrip("0")
+
+def _product_code_keys(product):
+    keys = set()
+    for field in ("eanList", "upcList"):
+        for c in product.get(field) or []:
+            keys.add(_code_key(c))
+    return keys
+
+
+# =========================
+# Keepa API
+# =========================
+def make_session(pool_size=DEFAULT_CONCURRENCY):
+    """TCP/TLS 接続を使い回すセッション（同時接続数 = pool_size）"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def fetch_top_display_prices(api_key: str, codes, domain=DOMAIN_JP, scheduler=None,
+                              cache=None, cache_mode=REFRESH_STALE, session=None, plan=PLAN_TIERED,
+                              metrics=None, history=None):
+    """
+    最大100件のJANを取得する（plan=PLAN_TIERED なら BuyBox → オファーの2段階）。
+    scheduler（keepa_tokens.TokenScheduler）を渡すと、必要なトークンが貯まるまで
+    待ってから問い合わせ、レスポンスの残トークン情報でモデルを補正する。
+    keepa_tokens.KeyPool を渡した場合は api_key の代わりにプールのキーを使い分ける。
+    cache（keepa_cache.PriceCache）を渡すと、cache_mode に従ってキャッシュ済みの
+    JANはAPIに問い合わせず、取得した確定結果はキャッシュへ書き込む。
+    session を渡すとその接続プールを使う（省略時は毎回新しい接続）。
+    metrics（run_metrics.RunMetrics）を渡すと、段ごとの所要時間・HTTP ステータスと
+    キャッシュの読み書きにかかった時間を記録する。
+    キャッシュには商品の lastUpdate / lastPriceChange も一緒に保存する（差分更新の判定用）。
+    history（keepa_history.HistoryStore）を渡すと history=1 で問い合わせ、APIから取得した
+    商品の価格履歴を保存する（キャッシュから返したJANの履歴は取り直さない）。
+    戻り値: codes と同じ順序の結果タプルのリスト（待機中に停止された場合は「中断」）
+    """
+    codes = [str(c).strip() for c in codes]
+    if not codes:
+        return []
+    if len(codes) > MAX_CODES_PER_REQUEST:
+        raise ValueError(f"code は最大{MAX_CODES_PER_REQUEST}件までです（{len(codes)}件）")
+
+    if cache is None:
+        return _plan_prices(api_key, codes, domain, scheduler, session, plan, metrics, history=history)
+
+    with timed(metrics, "cache_read"):
+        served, missing = cache.lookup(codes, domain, cache_mode)
+    if missing and cache_mode == CACHE_ONLY:
+        served.update((code, (None, None, "キャッシュなし", 0)) for code in missing)
+    elif missing:
+        missing = list(dict.fromkeys(missing))
+        times = {}
+        fetched = _plan_prices(api_key, missing, domain, scheduler, session, plan, metrics, times, history)
+        with timed(metrics, "cache_write"):
+            cache.put_many(zip(missing, fetched), domain, times)
+        served.update(zip(missing, fetched))
+    return [served[code] for code in codes]
+
+def _plan_prices(api_key, codes, domain, scheduler, session, plan, metrics=None, times=None, history=None):
+    """キャッシュを通さずに問い合わせる（plan に従って1〜2段。履歴は1段目でだけ取る）"""
+    if plan == PLAN_OFFERS:
+        return _request_prices(api_key, codes, domain, scheduler, session, TIER_OFFERS,
+                               metrics=metrics, times=times, history=history)
+
+    # 1段目: BuyBox だけ（決まらなかったJANは None）
+    results = _request_prices(api_key, codes, domain, scheduler, session, TIER_BUYBOX,
+                              select=select_buybox_prices, metrics=metrics, times=times, history=history)
+    undecided = [k for k, r in enumerate(results) if r is None]
+    if undecided:
+        # 2段目: 決まらなかったJANだけオファー付きで
+        fetched = _request_prices(api_key, [codes[k] for k in undecided], domain,
+                                  scheduler, session, TIER_OFFERS, metrics=metrics, times=times)
+        for k, r in zip(undecided, fetched):
+            results[k] = r
+    return results
+
+def _reserve(api_key, scheduler, n_items, tier):
+    """
+    トークンを予約する。
+    戻り値: (使うキー, 補正に使う TokenScheduler, 予約したトークン数)。停止したら None
+    """
+    if scheduler is None:
+        return api_key, None, 0
+    if isinstance(scheduler, KeyPool):
+        return scheduler.acquire(n_items, tier)
+    reserved = scheduler.acquire(n_items, tier)
+    return None if reserved is None else (api_key, scheduler, reserved)
+
+def _request_prices(api_key, codes, domain, scheduler, session=None, tier=TIER_OFFERS,
+                    select=select_display_prices, metrics=None, times=None, history=None):
+    """
+    /product へ1リクエスト送る（tier で問い合わせ内容を切り替える）。
+    metrics には tier を段の名前として所要時間と HTTP ステータスを記録する。
+    times（dict）を渡すと、見つかった商品の {JAN: (lastUpdate, lastPriceChange)} を書き込む。
+    history（keepa_history.HistoryStore）を渡すと history=1・days=history.days で問い合わせ、
+    見つかった商品の価格履歴を追記する（トークン消費は変わらない）。
+    見つかった商品は select(商品のリスト) の戻り値、見つからないJANは「商品が見つからない」。
+    """
+    pool = scheduler if isinstance(scheduler, KeyPool) else None
+    if pool is not None and not pool.available():
+        return [(None, None, "APIキー無効", 0)] * len(codes)
+
+    reservation = _reserve(api_key, scheduler, len(codes), tier)
+    if reservation is None:
+        return [(None, None, "中断", 0)] * len(codes)
+    api_key, scheduler, reserved = reservation
+
+    params = {
+        "key": api_key,
+        "domain": domain,
+        "code": ",".join(codes),
+        **TIER_PARAMS[tier],
+    }
+    if history is not None:
+        params.update(history=1, days=history.days)
+    timeout = MAX_SECONDS_ALLOWED if len(codes) == 1 else BATCH_TIMEOUT_SECONDS
+
+    data = None
+    try:
+        with timed(metrics, tier) as timer:
+            resp = (session or requests).get(KEEPA_API_URL, params=params, timeout=timeout)
+            timer.status = resp.status_code
+        if resp.status_code in AUTH_ERROR_STATUS:
+            if scheduler is not None:
+                scheduler.update(None, reserved, kind=tier)
+            if pool is not None:
+                # 他のキーで取り直す
+                pool.disable(api_key, f"HTTP {resp.status_code}")
+                return _request_prices(None, codes, domain, pool, session, tier, select, metrics, times,
+                                       history)
+            return [(None, None, f"APIキー無効（HTTP {resp.status_code}）", 0)] * len(codes)
+        if resp.status_code == 429:
+            if scheduler is not None:
+                try:
+                    data = resp.json()
+                except ValueError:
+                    pass
+                scheduler.update(data, reserved, kind=tier)
+                scheduler.throttled()
+            return [(None, None, "トークン枯渇", 0)] * len(codes)
+        if resp.status_code >= 500:
+            if scheduler is not None:
+                scheduler.update(None, reserved, kind=tier)
+            return [(None, None, f"サーバエラー（HTTP {resp.status_code}）", 0)] * len(codes)
+        data = resp.json()
+    except requests.exceptions.Timeout:
+        if scheduler is not None:
+            scheduler.update(None, reserved, kind=tier)
+        return [(None, None, f"処理時間超過（{timeout}秒）", 0)] * len(codes)
+    except ValueError:
+        # JSON として読めない応答（途中で切れた・HTML のエラーページ等）
+        if scheduler is not None:
+            scheduler.update(None, reserved, kind=tier)
+        return [(None, None, "応答解析エラー", 0)] * len(codes)
+    except Exception as e:
+        if scheduler is not None:
+            scheduler.update(None, reserved, kind=tier)
+        return [(None, None, f"通信エラー: {e}", 0)] * len(codes)
+
+    if scheduler is not None:
+        scheduler.update(data, reserved, len(codes), kind=tier)
+
+    if not data or "products" not in data:
+        return [(None, None, "データなし", 0)] * len(codes)
+
+    # 商品 → JAN の対応表（同じJANに複数商品が返った場合は先頭を採用）
+    products = data["products"] or []
+    by_code = {}
+    for product in products:
+        for key in _product_code_keys(product):
+            by_code.setdefault(key, product)
+    # 1件問い合わせで eanList が無い商品は、そのまま問い合わせたJANの商品とみなす
+    if len(codes) == 1 and products and not by_code:
+        by_code[_code_key(codes[0])] = products[0]
+
+    matched = [by_code.get(_code_key(code)) for code in codes]
+    if times is not None:
+        times.update((code, product_times(p)) for code, p in zip(codes, matched) if p is not None)
+    if history is not None:
+        for code, product in zip(codes, matched):
+            if product is not None:
+                history.add_product(code, product)
+    selected = iter(select([p for p in matched if p is not None]))
+    return [
+        (None, None, "商品が見つからない", 0) if product is None else next(selected)
+        for product in matched
+    ]
+
+# =========================
+# 並列取得
+# =========================
+def iter_fetched_chunks(api_key: str, rows, concurrency=DEFAULT_CONCURRENCY, domain=DOMAIN_JP,
+                        scheduler=None, cache=None, cache_mode=REFRESH_STALE,
+                        log=None, stop=None, plan=PLAN_TIERED, metrics=None, retry=None, history=None):
+    """
+    rows: (行番号, JAN) の並び。100件ずつの塊を最大 concurrency 本同時に問い合わせ、
+    (塊, 結果タプルのリスト) を返す。rows に FLUSH が来たら、そこまでの分を100件未満でも送る。
+    retry（keepa_retry.RetryQueue）で再試行するエラーのJANはその場では返さず、
+    待ち時間が過ぎたら次の塊の先頭に混ぜて取り直す（待っている間もほかのJANは進む）。
+    再試行を使い切ったJANは最後のエラーのまま返す。そのため再試行したJANは入力順より後に出る。
+    retry を省略した場合はトークン枯渇だけを取り直す（scheduler があるとき）。
+    history（keepa_history.HistoryStore）を渡すと取得した商品の価格履歴も保存する。
+    stop() が真になったら新しい塊は投げず、取り終えていた塊を返してから終了する。
+    途中でやめたときは scheduler.halt() で補充待ちの問い合わせも打ち切る（scheduler はその後使えない）。
+    """
+    log = log or (lambda text: None)
+    stop = stop or (lambda: False)
+    concurrency = max(1, int(concurrency))
+    if retry is None and scheduler is not None:
+        retry = RetryQueue({"throttled": RETRY_POLICIES["throttled"]})
+    session = make_session(concurrency)
+    rows = iter(rows)
+    rows_left = True
+    paused = False                 # 直前に FLUSH で戻った（入力の続きがまだ来ていない）
+
+    def task(chunk):
+        codes = [jan for _, jan in chunk]
+        return chunk, fetch_top_display_prices(api_key, codes, domain, scheduler, cache, cache_mode, session,
+                                               plan, metrics, history)
+
+    def next_chunk():
+        """期限の来た再試行分 + 新しい行 で最大100件"""
+        nonlocal rows_left, paused
+        chunk = retry.pop_due(MAX_CODES_PER_REQUEST) if retry is not None else []
+        paused = False
+        while rows_left and len(chunk) < MAX_CODES_PER_REQUEST:
+            row = next(rows, None)
+            if row is None:
+                rows_left = False
+            elif row[0] is None:
+                paused = True              # FLUSH
+                break
+            else:
+                chunk.append(row)
+        return chunk
+
+    def defer(chunk, fetched):
+        """再試行に回したJANを除いた (塊, 結果)"""
+        if retry is None:
+            return chunk, fetched
+        kept, kept_results, deferred = [], [], {}
+        for (i, jan), result in zip(chunk, fetched):
+            delay = retry.schedule(i, jan, result[2]) if result[2] else None
+            if delay is None:
+                kept.append((i, jan))
+                kept_results.append(result)
+            else:
+                deferred.setdefault(classify_error(result[2]), []).append(delay)
+        for kind, delays in deferred.items():
+            log(f"🔁 {chunk[0][0]+1}行目〜 {len(delays)}件 → {kind} のため {min(delays):.0f}秒後から再試行します。\n")
+            if metrics is not None:
+                metrics.add(f"retry_{kind}", len(delays))
+        return kept, kept_results
+
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            try:
+                while True:
+                    # 投げている塊が concurrency 本になるまで補充する。
+                    # 先頭の塊が終わっていたら、入力の続きを読みに行く前に返す
+                    # （キューから読む入力だと、次の行か FLUSH が来るまで待たされるため）
+                    while len(pending) < concurrency and not stop() and not (pending and pending[0].done()):
+                        chunk = next_chunk()
+                        if not chunk:
+                            break
+                        pending.append(pool.submit(task, chunk))
+                        if paused:
+                            break          # 入力が途切れている。続きを読む前に投げた塊を待つ
+                    if not pending:
+                        if rows_left and not stop():
+                            continue       # FLUSH で戻っただけ（入力の続きを待つ）
+                        # 新しい行は尽きた。再試行待ちがあれば期限まで待つ
+                        due_in = retry.next_due_in() if retry is not None else None
+                        if due_in is None or stop():
+                            break
+                        time.sleep(min(due_in, 1.0))
+                        continue
+                    if paused and rows_left and len(pending) < concurrency and not pending[0].done():
+                        # 入力が途切れている間は入力を読みに行かず、どれかの塊が終わるのを待つ
+                        # （先頭が終わればすぐ返し、ほかが終われば空いた枠のために入力の続きを見る）
+                        wait(pending, timeout=PAUSED_WAIT_SECONDS, return_when=FIRST_COMPLETED)
+                        if not pending[0].done():
+                            paused = False
+                            continue
+                    chunk, fetched = pending.popleft().result()
+                    chunk, fetched = defer(chunk, fetched)
+                    if chunk:
+                        yield chunk, fetched       # トークンを使った分は stop() でも捨てずに返す
+                    if stop():
+                        break
+            finally:
+                # 途中でやめる（stop・Ctrl+C・例外）ときは、プールの終了待ちより前に
+                # トークンの補充待ちをしているスレッドを起こす（起こさないと待ち終わるまで終われない）
+                if pending and scheduler is not None:
+                    scheduler.halt()
+                for future in pending:
+                    future.cancel()
+    finally:
+        session.close()
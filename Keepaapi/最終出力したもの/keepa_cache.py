@@ -0,0 +1,238 @@
+# coding: utf-8
+"""
+Keepa 価格キャッシュ（SQLite）
+
+JAN × ドメインごとに (商品名, 価格, 備考, ヒット数, 取得時刻) を保存し、
+同じJANを短期間に再取得してトークンを無駄にしないようにする。
+
+モード:
+  CACHE_ONLY     … キャッシュにあるものだけ返す（APIを呼ばない）
+  REFRESH_STALE  … 有効期限内のものはキャッシュ、期限切れ・未取得だけAPI
+  INCREMENTAL    … 差分更新。有効期限をJANごとに変える（adaptive_ttl）
+                   価格が長く動いていない商品は最大 STABLE_TTL_HOURS までキャッシュを使い、
+                   最近動いた・取得のたびに価格が変わる商品は通常の有効期限で取り直す
+  FORCE_REFRESH  … 全件APIで取り直してキャッシュを更新
+
+差分更新の判定のため、商品の lastUpdate / lastPriceChange（UNIX 秒）と、
+取得回数・そのうち前回から価格が変わっていた回数も保存する。
+
+件数が上限を超えたら最終参照が古いものから削除する（LRU）。
+件数は開いたときに1回数え、以後は保存のたびに増えた分だけ足す（書き込みごとに全件を数えない）。
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from keepa_retry import is_transient
+
+# =========================
+# 設定
+# =========================
+CACHE_ONLY = "cache_only"
+REFRESH_STALE = "refresh_stale"
+INCREMENTAL = "incremental"
+FORCE_REFRESH = "force_refresh"
+CACHE_MODES = (CACHE_ONLY, REFRESH_STALE, INCREMENTAL, FORCE_REFRESH)
+
+# GUI の選択肢（表示名 → モード）
+CACHE_MODE_LABELS = {
+    "期限切れだけ再取得": REFRESH_STALE,
+    "変動しやすいものだけ再取得（差分更新）": INCREMENTAL,
+    "キャッシュのみ（API不使用）": CACHE_ONLY,
+    "すべて再取得": FORCE_REFRESH,
+}
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".keepa_cache", "keepa_price_cache.sqlite3")
+DEFAULT_TTL_HOURS = 24
+DEFAULT_MAX_ENTRIES = 1_000_000
+
+# 差分更新（INCREMENTAL）
+STABLE_TTL_HOURS = 24 * 7      # 価格が動かない商品でもこれ以上は古くしない
+QUIET_FRACTION = 0.25          # 「価格が動いていない期間」のこの割合までキャッシュを使う
+VOLATILE_CHANGE_RATIO = 0.5    # 取得のたびに価格が変わる割合がこれ以上なら変動しやすい
+
+
+def is_cacheable(result):
+    """結果タプルが確定した結果（価格あり／見つからない／価格取得失敗）か"""
+    return not is_transient(result[2])  # 一時的なエラーはキャッシュしない（次回また取りに行く）
+
+
+class PriceCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_hours=DEFAULT_TTL_HOURS,
+                 max_entries=DEFAULT_MAX_ENTRIES, clock=time.time):
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS prices (
+                jan         TEXT    NOT NULL,
+                domain      INTEGER NOT NULL,
+                title       TEXT,
+                price       INTEGER,
+                error       TEXT,
+                hit_count   INTEGER,
+                fetched_at  REAL    NOT NULL,
+                last_access REAL    NOT NULL,
+                last_update REAL,
+                last_price_change REAL,
+                checks      INTEGER NOT NULL DEFAULT 1,
+                price_changes INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (jan, domain)
+            )
+            """
+        )
+        # 差分更新より前に作ったキャッシュには列を足す
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(prices)")}
+        for name, decl in (("last_update", "REAL"), ("last_price_change", "REAL"),
+                           ("checks", "INTEGER NOT NULL DEFAULT 1"),
+                           ("price_changes", "INTEGER NOT NULL DEFAULT 0")):
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE prices ADD COLUMN {name} {decl}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_prices_last_access ON prices(last_access)")
+        self._conn.commit()
+        self.entries = self._conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+
+    def is_fresh(self, fetched_at):
+        return self.clock() - fetched_at < self.ttl_seconds
+
+    def adaptive_ttl(self, last_update, last_price_change, checks, price_changes):
+        """
+        差分更新での有効期限（秒）。
+        価格が動いていない期間（lastUpdate - lastPriceChange）の QUIET_FRACTION まで延ばす
+        （通常の有効期限 〜 STABLE_TTL_HOURS）。取得のたびに価格が変わっている商品・
+        時刻の分からない商品（見つからない等）は通常の有効期限。
+        """
+        if checks >= 2 and price_changes / checks >= VOLATILE_CHANGE_RATIO:
+            return self.ttl_seconds
+        if not last_update or not last_price_change:
+            return self.ttl_seconds
+        quiet = max(0.0, last_update - last_price_change)
+        return min(STABLE_TTL_HOURS * 3600, max(self.ttl_seconds, quiet * QUIET_FRACTION))
+
+    def get_many(self, codes, domain):
+        """
+        codes のうちキャッシュにあるものを返す。
+        戻り値: {jan: (結果タプル, fetched_at, 差分更新での有効期限（秒）)}
+        """
+        codes = list(dict.fromkeys(codes))
+        if not codes:
+            return {}
+        now = self.clock()
+        found = {}
+        with self._lock:
+            for start in range(0, len(codes), 500):
+                part = codes[start:start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT jan, title, price, error, hit_count, fetched_at, "
+                    f"last_update, last_price_change, checks, price_changes FROM prices "
+                    f"WHERE domain = ? AND jan IN ({marks})",
+                    [domain, *part],
+                ).fetchall()
+                for jan, title, price, error, hit_count, fetched_at, *history in rows:
+                    found[jan] = ((title, price, error, hit_count or 0), fetched_at, self.adaptive_ttl(*history))
+            if found:
+                self._conn.executemany(
+                    "UPDATE prices SET last_access = ? WHERE jan = ? AND domain = ?",
+                    [(now, jan, domain) for jan in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items, domain, times=None):
+        """
+        items: [(jan, 結果タプル)]。確定した結果だけ保存する。
+        times: {jan: (lastUpdate, lastPriceChange)}（UNIX 秒。無いJANは NULL）
+        すでにあるJANは取得回数を足し、価格が前回と違えば価格変化の回数も足す。
+        """
+        now = self.clock()
+        times = times or {}
+        rows = [
+            (jan, domain, title, price, error, hit_count, now, now, *times.get(jan, (None, None)))
+            for jan, (title, price, error, hit_count) in items
+            if is_cacheable((title, price, error, hit_count))
+        ]
+        if not rows:
+            return
+        with self._lock:
+            existing = self._count_existing([row[0] for row in rows], domain)
+            self._conn.executemany(
+                "INSERT INTO prices "
+                "(jan, domain, title, price, error, hit_count, fetched_at, last_access, "
+                " last_update, last_price_change) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(jan, domain) DO UPDATE SET "
+                " title = excluded.title, price = excluded.price, error = excluded.error, "
+                " hit_count = excluded.hit_count, fetched_at = excluded.fetched_at, "
+                " last_access = excluded.last_access, last_update = excluded.last_update, "
+                " last_price_change = excluded.last_price_change, "
+                " checks = prices.checks + 1, "
+                " price_changes = prices.price_changes + (prices.price IS NOT excluded.price)",
+                rows,
+            )
+            self._conn.commit()
+            self.entries += len({row[0] for row in rows}) - existing
+            if self.entries > self.max_entries:
+                self._evict()
+
+    def _count_existing(self, codes, domain):
+        """codes のうちすでに保存されている件数（主キーで引くだけなので件数が多くても速い）"""
+        codes = list(dict.fromkeys(codes))
+        existing = 0
+        for start in range(0, len(codes), 500):
+            part = codes[start:start + 500]
+            marks = ",".join("?" * len(part))
+            existing += self._conn.execute(
+                f"SELECT COUNT(*) FROM prices WHERE domain = ? AND jan IN ({marks})", [domain, *part]
+            ).fetchone()[0]
+        return existing
+
+    def _evict(self):
+        """上限を超えた分を最終参照が古いものから消す"""
+        self._conn.execute(
+            "DELETE FROM prices WHERE rowid IN "
+            "(SELECT rowid FROM prices ORDER BY last_access LIMIT ?)",
+            (self.entries - self.max_entries,),
+        )
+        self._conn.commit()
+        self.entries = self.max_entries
+
+    def lookup(self, codes, domain, mode=REFRESH_STALE):
+        """
+        モードに応じてキャッシュから返せるものを選ぶ。
+        戻り値: ({jan: 結果タプル}, APIで取得すべきJANのリスト)
+        """
+        if mode == FORCE_REFRESH:
+            return {}, list(codes)
+        cached = self.get_many(codes, domain)
+        served, missing = {}, []
+        now = self.clock()
+        for code in codes:
+            entry = cached.get(code)
+            if entry and (mode == CACHE_ONLY
+                          or (mode == INCREMENTAL and now - entry[1] < entry[2])
+                          or (mode == REFRESH_STALE and self.is_fresh(entry[1]))):
+                served[code] = entry[0]
+            else:
+                missing.append(code)
+        with self._lock:
+            self.hits += len(codes) - len(missing)
+            self.misses += len(missing)
+        return served, missing
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
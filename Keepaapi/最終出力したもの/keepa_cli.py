@@ -0,0 +1,160 @@
+# coding: utf-8
+"""
+Keepa 価格取得のコマンドライン版（GUIなし）
+
+使い方（このフォルダで実行）:
+    set KEEPA_API_KEY=xxxxx          （Linux: export KEEPA_API_KEY=xxxxx）
+    python -m keepa_cli --input JAN.xlsx --output-dir ./out --concurrency 8
+
+    --layout simple      … 結果_YYYYMMDD_HHMMSS.xlsx を1つ出力（2_Keepa価格調査提出分.py と同じ）
+    --layout classified  … 結果_YYYYMMDD_HHMMSS フォルダに4ファイル出力（3.Keepa統合実験.py と同じ）
+    --layout jsonl       … 結果を1件ずつ JSON の1行で標準出力に書く（ファイルは出さない。ほかのプログラム用）
+                           通信エラー等で取れなかった行も備考付きで出し、"再取得": true を付ける
+    --input -            … 標準入力から1行に1つずつ JAN を読む（届いた分から取得する。件数は数えない）
+    --journal <jsonl>    … ジャーナルの保存先（既定: 出力先/結果_YYYYMMDD_HHMMSS.jsonl。
+                           既にあれば .bak に退避して作り直す。続きから取るときは --resume）
+    --resume <jsonl>     … 中断したジャーナルから再開
+    --cache-mode incremental … 差分更新（価格が動きやすいJAN・期限切れだけ取り直す。毎日の再取得向け）
+    --history [DIR]      … 価格履歴も保存する（既定: ~/.keepa_cache/history。集計は python -m keepa_history）
+
+計測値（所要時間・HTTP ステータス・トークン・件/秒・残り時間）は
+ジャーナルと同じ名前の .metrics.json / .metrics.prom に定期的に書き出す。
+再試行しても取れなかったJANは *_再取得用.csv に出る（そのまま --input に渡せる）。
+
+Ctrl+C で中断すると、それまでの結果を出力してから終了する。
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+
+from keepa_api import DEFAULT_CONCURRENCY, PLAN_TIERED, QUERY_PLANS
+from keepa_cache import CACHE_MODES, REFRESH_STALE
+from keepa_history import DEFAULT_HISTORY_PATH
+from keepa_retry import is_transient
+from keepa_core import (
+    PriceLookup, StreamedInput, load_input, journal_input_path, run_name, save_simple, save_classified,
+)
+
+PROGRESS_EVERY = 100           # この件数ごとに進捗を表示
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="keepa_cli", description="Keepa 価格取得（GUIなし）")
+    parser.add_argument("--input", help="JANリスト（xlsx / csv / txt の1列目。- で標準入力。--resume 時は省略可）")
+    parser.add_argument("--output-dir", default=".", help="出力先フォルダ（既定: カレント）")
+    parser.add_argument("--api-key-env", default="KEEPA_API_KEY", help="APIキーを読む環境変数名（カンマ区切りで複数可）")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同時リクエスト数")
+    parser.add_argument("--cache-mode", choices=CACHE_MODES, default=REFRESH_STALE)
+    parser.add_argument("--layout", choices=("simple", "classified", "jsonl"), default="simple")
+    parser.add_argument("--journal", metavar="JSONL", help="ジャーナルの保存先（既にあれば .bak に退避して作り直す）")
+    parser.add_argument("--plan", choices=QUERY_PLANS, default=PLAN_TIERED,
+                        help="tiered: BuyBox→決まらない分だけオファー / offers: 最初からオファー付き")
+    parser.add_argument("--no-validate", action="store_true",
+                        help="JANの正規化・チェックディジット検証をしない（そのまま問い合わせる）")
+    parser.add_argument("--history", nargs="?", const=DEFAULT_HISTORY_PATH, metavar="DIR",
+                        help="history=1 で取得し、価格履歴をこのフォルダに保存する（キャッシュから返したJANは対象外）")
+    parser.add_argument("--resume", metavar="JOURNAL", help="再開するジャーナル（*.jsonl）")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    api_key = os.environ.get(args.api_key_env, "").strip()
+    if not api_key:
+        print(f"環境変数 {args.api_key_env} にKeepa APIキーを設定してください。", file=sys.stderr)
+        return 2
+
+    if args.resume:
+        journal_path = args.resume
+        input_path = journal_input_path(journal_path) or args.input
+        base = os.path.splitext(journal_path)[0]
+    else:
+        input_path = args.input
+        os.makedirs(args.output_dir, exist_ok=True)
+        journal_path = args.journal or os.path.join(args.output_dir, run_name() + ".jsonl")
+        base = os.path.splitext(journal_path)[0]
+        # 新しく始めるので、同じ名前の前回のジャーナルは .bak に退避する（行番号が 0 からやり直しになるため）。
+        # 消さないのは --resume のつもりで渡した途中のジャーナルを失わないため。再取得用 CSV も前回の分に追記しないよう一緒に
+        if os.path.exists(journal_path):
+            for path in (journal_path, base + "_再取得用.csv"):
+                if os.path.exists(path):
+                    os.replace(path, path + ".bak")
+            print(f"📦 前回のジャーナルを {journal_path}.bak に退避しました"
+                  f"（そちらの続きを取るときは --resume {journal_path}.bak）", file=sys.stderr)
+    if not input_path:
+        print("--input を指定してください。", file=sys.stderr)
+        return 2
+
+    streamed = input_path == "-"
+    if streamed:
+        rows, total = StreamedInput(sys.stdin), None
+        input_path = None
+        print("📘 標準入力から JAN を読みます", file=sys.stderr)
+    else:
+        try:
+            rows, total = load_input(input_path)
+        except Exception as e:
+            print(f"入力ファイルを開けませんでした: {e}", file=sys.stderr)
+            return 1
+        print(f"📘 {input_path}：全{total}件" if total is not None else f"📘 {input_path}（件数は数えずに読み進めます）",
+              file=sys.stderr)
+
+    stop_event = threading.Event()
+
+    def progress(done, total):
+        if done % PROGRESS_EVERY == 0 or done == total:
+            print(f"🕐 {done}/{total} 件完了" if total else f"🕐 {done}件完了", file=sys.stderr)
+
+    lookup = PriceLookup(
+        api_key, journal_path,
+        concurrency=args.concurrency,
+        cache_mode=args.cache_mode,
+        plan=args.plan,
+        validate_jans=not args.no_validate,
+        metrics_path=base + ".metrics",
+        dead_letter_path=base + "_再取得用.csv",
+        history_path=args.history,
+        keep_failed=(args.layout != "simple"),
+        log=lambda text: print(text, end="", file=sys.stderr),
+        progress=progress,
+        stop=stop_event.is_set,
+    )
+    try:
+        for record in lookup.run(rows, total, input_path=input_path, resume=bool(args.resume)):
+            if args.layout == "jsonl":
+                print(json.dumps(dict(record, 再取得=is_transient(record["備考"]))), flush=True)
+    except KeyboardInterrupt:
+        stop_event.set()
+        print("🛑 中断しました → 途中までの結果を出力します。", file=sys.stderr)
+
+    if args.layout == "jsonl":
+        output = journal_path
+    elif args.layout == "classified":
+        os.makedirs(base, exist_ok=True)
+        output = save_classified(journal_path, base, lookup.metrics)
+    else:
+        output = save_simple(journal_path, base + ".xlsx", lookup.metrics)
+
+    print(f"💽 キャッシュ利用 {lookup.cache_hits}件 / キャッシュ外 {lookup.cache_misses}件", file=sys.stderr)
+    print(f"🪙 {lookup.token_report()}", file=sys.stderr)
+    print(f"🧮 {lookup.dedup_report()}", file=sys.stderr)
+    print(f"⏱ {lookup.metrics_report()}", file=sys.stderr)
+    print(f"🔁 {lookup.retry_report()}", file=sys.stderr)
+    if args.history:
+        print(f"📈 価格履歴 {lookup.history_products}件 → {args.history}", file=sys.stderr)
+    if lookup.dead_letters:
+        print(f"♻️ 再取得用: python -m keepa_cli --input {lookup.dead_letter_path}", file=sys.stderr)
+    print(f"🎉 出力: {output}", file=sys.stderr)
+    if stop_event.is_set():
+        if not streamed:
+            print(f"↩ 続き: python -m keepa_cli --resume {journal_path}", file=sys.stderr)
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
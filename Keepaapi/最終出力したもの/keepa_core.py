@@ -0,0 +1,433 @@
+# coding: utf-8
+"""
+Keepa 価格取得の本体（GUIなし）
+
+2_Keepa価格調査提出分.py / 3.Keepa統合実験.py の GUI と keepa_cli.py から共通で使う。
+Tkinter には依存しないので、バッチサーバや cron、複数プロセスからも実行できる。
+
+    rows, total = load_input("JAN.xlsx")
+    lookup = PriceLookup(api_key, "結果_xxx.jsonl", progress=print)
+    for record in lookup.run(rows, total, input_path="JAN.xlsx"):
+        ...                      # {"row", "JANコード", "価格", "商品名", "備考"}
+    save_simple("結果_xxx.jsonl", "結果_xxx.xlsx")
+
+    lookup.run(StreamedInput(sys.stdin))   # 1行ずつ届く JAN（全件数は分からないまま流す）
+"""
+
+import datetime
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import pandas as pd
+
+from jan_input import iter_jans, count_rows, normalize_jan
+from keepa_api import (
+    iter_fetched_chunks, DEFAULT_CONCURRENCY, DOMAIN_JP, FLUSH, PLAN_TIERED, TIER_TOKENS_PER_ITEM,
+)
+from keepa_retry import RetryQueue, DeadLetterFile, is_transient
+from keepa_history import HistoryStore
+from keepa_tokens import KeyPool, DEFAULT_TOKENS_PER_ITEM
+from keepa_cache import PriceCache, REFRESH_STALE, DEFAULT_CACHE_PATH, DEFAULT_TTL_HOURS, DEFAULT_MAX_ENTRIES
+from keepa_journal import ResultJournal, read_journal_meta, load_done_rows, journal_to_dataframe
+from shared.run_metrics import RunMetrics, timed
+
+# =========================
+# 設定
+# =========================
+RESULT_COLUMNS = ("JANコード", "価格", "商品名", "備考")
+STREAM_IDLE_SECONDS = 0.5      # 流し込みの入力がこの秒数途切れたら、100件未満でも問い合わせる
+STREAM_BUFFER_ROWS = 5_000     # 流し込みの入力を読み進めておく行数
+CLASSIFIED_FILES = (
+    "JAN整列結果.xlsx",
+    "価格取得成功.xlsx",
+    "価格取得失敗.xlsx",
+    "商品が見つからなかったもの.xlsx",
+)
+
+
+# =========================
+# 入力
+# =========================
+def load_input(source):
+    """
+    source: JANファイルのパス（xlsx / csv / txt、1列目がJAN）または JAN の並び
+    戻り値: ((行番号, JAN) の並び, 全行数)  ※空行は除くが行番号は元の位置
+    ファイルは先頭から順に読むので、全行を読み終える前に取得を始められる。
+    全行数は進捗表示用の目安。数えられないファイル（xls・範囲情報のない xlsx）は None のまま
+    （読み込むまで全件をメモリに載せない。進捗は件数なしで表示する）。
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return iter_jans(source), count_rows(source)
+    values = list(enumerate(source))
+    rows = [(i, str(v).strip()) for i, v in values]
+    rows = [(i, jan) for i, jan in rows if jan and jan.lower() != "nan"]
+    return rows, len(values)
+
+class StreamedInput:
+    """
+    1行に1つの JAN が少しずつ届く入力（標準入力など。行番号は届いた順に 0 から）。
+    読み込みは別スレッドで STREAM_BUFFER_ROWS 行まで先に進め、
+    STREAM_IDLE_SECONDS 届かなければ keepa_api.FLUSH を挟む（今ある分だけで問い合わせる）。
+    全件数は最後まで分からないので、PriceLookup.run には total=None のまま渡す。
+    """
+
+    _END = object()
+
+    def __init__(self, stream, idle_seconds=STREAM_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self.rows_in = 0
+        self._queue = queue.Queue(maxsize=STREAM_BUFFER_ROWS)
+        threading.Thread(target=self._read, args=(stream,), daemon=True).start()
+
+    def _read(self, stream):
+        try:
+            for line in stream:
+                self._queue.put(line.strip())
+        finally:
+            self._queue.put(self._END)
+
+    def __iter__(self):
+        while True:
+            try:
+                jan = self._queue.get(timeout=self.idle_seconds)
+            except queue.Empty:
+                yield FLUSH
+                continue
+            if jan is self._END:
+                return
+            self.rows_in += 1
+            yield self.rows_in - 1, jan
+
+
+def journal_input_path(journal_path):
+    """ジャーナルに記録された入力ファイルのパス（再開用）"""
+    return read_journal_meta(journal_path).get("input")
+
+
+# =========================
+# 重複まとめ
+# =========================
+class JanFanOut:
+    """
+    取得前の正規化と重複まとめ。
+    unique() は正規化したJANを初出の行だけ流し、重複行・不正なJANの行は取っておく。
+    取得結果が出たら resolve() で同じJANの行すべてに配る。
+    """
+
+    def __init__(self, validate=True):
+        self.validate = validate
+        self.results = {}        # JAN → 確定した結果タプル（以降の重複行にそのまま使う）
+        self.waiting = {}        # JAN → 取得中のJANを待っている重複行
+        self.ready = deque()     # すぐ出せる (行番号, JAN, 結果タプル)
+        self.duplicates = 0
+        self.invalid = 0
+
+    def unique(self, rows):
+        for row, raw in rows:
+            if row is None:
+                yield row, raw             # keepa_api.FLUSH（そのまま流す）
+                continue
+            if self.validate:
+                jan, problem = normalize_jan(raw)
+                if problem:
+                    self.invalid += 1
+                    self.ready.append((row, raw, (None, None, f"JAN不正（{problem}）", 0)))
+                    continue
+            else:
+                jan = raw
+            if jan in self.results:
+                self.duplicates += 1
+                self.ready.append((row, jan, self.results[jan]))
+            elif jan in self.waiting:
+                self.duplicates += 1
+                self.waiting[jan].append(row)
+            else:
+                self.waiting[jan] = []
+                yield row, jan
+
+    def resolve(self, jan, result):
+        """取得結果を受け取り、待っていた重複行を返す"""
+        error = result[2]
+        if not is_transient(error):
+            self.results[jan] = result
+        return [(row, jan, result) for row in self.waiting.pop(jan, ())]
+
+    @property
+    def saved(self):
+        """問い合わせずに済んだ件数"""
+        return self.duplicates + self.invalid
+
+
+# =========================
+# 取得
+# =========================
+class PriceLookup:
+    """
+    1回分の価格取得。run() が結果レコードを1件ずつ返し、同時にジャーナルへ追記する。
+    api_key はカンマ区切りで複数渡せる（キーごとにトークンを管理して使い分ける）。
+    log(text) / progress(完了件数, 全件数) / stop() はいずれも省略可。
+    keep_failed=False のときは通信エラー等の行を記録せずに飛ばす（True でも記録した行は再開で取り直す）。
+    validate_jans=True なら取得前にJANを正規化・検証し（不正なものは問い合わせない）、
+    同じJANは1回だけ問い合わせて全行に結果を配る。
+    metrics_path を渡すと、実行中の計測値（段ごとの所要時間・HTTP ステータス・トークン・
+    トークン待ち時間・件/秒・残り時間）を metrics_path.json / .prom に定期的に書き出す。
+    通信エラー等のJANは retry_policies（既定は keepa_retry.RETRY_POLICIES）に従って時間をおいて
+    取り直し、それでも取れなかったJANは dead_letter_path の CSV に書き出す（次の実行の入力にできる）。
+    history_path を渡すと history=1 で問い合わせ、APIから取得した商品の価格履歴を
+    そのフォルダ（keepa_history.HistoryStore）に追記する。
+    """
+
+    def __init__(self, api_key, journal_path, concurrency=DEFAULT_CONCURRENCY, cache_mode=REFRESH_STALE,
+                 tokens_per_item=DEFAULT_TOKENS_PER_ITEM, cache_path=DEFAULT_CACHE_PATH,
+                 cache_ttl_hours=DEFAULT_TTL_HOURS, cache_max_entries=DEFAULT_MAX_ENTRIES,
+                 keep_failed=True, domain=DOMAIN_JP, plan=PLAN_TIERED, validate_jans=True,
+                 metrics_path=None, dead_letter_path=None, retry_policies=None, history_path=None,
+                 log=None, progress=None, stop=None):
+        self.api_key = api_key
+        self.journal_path = journal_path
+        self.concurrency = concurrency
+        self.cache_mode = cache_mode
+        self.tokens_per_item = tokens_per_item
+        self.cache_path = cache_path
+        self.cache_ttl_hours = cache_ttl_hours
+        self.cache_max_entries = cache_max_entries
+        self.keep_failed = keep_failed
+        self.domain = domain
+        self.plan = plan
+        self.validate_jans = validate_jans
+        self.metrics_path = metrics_path
+        self.dead_letter_path = dead_letter_path
+        self.retry_policies = retry_policies
+        self.history_path = history_path
+        self.metrics = RunMetrics("keepa")
+        self.log = log or (lambda text: None)
+        self.progress = progress or (lambda done, total: None)
+        self.stop = stop or (lambda: False)
+
+        self.total = 0
+        self.done = 0
+        self.skipped = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.tokens_consumed = 0
+        self.tier_usage = {}           # 段 → (取得件数, 消費トークン)
+        self.key_usage = ""            # キーごとの消費（複数キーのとき）
+        self.duplicates = 0
+        self.invalid = 0
+        self.dead_letters = 0          # 再試行しても取れず dead_letter_path に書いた件数
+        self.retry_summary = ""
+        self.history_products = 0      # 価格履歴を保存した商品数
+        self.stopped = False
+        self._retry = None
+        self._dead = None
+
+    def run(self, rows, total=None, input_path=None, resume=False):
+        """
+        rows: (行番号, JAN) の並び（ジェネレータでよい）。resume=True ならジャーナル記録済みの行を飛ばす。
+        total: progress に渡す全件数（再開時は記録済みの分を含む）。分からなければ None のまま渡す
+        （rows を先に読み切って数えることはしない）。
+        rows が StreamedInput なら、次の行が届くまでの待ちは入力の読み込み時間（input_read_seconds）
+        ではなく input_wait_seconds に数える。
+        """
+        done_rows = load_done_rows(self.journal_path) if resume else set()
+        if done_rows:
+            self.log(f"⏭ 再開：取得済みの{len(done_rows)}件を飛ばします。\n")
+        stage = "input_wait_seconds" if isinstance(rows, StreamedInput) else "input_read_seconds"
+        rows = ((i, jan) for i, jan in _timed_rows(rows, self.metrics, stage) if i not in done_rows)
+        self.total = total
+        self.done = len(done_rows)
+        fan_out = JanFanOut(self.validate_jans)
+
+        journal = ResultJournal(self.journal_path, meta={
+            "input": os.path.abspath(input_path) if input_path else None,
+            "started": datetime.datetime.now().strftime("%Y%m%d_%H%M%S"),
+        })
+        # ✅ 残トークンから必要な分だけ待つ（キーが複数なら一番早く使えるキーへ）
+        scheduler = KeyPool(self.api_key, self.tokens_per_item, log=self.log, stop=self.stop,
+                            kind_rates=TIER_TOKENS_PER_ITEM)
+        # ✅ 取得済みJANはキャッシュから（有効期限・モードは設定に従う）
+        cache = PriceCache(self.cache_path, ttl_hours=self.cache_ttl_hours, max_entries=self.cache_max_entries)
+        # ✅ 失敗したJANは時間をおいて取り直し、取れなければ退避ファイルへ
+        retry = self._retry = RetryQueue(self.retry_policies)
+        dead = self._dead = DeadLetterFile(self.dead_letter_path) if self.dead_letter_path else None
+        # ✅ 価格履歴も保存する場合
+        history = HistoryStore(self.history_path) if self.history_path else None
+        metrics = self.metrics
+        metrics.begin(self.done, total)
+        metrics.gauge("tokens_consumed", lambda: scheduler.tokens_consumed)
+        metrics.gauge("throttled_wait_seconds", lambda: round(scheduler.wait_seconds, 3))
+        metrics.gauge("cache_hits", lambda: cache.hits)
+        metrics.gauge("cache_misses", lambda: cache.misses)
+        metrics.gauge("duplicates", lambda: fan_out.duplicates)
+        metrics.gauge("invalid_jans", lambda: fan_out.invalid)
+        metrics.gauge("retry_waiting", lambda: len(retry))
+        metrics.gauge("dead_letters", lambda: dead.count if dead else 0)
+        metrics.gauge("history_products", lambda: history.products if history else 0)
+        if self.metrics_path:
+            metrics.start(self.metrics_path)
+
+        try:
+            for chunk, fetched in iter_fetched_chunks(self.api_key, fan_out.unique(rows), self.concurrency,
+                                                      self.domain, scheduler=scheduler, cache=cache,
+                                                      cache_mode=self.cache_mode,
+                                                      log=self.log, stop=self.stop, plan=self.plan,
+                                                      metrics=metrics, retry=retry, history=history):
+                for (i, jan), result in zip(chunk, fetched):
+                    for row in [(i, jan, result), *fan_out.resolve(jan, result)]:
+                        record = self._record(journal, *row)
+                        if record is not None:
+                            yield record
+                while fan_out.ready:
+                    record = self._record(journal, *fan_out.ready.popleft())
+                    if record is not None:
+                        yield record
+            # 最後の塊より後ろに残った重複行・不正な行
+            while fan_out.ready and not self.stop():
+                record = self._record(journal, *fan_out.ready.popleft())
+                if record is not None:
+                    yield record
+            self.stopped = self.stop()
+        finally:
+            journal.close()
+            self.cache_hits, self.cache_misses = cache.hits, cache.misses
+            self.tokens_consumed = scheduler.tokens_consumed
+            self.tier_usage = {k: tuple(v) for k, v in scheduler.usage.items()}
+            if len(scheduler.keys) > 1:
+                self.key_usage = scheduler.key_report()
+            self.duplicates, self.invalid = fan_out.duplicates, fan_out.invalid
+            self.retry_summary = retry.report()
+            if dead is not None:
+                self.dead_letters = dead.count
+                dead.close()
+            if history is not None:
+                with timed(metrics, "history_write"):
+                    history.close()
+                self.history_products = history.products
+            metrics.close()
+            cache.close()
+
+
+    def _record(self, journal, i, jan, result):
+        """結果1件をジャーナルへ。飛ばした場合は None"""
+        title, price, error, _ = result
+        if is_transient(error):
+            tries = self._retry.attempt(i, jan) if self._retry is not None else 0
+            tried = f"（再試行{tries}回）" if tries else ""
+            if self._dead is not None:
+                self._dead.append(i, jan, error)
+                self.log(f"⚠️ {i+1}行目 {jan} → {error}{tried} → 再取得用ファイルへ\n")
+            else:
+                self.log(f"⚠️ {i+1}行目 {jan} → {error}{tried} のためスキップ\n")
+            if not self.keep_failed:
+                self.skipped += 1
+                return None
+
+        record = {
+            "row": i,
+            "JANコード": jan,
+            "価格": price if price is not None else "Null",
+            "商品名": title or "",
+            "備考": error or "",
+        }
+        journal.append(record)
+        self.done += 1
+        self.metrics.set_progress(self.done)
+        self.progress(self.done, self.total)
+        return record
+
+    def dedup_report(self):
+        """重複まとめ・不正JANで省いた問い合わせの件数を1行で"""
+        saved = self.duplicates + self.invalid
+        return f"重複 {self.duplicates}件・JAN不正 {self.invalid}件 → 問い合わせ {saved}件を省略"
+
+    def token_report(self):
+        """消費トークンの内訳（段ごと）を1行で"""
+        parts = [f"{tier} {items}件/{tokens}" for tier, (items, tokens) in self.tier_usage.items()]
+        detail = f"（{' / '.join(parts)}）" if parts else ""
+        keys = f"\n   キー別: {self.key_usage}" if self.key_usage else ""
+        return f"消費トークン {self.tokens_consumed}{detail}{keys}"
+
+    def retry_report(self):
+        """再試行の内訳と、取れずに退避したJANの件数を1行で"""
+        dead = f"・再取得用ファイルへ {self.dead_letters}件" if self.dead_letter_path else ""
+        return f"{self.retry_summary}{dead}"
+
+    def metrics_report(self):
+        """段ごとの所要時間と件/秒を1行で"""
+        return self.metrics.report()
+
+
+def _timed_rows(rows, metrics, name="input_read_seconds"):
+    """入力の読み込み（xlsx の解析など）にかかった時間を name に足していく"""
+    rows = iter(rows)
+    while True:
+        started = time.perf_counter()
+        row = next(rows, None)
+        metrics.add(name, time.perf_counter() - started)
+        if row is None:
+            return
+        yield row
+
+
+# =========================
+# 出力
+# =========================
+def default_output_dir():
+    return os.path.join(os.path.expanduser("~"), "Desktop")
+
+def run_name():
+    return f"結果_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+def ensure_result_folder(base_dir=None):
+    folder = os.path.join(base_dir or default_output_dir(), run_name())
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def save_simple(journal_path, output_file, metrics=None):
+    """ジャーナル → 1つの Excel（JANコード, 価格, 商品名, 備考）"""
+    with timed(metrics, "excel_write"):
+        df = journal_to_dataframe(journal_path, RESULT_COLUMNS)
+        df.to_excel(output_file, index=False)
+    if metrics is not None:
+        metrics.write_snapshot()
+    return output_file
+
+def classify_and_save(df, result_folder):
+    """
+    df: 列(JANコード, 価格, 商品名, 備考)
+    価格を数値化して分類。3ファイル＋JAN整列結果.xlsx を保存
+    """
+    df = df.copy()
+
+    rename_map = {}
+    for c in df.columns:
+        if "JAN" in str(c).upper():
+            rename_map[c] = "JANコード"
+    df.rename(columns=rename_map, inplace=True)
+
+    df["価格数値"] = pd.to_numeric(df["価格"], errors="coerce")
+
+    df_success = df[df["価格数値"].notna()].copy()
+    df_not_found = df[df["備考"].astype(str).str.contains("商品が見つからない", na=False)].copy()
+    df_fail = df[~df.index.isin(df_success.index) & ~df.index.isin(df_not_found.index)].copy()
+
+    for d in (df_success, df_fail, df_not_found):
+        if "価格数値" in d.columns:
+            d.drop(columns=["価格数値"], inplace=True)
+    df.drop(columns=["価格数値"], inplace=True)
+
+    df.to_excel(os.path.join(result_folder, "JAN整列結果.xlsx"), index=False)
+    df_success.to_excel(os.path.join(result_folder, "価格取得成功.xlsx"), index=False)
+    df_fail.to_excel(os.path.join(result_folder, "価格取得失敗.xlsx"), index=False)
+    df_not_found.to_excel(os.path.join(result_folder, "商品が見つからなかったもの.xlsx"), index=False)
+
+def save_classified(journal_path, result_folder, metrics=None):
+    """ジャーナル → 結果フォルダに4ファイル"""
+    with timed(metrics, "excel_write"):
+        classify_and_save(journal_to_dataframe(journal_path, RESULT_COLUMNS), result_folder)
+    if metrics is not None:
+        metrics.write_snapshot()
+    return result_folder
@@ -0,0 +1,342 @@
+# coding: utf-8
+"""
+Keepa 価格履歴の保存と集計（メモリマップした NumPy 配列）
+
+    store = HistoryStore(DEFAULT_HISTORY_PATH)
+    store.add_product("4901234567894", product)      # /product（history=1）の商品1件
+    store.flush()
+    stats = store.window_stats(kind=BUY_BOX_SHIPPING, days=90)   # 全JANの直近90日
+    stats["jan"], stats["min"], stats["avg"], stats["last"]
+
+    python -m keepa_history --days 90 --kind 18 --out 90日集計.csv
+
+保存形式（フォルダ1つ・追記のみ）:
+    times.i32   … Keepa 時刻（分）   int32 を全履歴ぶん連結
+    values.i32  … 価格（-1 = 出品なし）int32 を全履歴ぶん連結
+    index.bin   … INDEX_DTYPE の配列（JANのキー, 種類, 位置, 件数）
+同じ JAN × 種類を取り直したら後ろに追記し、index の後の方を使う（compact() で詰め直せる）。
+読み込みは np.memmap なので、集計で全体をメモリに載せない。
+
+Keepa の csv は種類ごとに [時刻, 価格, 時刻, 価格, ...]。
+送料つきの種類（TRIPLET_KINDS）は [時刻, 価格, 送料, ...] で、送料込みの価格として保存する。
+"""
+
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from keepa_price import KEEPA_EPOCH_MINUTES
+
+# =========================
+# 設定
+# =========================
+# Keepa の csv の種類（よく使うもの）
+AMAZON = 0
+NEW = 1
+USED = 2
+BUY_BOX_SHIPPING = 18
+DEFAULT_KINDS = (AMAZON, NEW, BUY_BOX_SHIPPING)
+TRIPLET_KINDS = frozenset((7, 18, 19, 20, 21, 22))   # [時刻, 価格, 送料] の3つ組
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".keepa_cache", "history")
+HISTORY_DAYS = 365             # history=1 で取る期間（Keepa の days=）
+
+INDEX_DTYPE = np.dtype([("key", "<i8"), ("kind", "<i2"), ("offset", "<i8"), ("length", "<i4")])
+FLUSH_POINTS = 1_000_000       # この点数が溜まったらファイルへ書き出す
+QUERY_POINTS = 4_000_000       # 集計で一度に読む点数
+NO_VALUE = -1
+FORMAT_VERSION = 1
+
+
+# =========================
+# JAN ⇔ キー
+# =========================
+def jan_key(jan):
+    """JAN → int64 のキー（桁数も含めるので先頭ゼロの違う JAN と混ざらない）。数字以外は None"""
+    jan = str(jan)
+    if not jan.isdigit() or not 0 < len(jan) <= 14:
+        return None
+    return len(jan) * 10**14 + int(jan)
+
+def key_jan(key):
+    key = int(key)
+    return str(key % 10**14).zfill(key // 10**14)
+
+
+# =========================
+# 展開
+# =========================
+def decode_csv(kind, values):
+    """Keepa の csv 1種類 → (時刻, 価格) の int32 配列"""
+    if not values:
+        return None
+    width = 3 if kind in TRIPLET_KINDS else 2
+    arr = np.asarray(values, dtype=np.int64)
+    arr = arr[: len(arr) - len(arr) % width].reshape(-1, width)
+    if not len(arr):
+        return None
+    times = arr[:, 0]
+    prices = arr[:, 1]
+    if width == 3:
+        prices = np.where(prices >= 0, prices + np.maximum(arr[:, 2], 0), NO_VALUE)
+    return times.astype(np.int32), prices.astype(np.int32)
+
+
+class HistoryStore:
+    """
+    価格履歴のフォルダ。add_product() は複数スレッドから呼んでよい
+    （溜めておいて FLUSH_POINTS ごと・flush() でまとめて追記する）。
+    """
+
+    def __init__(self, path, kinds=DEFAULT_KINDS, days=HISTORY_DAYS):
+        self.path = os.path.expanduser(path)
+        self.kinds = tuple(kinds)
+        self.days = days
+        os.makedirs(self.path, exist_ok=True)
+        self._times_path = os.path.join(self.path, "times.i32")
+        self._values_path = os.path.join(self.path, "values.i32")
+        self._index_path = os.path.join(self.path, "index.bin")
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(meta_path):
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"version": FORMAT_VERSION, "epoch_minutes": KEEPA_EPOCH_MINUTES}, f)
+
+        self.products = 0
+        self._pending = []           # [(キー, 種類, 時刻, 価格)]
+        self._pending_points = 0
+        self._lock = threading.Lock()
+        self._repair()
+
+    # ---------- 書き込み ----------
+    def _repair(self):
+        """前回が書き込み途中で落ちていたら、index とデータの長さをそろえる"""
+        n_points = min(_count(self._times_path, 4), _count(self._values_path, 4))
+        for path in (self._times_path, self._values_path):
+            if os.path.exists(path) and os.path.getsize(path) != n_points * 4:
+                with open(path, "r+b") as f:
+                    f.truncate(n_points * 4)
+        index = self._read_index()
+        valid = index["offset"] + index["length"] <= n_points
+        if not valid.all() or (os.path.exists(self._index_path)
+                               and os.path.getsize(self._index_path) % INDEX_DTYPE.itemsize):
+            index[valid].tofile(self._index_path)
+        self._n_points = n_points
+
+    def add_product(self, jan, product):
+        """商品1件の履歴（self.kinds の種類）を追記待ちに入れる"""
+        key = jan_key(jan)
+        series = product.get("csv") if product else None
+        if key is None or not series:
+            return
+        rows = []
+        for kind in self.kinds:
+            if kind < len(series):
+                decoded = decode_csv(kind, series[kind])
+                if decoded is not None:
+                    rows.append((key, kind, *decoded))
+        if not rows:
+            return
+        with self._lock:
+            self.products += 1
+            self._pending.extend(rows)
+            self._pending_points += sum(len(r[2]) for r in rows)
+            if self._pending_points >= FLUSH_POINTS:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        index = np.empty(len(self._pending), dtype=INDEX_DTYPE)
+        offset = self._n_points
+        for k, (key, kind, times, _) in enumerate(self._pending):
+            index[k] = (key, kind, offset, len(times))
+            offset += len(times)
+        # データ → index の順に書く（index が先に残ることはない）
+        with open(self._times_path, "ab") as f:
+            np.concatenate([r[2] for r in self._pending]).tofile(f)
+        with open(self._values_path, "ab") as f:
+            np.concatenate([r[3] for r in self._pending]).tofile(f)
+        with open(self._index_path, "ab") as f:
+            index.tofile(f)
+        self._n_points = offset
+        self._pending = []
+        self._pending_points = 0
+
+    def close(self):
+        self.flush()
+
+    # ---------- 読み込み ----------
+    def _read_index(self):
+        if not os.path.exists(self._index_path):
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        n = os.path.getsize(self._index_path) // INDEX_DTYPE.itemsize
+        return np.fromfile(self._index_path, dtype=INDEX_DTYPE, count=n)
+
+    def latest_index(self, kind=None):
+        """JAN × 種類ごとに最後に追記したものだけの index（JAN・種類の順）"""
+        index = self._read_index()
+        if kind is not None:
+            index = index[index["kind"] == kind]
+        if not len(index):
+            return index
+        # 後ろから並べて安定ソートすると、同じ JAN × 種類の先頭が最新になる
+        rev = index[::-1]
+        rev = rev[np.lexsort((rev["kind"], rev["key"]))]
+        first = np.ones(len(rev), dtype=bool)
+        first[1:] = (rev["key"][1:] != rev["key"][:-1]) | (rev["kind"][1:] != rev["kind"][:-1])
+        return rev[first]
+
+    def _columns(self):
+        if not self._n_points:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, empty
+        return (np.memmap(self._times_path, dtype=np.int32, mode="r", shape=(self._n_points,)),
+                np.memmap(self._values_path, dtype=np.int32, mode="r", shape=(self._n_points,)))
+
+    def series(self, jan, kind=BUY_BOX_SHIPPING):
+        """1つの JAN の履歴 → (UNIX 秒の配列, 価格の配列)"""
+        self.flush()
+        key = jan_key(jan)
+        index = self.latest_index(kind)
+        hit = index[index["key"] == key]
+        if not len(hit):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+        times, values = self._columns()
+        start, length = int(hit[-1]["offset"]), int(hit[-1]["length"])
+        t = (times[start:start + length].astype(np.int64) + KEEPA_EPOCH_MINUTES) * 60
+        return t, np.array(values[start:start + length])
+
+    def window_stats(self, jans=None, kind=BUY_BOX_SHIPPING, days=90, now=None):
+        """
+        直近 days 日の 最安値 / 時間加重の平均 / 最新値 / 出品あり時間の割合 をまとめて求める。
+        jans を省略すると全JAN。戻り値は列ごとの配列の dict（jan, min, avg, last, coverage）。
+        値が無い JAN は -1（coverage は 0）。並びはファイル上の順（読み込みが前から順になるように）。
+        """
+        self.flush()
+        now_minutes = int((time.time() if now is None else now) // 60) - KEEPA_EPOCH_MINUTES
+        cutoff = now_minutes - days * 24 * 60
+        index = self.latest_index(kind)
+        if jans is not None:
+            keys = np.array([k for k in map(jan_key, jans) if k is not None], dtype=np.int64)
+            index = index[np.isin(index["key"], keys)]
+        index = index[np.argsort(index["offset"], kind="stable")]
+        times, values = self._columns()
+
+        n = len(index)
+        out_min = np.full(n, NO_VALUE, dtype=np.int64)
+        out_avg = np.full(n, NO_VALUE, dtype=np.float64)
+        out_last = np.full(n, NO_VALUE, dtype=np.int64)
+        coverage = np.zeros(n, dtype=np.float64)
+
+        # ファイル上の並び順に QUERY_POINTS 点ずつ読んで集計する
+        lengths = index["length"].astype(np.int64)
+        ends = np.cumsum(lengths)
+        start = 0
+        while start < n:
+            base = ends[start - 1] if start else 0
+            stop = max(start + 1, int(np.searchsorted(ends, base + QUERY_POINTS, side="right")))
+            _window_block(index[start:stop], times, values, cutoff, now_minutes,
+                          out_min[start:stop], out_avg[start:stop], out_last[start:stop],
+                          coverage[start:stop])
+            start = stop
+        return {
+            "jan": [key_jan(k) for k in index["key"]],
+            "min": out_min,
+            "avg": out_avg,
+            "last": out_last,
+            "coverage": coverage,
+        }
+
+    def compact(self):
+        """古い（取り直し前の）履歴を除いて詰め直す"""
+        self.flush()
+        index = self.latest_index()
+        index = index[np.argsort(index["offset"], kind="stable")]
+        times, values = self._columns()
+        picks = _ranges(index["offset"].astype(np.int64), index["length"].astype(np.int64))
+        new_times, new_values = np.array(times[picks]), np.array(values[picks])
+        new_index = index.copy()
+        new_index["offset"] = np.concatenate([[0], np.cumsum(index["length"].astype(np.int64))[:-1]])
+        del times, values
+        for path, arr in ((self._times_path, new_times), (self._values_path, new_values),
+                          (self._index_path, new_index)):
+            arr.tofile(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        self._n_points = len(new_times)
+
+
+# =========================
+# 集計（配列演算）
+# =========================
+def _ranges(starts, lengths):
+    """[start, start+length) を並べた位置の配列"""
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    seg_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.repeat(starts - seg_starts, lengths) + np.arange(total)
+
+def _window_block(index, times, values, cutoff, now, out_min, out_avg, out_last, coverage):
+    lengths = index["length"].astype(np.int64)
+    picks = _ranges(index["offset"].astype(np.int64), lengths)
+    t = times[picks].astype(np.int64)
+    v = values[picks].astype(np.int64)
+    seg_start = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    seg_end = seg_start + lengths - 1
+
+    # 各点の価格が続いた期間（窓 [cutoff, now] の中だけ）
+    nxt = np.empty_like(t)
+    nxt[:-1] = t[1:]
+    nxt[seg_end] = now
+    duration = np.clip(np.minimum(nxt, now) - np.maximum(t, cutoff), 0, None)
+    valid = (v >= 0) & (duration > 0)
+
+    big = np.iinfo(np.int64).max
+    seg_min = np.minimum.reduceat(np.where(valid, v, big), seg_start)
+    weight = np.where(valid, duration, 0)
+    seg_weight = np.add.reduceat(weight, seg_start)
+    seg_sum = np.add.reduceat(weight * np.where(valid, v, 0), seg_start)
+    has = seg_weight > 0
+
+    out_min[:] = np.where(has, seg_min, NO_VALUE)
+    out_avg[:] = np.where(has, seg_sum / np.maximum(seg_weight, 1), NO_VALUE)
+    last = v[seg_end]
+    out_last[:] = np.where(t[seg_end] <= now, last, NO_VALUE)
+    coverage[:] = seg_weight / max(1, now - cutoff)
+
+def _count(path, itemsize):
+    return os.path.getsize(path) // itemsize if os.path.exists(path) else 0
+
+
+# =========================
+# コマンドライン（集計を CSV に）
+# =========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="keepa_history", description="保存した価格履歴の集計")
+    parser.add_argument("--store", default=DEFAULT_HISTORY_PATH, help="履歴フォルダ（既定: ~/.keepa_cache/history）")
+    parser.add_argument("--kind", type=int, default=BUY_BOX_SHIPPING, help="Keepa の csv の種類（18 = BuyBox 送料込み）")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--out", required=True, help="出力 CSV（JAN, 最安値, 平均, 最新, 出品ありの割合）")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    stats = HistoryStore(args.store).window_stats(kind=args.kind, days=args.days)
+    with open(args.out, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(["JANコード", f"{args.days}日最安値", f"{args.days}日平均", "最新", "出品ありの割合"])
+        for row in zip(stats["jan"], stats["min"].tolist(), np.round(stats["avg"]).astype(np.int64).tolist(),
+                       stats["last"].tolist(), np.round(stats["coverage"], 3).tolist()):
+            writer.writerow(row)
+    print(f"{len(stats['jan'])}件を集計しました（{time.perf_counter() - started:.1f}秒）→ {args.out}")
+
+
+if __name__ == "__main__":
+    main()
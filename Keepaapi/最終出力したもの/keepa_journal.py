@@ -0,0 +1,106 @@
+# coding: utf-8
+"""
+Keepa 価格取得の途中経過ジャーナル（JSON Lines・追記のみ）
+
+・1件取得するごとに1行追記する（Excel を毎回書き直さない）
+・最終的な Excel は終了時に1回だけジャーナルから作る
+・中断した実行はジャーナルを読み直し、取得済みの行を飛ばして再開できる
+  （通信エラー等の一時的なエラーで記録した行は取得済みに数えず、再開で取り直す。
+   同じ行が2回記録されていたら後の記録を使う）
+
+1行目はメタ情報 {"_meta": {...}}、以降は結果1件ごとに
+{"row": 行番号, "JANコード": ..., "価格": ..., "商品名": ..., "備考": ...}
+"""
+
+import json
+import os
+
+import pandas as pd
+
+from keepa_retry import is_transient
+
+SYNC_INTERVAL = 100            # この件数ごとにディスクへ確実に書き出す（fsync）
+
+
+class ResultJournal:
+    def __init__(self, path, meta=None):
+        self.path = path
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        torn = False
+        if not is_new:
+            # 前回が書き込み途中で落ちていたら、その行を閉じてから追記する
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+        self._f = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        if torn:
+            self._f.write("\n")
+        if is_new and meta:
+            self._write({"_meta": meta})
+
+    def _write(self, obj):
+        self._f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def append(self, record):
+        self._write(record)
+        self._unsynced += 1
+        if self._unsynced >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        if not self._f.closed:
+            self.sync()
+            self._f.close()
+
+
+def _iter_lines(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # 書き込み途中で落ちた最終行などは読み飛ばす
+                continue
+
+def read_journal_meta(path):
+    for obj in _iter_lines(path):
+        if "_meta" in obj:
+            return obj["_meta"]
+        break
+    return {}
+
+def read_journal(path):
+    """結果レコードを書き込み順に返す"""
+    for obj in _iter_lines(path):
+        if "_meta" not in obj:
+            yield obj
+
+def load_done_rows(path):
+    """ジャーナルに記録済みの行番号の集合（再開時に飛ばす）。一時的なエラーで終わった行は含めない"""
+    if not path or not os.path.exists(path):
+        return set()
+    done = set()
+    for rec in read_journal(path):
+        if is_transient(rec.get("備考")):
+            done.discard(rec["row"])
+        else:
+            done.add(rec["row"])
+    return done
+
+def journal_to_dataframe(path, columns=("JANコード", "価格", "商品名", "備考")):
+    """ジャーナルを入力順（row順）の DataFrame にする"""
+    records = list(read_journal(path)) if os.path.exists(path) else []
+    df = pd.DataFrame(records, columns=["row", *columns])
+    df = df.drop_duplicates("row", keep="last")           # 再開で取り直した行は後の記録
+    df = df.sort_values("row", kind="stable").drop(columns=["row"]).reset_index(drop=True)
+    return df
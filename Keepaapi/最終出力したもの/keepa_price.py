@@ -0,0 +1,282 @@
+# coding: utf-8
+"""
+Keepa 価格決定（BuyBox > Prime > 先頭オファー）を商品の塊ごとにまとめて行う
+
+・decode_products() … /product の products をまとめて NumPy 配列に展開する
+    - BuyBox: stats.current[18]（送料込み）→ なければ stats.buyBoxPrice + buyBoxShipping
+    - オファー: offerCSV の末尾 [..., 時刻, 価格, 送料] を現在値として読む
+      （offerCSV が無いオファーは price / shipping キーを読む）
+    - 並び順は liveOffersOrder（無ければ offers の順）
+・display_prices() / buybox_prices() … 全商品の価格を1回の配列演算で決める
+・display_price_tuples() / buybox_price_tuples() … 同じ規則を1商品ずつ dict から直接決める
+
+戻り値の PriceColumns は列ごとの配列（商品名, 価格, 状態, ヒット数）。
+to_tuples() で従来の結果タプル (title, total_price_or_None, error_message_or_None, hit_count) に戻せる。
+価格が無いところは -1。
+
+配列方式は dict → 配列 の展開（Python のループ）が結局必要なうえ、配列の確保と
+to_tuples() の分だけ余計にかかる（bench_keepa_price.py では 10万件でも 1商品ずつの方が速い）。
+そのため1レスポンス（最大100件）ごとの価格決定は *_tuples() を使い、配列方式は
+配列のまま集計したいときに使う。
+
+product_times() は商品の lastUpdate / lastPriceChange（Keepa 時刻 = 2011-01-01 からの分）を
+UNIX 秒に直して返す（差分更新で「どれだけ価格が動いていないか」を見るため）。
+"""
+
+import numpy as np
+
+# =========================
+# 設定
+# =========================
+NO_VALUE = -1
+BUY_BOX_SHIPPING = 18          # stats.current の BuyBox（送料込み）の位置
+KEEPA_EPOCH_MINUTES = 21564000 # Keepa 時刻 0 の UNIX 時刻（分）
+
+# 状態
+OK = 0                         # 価格が決まった
+NO_PRICE = 1                   # オファーはあるが価格が取れない → 価格取得失敗
+NOT_FOUND = 2                  # オファーなし → 商品が見つからない
+UNDECIDED = 3                  # BuyBox だけでは決まらない（buybox_prices のみ）
+
+
+class OfferArrays:
+    """
+    decode_products() の結果。商品ごとの配列（長さ n）と、
+    全商品のオファーを並べた配列（長さ m、offer_product が商品の番号）。
+    """
+
+    def __init__(self, titles, buybox, hit_count, offer_product, offer_rank,
+                 offer_price, offer_shipping, offer_prime):
+        self.titles = titles
+        self.buybox = buybox
+        self.hit_count = hit_count
+        self.offer_product = offer_product
+        self.offer_rank = offer_rank
+        self.offer_price = offer_price
+        self.offer_shipping = offer_shipping
+        self.offer_prime = offer_prime
+
+    def __len__(self):
+        return len(self.titles)
+
+
+class PriceColumns:
+    """商品ごとの決定結果（列形式）"""
+
+    def __init__(self, titles, price, status, hit_count):
+        self.titles = titles
+        self.price = price
+        self.status = status
+        self.hit_count = hit_count
+
+    def __len__(self):
+        return len(self.titles)
+
+    def to_tuples(self):
+        """従来の結果タプルのリスト（UNDECIDED は None）"""
+        out = []
+        for title, price, status, hit in zip(self.titles, self.price.tolist(),
+                                             self.status.tolist(), self.hit_count.tolist()):
+            if status == OK:
+                out.append((title, price, None, hit))
+            elif status == NO_PRICE:
+                out.append((title, None, f"価格取得失敗（{hit}件ヒット）", hit))
+            elif status == NOT_FOUND:
+                out.append((title, None, "商品が見つからない", hit))
+            else:
+                out.append(None)
+        return out
+
+
+# =========================
+# 展開
+# =========================
+def _number(v):
+    return v if isinstance(v, (int, float)) else NO_VALUE
+
+def keepa_time(minutes):
+    """Keepa 時刻（分）→ UNIX 秒（無効な値は None）"""
+    if not isinstance(minutes, (int, float)) or minutes <= 0:
+        return None
+    return (minutes + KEEPA_EPOCH_MINUTES) * 60
+
+def product_times(product):
+    """商品 → (lastUpdate, lastPriceChange) の UNIX 秒"""
+    return keepa_time(product.get("lastUpdate")), keepa_time(product.get("lastPriceChange"))
+
+def _offer_price(offer):
+    """オファーの現在の (価格, 送料)"""
+    csv = offer.get("offerCSV")
+    if csv and len(csv) >= 3:
+        return _number(csv[-2]), _number(csv[-1])
+    return _number(offer.get("price")), _number(offer.get("shipping"))
+
+def decode_products(products):
+    """products（dict のリスト）→ OfferArrays"""
+    titles = []
+    bb_current, bb_price, bb_shipping, hit_count = [], [], [], []
+    o_product, o_rank, o_price, o_shipping, o_prime = [], [], [], [], []
+
+    for idx, product in enumerate(products):
+        titles.append(product.get("title", ""))
+
+        current = price = shipping = NO_VALUE
+        stats = product.get("stats")
+        if stats:
+            cur = stats.get("current")
+            if cur and len(cur) > BUY_BOX_SHIPPING:
+                current = _number(cur[BUY_BOX_SHIPPING])
+            price = _number(stats.get("buyBoxPrice"))
+            shipping = _number(stats.get("buyBoxShipping"))
+        bb_current.append(current)
+        bb_price.append(price)
+        bb_shipping.append(shipping)
+
+        offers = product.get("offers")
+        hit_count.append(len(offers) if offers else 0)
+        if not offers or current > 0 or price > 0:
+            # BuyBox で決まる商品のオファーは使わないので展開しない
+            continue
+        order = [i for i in product.get("liveOffersOrder") or () if isinstance(i, int) and 0 <= i < len(offers)]
+        ordered = [offers[i] for i in order] if order else offers
+        o_product.extend([idx] * len(ordered))
+        o_rank.extend(range(len(ordered)))
+        for offer in ordered:
+            p, s = _offer_price(offer)
+            o_price.append(p)
+            o_shipping.append(s)
+            o_prime.append(bool(offer.get("isPrime")))
+
+    bb_current = np.array(bb_current, dtype=np.int64)
+    bb_price = np.array(bb_price, dtype=np.int64)
+    bb_shipping = np.array(bb_shipping, dtype=np.int64)
+
+    # BuyBox（送料込み）: current[18] → buyBoxPrice + buyBoxShipping
+    buybox = np.where(
+        bb_current > 0, bb_current,
+        np.where(bb_price > 0, bb_price + np.maximum(bb_shipping, 0), NO_VALUE),
+    )
+    return OfferArrays(
+        titles, buybox, np.array(hit_count, dtype=np.int32),
+        np.array(o_product, dtype=np.int32),
+        np.array(o_rank, dtype=np.int32),
+        np.array(o_price, dtype=np.int64),
+        np.array(o_shipping, dtype=np.int64),
+        np.array(o_prime, dtype=bool),
+    )
+
+
+def _positive(v):
+    """正の数なら int、それ以外は 0"""
+    return int(v) if isinstance(v, (int, float)) and v > 0 else 0
+
+def _buybox_price(product):
+    """BuyBox（送料込み）。無ければ 0"""
+    stats = product.get("stats")
+    if not stats:
+        return 0
+    cur = stats.get("current")
+    if cur and len(cur) > BUY_BOX_SHIPPING:
+        current = _positive(cur[BUY_BOX_SHIPPING])
+        if current:
+            return current
+    price = _positive(stats.get("buyBoxPrice"))
+    return price + _positive(stats.get("buyBoxShipping")) if price else 0
+
+
+# =========================
+# 価格決定（1商品ずつ）
+# =========================
+def display_price_tuples(products):
+    """products → 結果タプルのリスト（BuyBox > Prime > 先頭オファー。display_prices と同じ結果）"""
+    out = []
+    append = out.append
+    for product in products:
+        title = product.get("title", "")
+        buybox = _buybox_price(product)
+        if buybox:
+            append((title, buybox, None, 0))
+            continue
+        offers = product.get("offers")
+        if not offers:
+            append((title, None, "商品が見つからない", 0))
+            continue
+        hit = len(offers)
+        order = product.get("liveOffersOrder")
+        if order:
+            ordered = [offers[i] for i in order if isinstance(i, int) and 0 <= i < hit] or offers
+        else:
+            ordered = offers
+        for chosen in ordered:
+            if chosen.get("isPrime"):
+                break
+        else:
+            chosen = ordered[0]
+        csv = chosen.get("offerCSV")
+        if csv and len(csv) >= 3:
+            price, shipping = _positive(csv[-2]), _positive(csv[-1])
+        else:
+            price, shipping = _positive(chosen.get("price")), _positive(chosen.get("shipping"))
+        if price:
+            append((title, price + shipping, None, hit))
+        else:
+            append((title, None, f"価格取得失敗（{hit}件ヒット）", hit))
+    return out
+
+def buybox_price_tuples(products):
+    """products → 結果タプルのリスト（BuyBox だけ。決まらない商品は None）"""
+    out = []
+    for product in products:
+        buybox = _buybox_price(product)
+        out.append((product.get("title", ""), buybox, None, 0) if buybox else None)
+    return out
+
+
+# =========================
+# 価格決定（配列）
+# =========================
+def _chosen_offers(arrays):
+    """
+    商品ごとに採用するオファー（Prime の先頭、なければ先頭）の位置。
+    戻り値: (商品の番号, オファーの位置)
+    """
+    if not len(arrays.offer_product):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    # 商品 → Prime を先に → 並び順 で並べ、各商品の先頭を取る
+    order = np.lexsort((arrays.offer_rank, ~arrays.offer_prime, arrays.offer_product))
+    product_sorted = arrays.offer_product[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = product_sorted[1:] != product_sorted[:-1]
+    return product_sorted[first], order[first]
+
+def select_prices(arrays):
+    """OfferArrays → PriceColumns（BuyBox > Prime > 先頭オファー）"""
+    price = arrays.buybox.copy()
+    hit_count = np.where(price > 0, 0, arrays.hit_count).astype(np.int32)
+
+    products, chosen = _chosen_offers(arrays)
+    offer_price = arrays.offer_price[chosen]
+    total = offer_price + np.maximum(arrays.offer_shipping[chosen], 0)
+    # BuyBox が無く、採用オファーに価格がある商品だけ
+    use = (offer_price > 0) & (price[products] <= 0)
+    price[products[use]] = total[use]
+
+    status = np.where(price > 0, OK, np.where(arrays.hit_count > 0, NO_PRICE, NOT_FOUND)).astype(np.int8)
+    price[status != OK] = NO_VALUE
+    return PriceColumns(arrays.titles, price, status, hit_count)
+
+def select_buybox(arrays):
+    """OfferArrays → PriceColumns（BuyBox だけ。無い商品は UNDECIDED）"""
+    price = arrays.buybox.copy()
+    status = np.where(price > 0, OK, UNDECIDED).astype(np.int8)
+    price[status != OK] = NO_VALUE
+    return PriceColumns(arrays.titles, price, status, np.zeros(len(arrays), dtype=np.int32))
+
+def display_prices(products):
+    """products → PriceColumns（表示価格）"""
+    return select_prices(decode_products(products))
+
+def buybox_prices(products):
+    """products → PriceColumns（BuyBox のみ）"""
+    return select_buybox(decode_products(products))
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""
+失敗したJANの再試行キューと、再試行しても取れなかったJANの退避ファイル
+
+・エラーの種類ごとに回数・待ち時間を決める（RETRY_POLICIES）
+    timeout   … 処理時間超過
+    server    … サーバエラー（HTTP 5xx）
+    throttled … トークン枯渇（HTTP 429）
+    parse     … 応答解析エラー / データなし
+    network   … 通信エラー（接続切れなど）
+・待ち時間は 基本秒数 × 2^(回数-1)（上限あり）にゆらぎ（jitter）を加える
+・RetryQueue は「何秒後に再試行するか」を覚えておくだけで、待っている間も
+  ほかのJANの取得は止めない（keepa_api.iter_fetched_chunks が期限の来た分から投げ直す）
+・一時的なエラーかどうかの判定（TRANSIENT_ERRORS / is_transient）もここだけで持つ
+  （keepa_core の記録・重複行への配布、keepa_cache の保存可否、keepa_journal の再開が同じ判定を使う）
+・回数を使い切ったJANは DeadLetterFile（CSV・見出しなし・1列目がJAN）に書き出す。
+  そのまま次の実行の入力ファイルとして渡せる
+"""
+
+import csv
+import heapq
+import os
+import random
+import threading
+import time
+
+# =========================
+# 設定
+# =========================
+class RetryPolicy:
+    def __init__(self, max_attempts, base_seconds, max_seconds, jitter=0.5):
+        self.max_attempts = max_attempts      # 最初の1回を含めない再試行の回数
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.jitter = jitter                  # 待ち時間のうちゆらがせる割合
+
+    def delay(self, attempt, rnd=random):
+        """attempt 回目（1始まり）の再試行までの秒数"""
+        delay = min(self.max_seconds, self.base_seconds * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter) + rnd.uniform(0, delay * self.jitter)
+
+
+RETRY_POLICIES = {
+    "timeout": RetryPolicy(3, 5, 60),
+    "server": RetryPolicy(5, 2, 120),
+    "throttled": RetryPolicy(20, 1, 30, jitter=0.2),   # 実際の待ちは TokenScheduler が補充時刻まで行う
+    "parse": RetryPolicy(2, 5, 30),
+    "network": RetryPolicy(5, 3, 120),
+}
+# 備考の文言 → エラーの種類（先に一致したもの）
+ERROR_CLASSES = (
+    ("処理時間超過", "timeout"),
+    ("サーバエラー", "server"),
+    ("トークン枯渇", "throttled"),
+    ("応答解析エラー", "parse"),
+    ("データなし", "parse"),
+    ("通信エラー", "network"),
+)
+# 一時的なエラー（確定した結果ではないので、キャッシュに残さず次回また取りに行く。
+#   ジャーナルに記録した行も、再開時は取得済みに数えずに取り直す）
+#   再試行する ERROR_CLASSES に加えて、キーが使えない・中断した・キャッシュに無かった分
+TRANSIENT_ERRORS = tuple(text for text, _ in ERROR_CLASSES) + ("APIキー無効", "中断", "キャッシュなし")
+
+
+def classify_error(error):
+    """結果の備考 → 再試行するエラーの種類（再試行しないものは None）"""
+    if not error:
+        return None
+    for text, kind in ERROR_CLASSES:
+        if text in error:
+            return kind
+    return None
+
+
+def is_transient(error):
+    """結果の備考が一時的なエラー（TRANSIENT_ERRORS）か"""
+    return bool(error) and any(text in error for text in TRANSIENT_ERRORS)
+
+
+# =========================
+# 再試行キュー
+# =========================
+class RetryQueue:
+    """
+    期限つきの再試行待ち。schedule() で積み、pop_due() で期限の来たものを取り出す。
+    複数スレッドから同時に使ってよい。
+    """
+
+    def __init__(self, policies=None, clock=time.monotonic, rnd=None):
+        self.policies = dict(RETRY_POLICIES if policies is None else policies)
+        self.clock = clock
+        self.rnd = rnd or random.Random()
+        self.attempts = {}          # (行番号, JAN) → 再試行した回数
+        self.scheduled = {}         # エラーの種類 → 積んだ回数
+        self.exhausted = 0          # 回数を使い切った件数
+        self._heap = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def schedule(self, row, jan, error):
+        """
+        再試行を積む。戻り値: 何秒後か（再試行しないエラー・回数切れは None）
+        """
+        kind = classify_error(error)
+        policy = self.policies.get(kind)
+        if policy is None:
+            return None
+        with self._lock:
+            attempt = self.attempts.get((row, jan), 0) + 1
+            if attempt > policy.max_attempts:
+                self.exhausted += 1
+                return None
+            self.attempts[(row, jan)] = attempt
+            self.scheduled[kind] = self.scheduled.get(kind, 0) + 1
+            delay = policy.delay(attempt, self.rnd)
+            self._seq += 1
+            heapq.heappush(self._heap, (self.clock() + delay, self._seq, row, jan))
+            return delay
+
+    def attempt(self, row, jan):
+        with self._lock:
+            return self.attempts.get((row, jan), 0)
+
+    def pop_due(self, limit):
+        """期限の来た (行番号, JAN) を古い順に最大 limit 件"""
+        out = []
+        with self._lock:
+            now = self.clock()
+            while self._heap and len(out) < limit and self._heap[0][0] <= now:
+                _, _, row, jan = heapq.heappop(self._heap)
+                out.append((row, jan))
+        return out
+
+    def next_due_in(self):
+        """次の期限までの秒数（空なら None）"""
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - self.clock())
+
+    def report(self):
+        """再試行の内訳を1行で"""
+        parts = [f"{kind} {n}回" for kind, n in self.scheduled.items()]
+        return f"再試行 {' / '.join(parts) if parts else 'なし'}・打ち切り {self.exhausted}件"
+
+
+# =========================
+# 退避ファイル
+# =========================
+class DeadLetterFile:
+    """
+    取れなかったJANを CSV（JAN, 元の行番号, 理由）で追記する。
+    見出しは付けない（1列目だけ読めば次の実行の入力になる）。最初の1件で作成する。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._f = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def append(self, row, jan, error):
+        with self._lock:
+            if self._f is None:
+                is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                self._f = open(self.path, "a", newline="", encoding="utf-8-sig" if is_new else "utf-8")
+                self._writer = csv.writer(self._f)
+            self._writer.writerow([jan, f"{row+1}行目", error])
+            self._f.flush()
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
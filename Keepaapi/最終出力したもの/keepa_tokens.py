@@ -0,0 +1,321 @@
+# coding: utf-8
+"""
+Keepa トークン管理（2_Keepa価格調査提出分.py / 3.Keepa統合実験.py 共通）
+
+Keepa のトークンは「refillIn ミリ秒後に refillRate 個」補充され、以後60秒ごとに
+refillRate 個ずつ増える（上限は refillRate × 60）。
+毎回のレスポンスに含まれる tokensLeft / refillIn / refillRate で手元のモデルを
+補正し、次の塊に必要なトークンが貯まるまでだけ待つことで 429 を避ける。
+
+問い合わせの種類（kind）ごとに1件あたりの消費量を別々に学習・集計できる
+（例: BuyBox だけの安い問い合わせと、オファー付きの高い問い合わせ）。
+
+KeyPool は複数の API キーをそれぞれの TokenScheduler で管理し、
+塊ごとに一番早く使えるキーへ振り分ける（429・認証エラーのキーは避ける）。
+
+clock / sleep は差し替え可能（テスト時に偽の時計を渡せる）。
+sleep を省略した場合の待機は halt() ですぐに起きる（Ctrl+C 等で取得をやめるとき、
+補充待ちのスレッドが待ち終わるまで終了が遅れないように）。
+"""
+
+import math
+import threading
+import time
+
+# =========================
+# 設定
+# =========================
+REFILL_PERIOD = 60.0            # 補充間隔（秒）
+BUCKET_MINUTES = 60             # 上限 = refillRate × 60
+DEFAULT_TOKENS_PER_ITEM = 10    # 実績が出るまでの1件あたり消費見込み
+LOG_WAIT_THRESHOLD = 5.0        # これ以上待つときだけログを出す（秒）
+
+
+def _log_wait(log, cost, wait, logged_minute):
+    """待ち時間のログ（最初に1回、以後は分が変わったときだけ）。戻り値: 今回の分"""
+    if wait < LOG_WAIT_THRESHOLD:
+        return logged_minute
+    minute = math.ceil(wait / 60)
+    if logged_minute is None:
+        log(f"🪙 トークン待ち（必要{cost}）→ 約{wait:.0f}秒待機します。\n")
+    elif minute != logged_minute:
+        log(f"⏳ 残り {minute} 分...\n")
+    return minute
+
+def parse_api_keys(text):
+    """「key1,key2」や改行・空白区切りの入力 → キーのリスト（重複は除く）"""
+    if isinstance(text, (list, tuple)):
+        text = ",".join(text)
+    keys = [k.strip() for k in text.replace("\n", ",").replace(" ", ",").split(",")]
+    return list(dict.fromkeys(k for k in keys if k))
+
+def mask_key(key):
+    """ログ用にキーの末尾4文字だけ見せる"""
+    return f"…{key[-4:]}"
+
+
+class TokenScheduler:
+    """
+    tokensLeft / refillIn / refillRate から残りトークンを見積もり、
+    acquire() で必要量が貯まるまで待ってから予約する。
+    複数スレッドから同時に使ってよい。
+    """
+
+    def __init__(self, tokens_per_item=DEFAULT_TOKENS_PER_ITEM, log=None, stop=None,
+                 clock=time.monotonic, sleep=None, kind_rates=None):
+        self.tokens_per_item = float(tokens_per_item)
+        # kind ごとの1件あたり消費見込み（無い kind は tokens_per_item）
+        self.kind_rates = {k: float(v) for k, v in (kind_rates or {}).items()}
+        self.log = log or (lambda text: None)
+        self.stop = stop or (lambda: False)
+        self.clock = clock
+        self._halted = threading.Event()
+        self.sleep = sleep or self._halted.wait
+
+        self.tokens = None          # 不明（最初のレスポンスまで）
+        self.refill_rate = None     # 1分あたりの補充量
+        self.next_refill = None     # 次に補充される時刻（clock 基準）
+        self.blocked_until = None   # 429 で残量不明のときの待機期限
+        self.in_flight = 0          # 予約済みでまだレスポンスが返っていない分
+        self.wait_seconds = 0.0     # 待機した合計秒数
+        self.tokens_consumed = 0    # Keepa が報告した消費トークン合計
+        self.usage = {}             # kind → [取得件数, 消費トークン]
+        self._lock = threading.Lock()
+
+    # ---------- 見積もり ----------
+    def rate(self, kind=None):
+        """1件あたりの消費見込み"""
+        return self.kind_rates.get(kind, self.tokens_per_item)
+
+    def estimate(self, n_items, kind=None):
+        """n_items 件の取得に必要なトークン見込み"""
+        return max(1, math.ceil(n_items * self.rate(kind)))
+
+    @property
+    def capacity(self):
+        if not self.refill_rate:
+            return None
+        return self.refill_rate * BUCKET_MINUTES
+
+    def _advance(self, now):
+        """now までに発生した補充を反映する"""
+        if self.tokens is None or self.next_refill is None or not self.refill_rate:
+            return
+        if now < self.next_refill:
+            return
+        refills = int((now - self.next_refill) // REFILL_PERIOD) + 1
+        self.tokens = min(self.tokens + refills * self.refill_rate, self.capacity)
+        self.next_refill += refills * REFILL_PERIOD
+
+    def _wait_time(self, cost, now):
+        if self.blocked_until is not None and now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens is None:
+            return 0.0
+        # 上限を超える塊は「満タンになるまで」で打ち切る
+        if self.capacity is not None:
+            cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        if not self.refill_rate or self.next_refill is None:
+            return REFILL_PERIOD
+        refills = math.ceil((cost - self.tokens) / self.refill_rate)
+        return max(0.0, self.next_refill + (refills - 1) * REFILL_PERIOD - now)
+
+    def wait_time(self, n_items, kind=None):
+        """n_items 件分のトークンが貯まるまでの秒数"""
+        with self._lock:
+            now = self.clock()
+            self._advance(now)
+            return self._wait_time(self.estimate(n_items, kind), now)
+
+    # ---------- 予約・補正 ----------
+    def _reserve(self, cost):
+        """予約できれば 0、できなければ貯まるまでの秒数"""
+        with self._lock:
+            now = self.clock()
+            self._advance(now)
+            wait = self._wait_time(cost, now)
+            if wait <= 0:
+                if self.tokens is not None:
+                    self.tokens -= cost
+                self.in_flight += cost
+                return 0.0
+            return wait
+
+    def try_acquire(self, n_items, kind=None):
+        """待たずに予約できれば予約したトークン数、できなければ None"""
+        cost = self.estimate(n_items, kind)
+        return cost if self._reserve(cost) <= 0 else None
+
+    def acquire(self, n_items, kind=None):
+        """
+        n_items 件分のトークンが貯まるまで待って予約する。
+        戻り値: 予約したトークン数（停止ボタンで中断した場合は None）
+        """
+        cost = self.estimate(n_items, kind)
+        logged_minute = None
+        while True:
+            wait = self._reserve(cost)
+            if wait <= 0:
+                return cost
+            if self.stop() or self._halted.is_set():
+                return None
+            logged_minute = _log_wait(self.log, cost, wait, logged_minute)
+            step = min(wait, 1.0)
+            self.sleep(step)
+            with self._lock:
+                self.wait_seconds += step
+
+    def halt(self):
+        """待機中・これからの acquire() をすぐに None で返す（取得をやめるときに呼ぶ）"""
+        self._halted.set()
+
+    def update(self, data, reserved, n_items=0, kind=None):
+        """
+        Keepa のレスポンス（429含む）でモデルを補正し、予約を解放する。
+        data が None（通信エラー等）のときは予約だけ戻す。
+        """
+        with self._lock:
+            now = self.clock()
+            self.in_flight = max(0, self.in_flight - reserved)
+            if not isinstance(data, dict) or "tokensLeft" not in data:
+                if self.tokens is not None:
+                    self.tokens += reserved
+                return
+
+            self.blocked_until = None
+            if data.get("refillRate"):
+                self.refill_rate = data["refillRate"]
+            if data.get("refillIn") is not None:
+                self.next_refill = now + data["refillIn"] / 1000.0
+            # サーバ値は他の実行中リクエストの分をまだ含まない
+            self.tokens = data["tokensLeft"] - self.in_flight
+
+            consumed = data.get("tokensConsumed")
+            if consumed:
+                self.tokens_consumed += consumed
+                used = self.usage.setdefault(kind, [0, 0])
+                used[0] += n_items
+                used[1] += consumed
+                if n_items:
+                    # 1件あたりの消費量を実績で更新（指数移動平均）
+                    ema = 0.7 * self.rate(kind) + 0.3 * (consumed / n_items)
+                    if kind is not None:
+                        self.kind_rates[kind] = ema
+                    else:
+                        self.tokens_per_item = ema
+
+    def throttled(self):
+        """
+        429 を受けたときに呼ぶ。残量は0以下とみなし、
+        補充情報が分からなければ1補充分（60秒）待つ。
+        """
+        with self._lock:
+            if self.tokens is not None and self.refill_rate and self.next_refill is not None:
+                self.tokens = min(self.tokens, 0)
+            else:
+                self.blocked_until = self.clock() + REFILL_PERIOD
+
+
+class KeyPool:
+    """
+    複数の Keepa API キーのトークンを別々に管理する。
+    acquire() は待ち時間が一番短いキー（同じなら残りトークンが多いキー）で予約し、
+    どのキーも足りなければ一番早く貯まるキーを待つ。
+    認証エラーのキーは disable() で以後使わない。
+    """
+
+    def __init__(self, keys, tokens_per_item=DEFAULT_TOKENS_PER_ITEM, log=None, stop=None,
+                 clock=time.monotonic, sleep=None, kind_rates=None):
+        self.keys = parse_api_keys(keys)
+        if not self.keys:
+            raise ValueError("APIキーがありません")
+        self.log = log or (lambda text: None)
+        self.stop = stop or (lambda: False)
+        self._halted = threading.Event()
+        self.sleep = sleep or self._halted.wait
+        self.schedulers = {
+            key: TokenScheduler(tokens_per_item, self.log, self.stop, clock, sleep, kind_rates)
+            for key in self.keys
+        }
+        self.disabled = {}          # キー → 除外した理由
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def available(self):
+        with self._lock:
+            return [k for k in self.keys if k not in self.disabled]
+
+    def disable(self, key, reason):
+        with self._lock:
+            if key in self.disabled:
+                return
+            self.disabled[key] = reason
+        self.log(f"🔑 APIキー{mask_key(key)}を除外しました（{reason}）。\n")
+
+    def _best(self, n_items, kind):
+        best = None
+        for key in self.available():
+            s = self.schedulers[key]
+            tokens = s.tokens if s.tokens is not None else math.inf
+            score = (s.wait_time(n_items, kind), -tokens)
+            if best is None or score < best[0]:
+                best = (score, key)
+        return best
+
+    def acquire(self, n_items, kind=None):
+        """
+        一番早く使えるキーで n_items 件分を予約する。
+        戻り値: (キー, そのキーの TokenScheduler, 予約したトークン数)
+                停止ボタンで中断した場合・使えるキーが無い場合は None
+        """
+        logged_minute = None
+        while True:
+            best = self._best(n_items, kind)
+            if best is None:
+                return None
+            (wait, _), key = best
+            if wait <= 0:
+                reserved = self.schedulers[key].try_acquire(n_items, kind)
+                if reserved is not None:
+                    return key, self.schedulers[key], reserved
+                continue
+            if self.stop() or self._halted.is_set():
+                return None
+            logged_minute = _log_wait(self.log, self.schedulers[key].estimate(n_items, kind), wait, logged_minute)
+            step = min(wait, 1.0)
+            self.sleep(step)
+            with self._lock:
+                self.wait_seconds += step
+
+    def halt(self):
+        """待機中・これからの acquire() をすぐに None で返す（全キー）"""
+        self._halted.set()
+        for s in self.schedulers.values():
+            s.halt()
+
+    # ---------- 集計（全キー合計） ----------
+    @property
+    def tokens_consumed(self):
+        return sum(s.tokens_consumed for s in self.schedulers.values())
+
+    @property
+    def usage(self):
+        total = {}
+        for s in self.schedulers.values():
+            for kind, (items, tokens) in list(s.usage.items()):
+                used = total.setdefault(kind, [0, 0])
+                used[0] += items
+                used[1] += tokens
+        return total
+
+    def key_report(self):
+        """キーごとの消費トークン（除外したキーは理由つき）"""
+        parts = []
+        for key in self.keys:
+            text = f"{mask_key(key)} {self.schedulers[key].tokens_consumed}"
+            if key in self.disabled:
+                text += f"（除外: {self.disabled[key]}）"
+            parts.append(text)
+        return " / ".join(parts)
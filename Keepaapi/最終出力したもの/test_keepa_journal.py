@@ -0,0 +1,60 @@
+# coding: utf-8
+"""
+keepa_journal の再開のテスト（一時的なエラーで記録した行を取り直すか）
+
+    python -m pytest test_keepa_journal.py
+"""
+
+import keepa_api
+from keepa_core import PriceLookup
+from keepa_journal import ResultJournal, journal_to_dataframe, load_done_rows
+
+
+def journal_rows(path, records):
+    journal = ResultJournal(str(path), meta={"input": None})
+    for row, jan, price, error in records:
+        journal.append({"row": row, "JANコード": jan, "価格": price, "商品名": "", "備考": error})
+    journal.close()
+
+
+def test_transient_rows_are_not_done(tmp_path):
+    path = tmp_path / "run.jsonl"
+    journal_rows(path, [
+        (0, "111", 1000, ""),
+        (1, "222", "Null", "通信エラー: ConnectionError"),
+        (2, "333", "Null", "商品が見つからない"),
+    ])
+    assert load_done_rows(str(path)) == {0, 2}
+
+
+def test_later_record_of_a_row_wins(tmp_path):
+    path = tmp_path / "run.jsonl"
+    journal_rows(path, [
+        (0, "111", "Null", "APIキー無効"),
+        (0, "111", 1000, ""),
+    ])
+    assert load_done_rows(str(path)) == {0}
+    df = journal_to_dataframe(str(path))
+    assert df["価格"].tolist() == [1000]
+
+
+def test_resume_fetches_transient_row_again(tmp_path, monkeypatch):
+    path = tmp_path / "run.jsonl"
+    journal_rows(path, [
+        (0, "111", 1000, ""),
+        (1, "222", "Null", "通信エラー: ConnectionError"),
+    ])
+    asked = []
+
+    def fake_fetch(api_key, codes, *args, **kwargs):
+        asked.extend(codes)
+        return [("商品", 2000, None, 1) for _ in codes]
+
+    monkeypatch.setattr(keepa_api, "fetch_top_display_prices", fake_fetch)
+    lookup = PriceLookup("key", str(path), cache_path=str(tmp_path / "cache.sqlite3"), validate_jans=False)
+    records = list(lookup.run([(0, "111"), (1, "222")], resume=True))
+
+    assert asked == ["222"]
+    assert [r["row"] for r in records] == [1]
+    assert load_done_rows(str(path)) == {0, 1}
+    assert journal_to_dataframe(str(path))["価格"].tolist() == [1000, 2000]
@@ -0,0 +1,265 @@
+# coding: utf-8
+"""
+keepa_tokens のテスト（偽の時計で待ち時間を確かめる）
+
+    python -m pytest test_keepa_tokens.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from keepa_tokens import REFILL_PERIOD, KeyPool, TokenScheduler
+
+
+class FakeClock:
+    """sleep() で進むだけの時計。sleep した秒数を記録する"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_scheduler(clock, tokens_per_item=10, **kwargs):
+    return TokenScheduler(tokens_per_item, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def response(tokens_left, refill_in_ms=10_000, refill_rate=20, consumed=None):
+    data = {"tokensLeft": tokens_left, "refillIn": refill_in_ms, "refillRate": refill_rate}
+    if consumed is not None:
+        data["tokensConsumed"] = consumed
+    return data
+
+
+# =========================
+# 待ち時間
+# =========================
+def test_no_wait_before_first_response():
+    clock = FakeClock()
+    s = make_scheduler(clock)
+    assert s.acquire(10) == 100
+    assert clock.slept == []
+
+
+def test_wait_is_deficit_over_refill_rate():
+    clock = FakeClock()
+    s = make_scheduler(clock)
+    s.update(response(tokens_left=20, refill_in_ms=10_000, refill_rate=20), reserved=0)
+
+    # 100 必要・残り 20 → 不足 80 / 20 = 4 回の補充。最初の補充は 10 秒後、以後 60 秒ごと
+    expected = 10 + (80 / 20 - 1) * REFILL_PERIOD
+    assert s.wait_time(10) == pytest.approx(expected)
+
+    started = clock.now
+    assert s.acquire(10) == 100
+    assert clock.now - started == pytest.approx(expected)
+    assert s.wait_seconds == pytest.approx(expected)
+    assert s.tokens == pytest.approx(0)
+
+
+def test_wait_rounds_partial_refill_up():
+    clock = FakeClock()
+    s = make_scheduler(clock)
+    s.update(response(tokens_left=90, refill_in_ms=5_000, refill_rate=20), reserved=0)
+    # 不足 10 でも補充は 20 ずつなので、次の補充（5 秒後）まで
+    assert s.wait_time(10) == pytest.approx(5)
+
+
+def test_no_wait_when_bucket_has_enough():
+    clock = FakeClock()
+    s = make_scheduler(clock)
+    s.update(response(tokens_left=500), reserved=0)
+    assert s.acquire(10) == 100
+    assert clock.slept == []
+    assert s.tokens == 400
+
+
+def test_in_flight_reservations_are_subtracted_from_server_value():
+    clock = FakeClock()
+    s = make_scheduler(clock)
+    s.update(response(tokens_left=300), reserved=0)
+    first = s.acquire(10)
+    second = s.acquire(10)
+    # 1つ目の応答: サーバ値 200 には、まだ返っていない2つ目の 100 が入っていない
+    s.update(response(tokens_left=200, consumed=100), first, n_items=10)
+    assert s.in_flight == second
+    assert s.tokens == 100
+
+
+# =========================
+# 429
+# =========================
+def test_429_body_refreshes_bucket():
+    clock = FakeClock()
+    s = make_scheduler(clock)
+    s.update(response(tokens_left=1000), reserved=0)
+    reserved = s.acquire(10)
+
+    # 429 の本文にも tokensLeft / refillIn / refillRate が入っている
+    s.throttled()
+    s.update(response(tokens_left=-40, refill_in_ms=30_000, refill_rate=50), reserved)
+    assert s.tokens == -40
+    assert s.refill_rate == 50
+    assert s.next_refill == pytest.approx(clock.now + 30)
+    assert s.blocked_until is None
+    # 不足 140 / 50 → 3 回の補充
+    assert s.wait_time(10) == pytest.approx(30 + 2 * REFILL_PERIOD)
+
+
+def test_429_without_body_blocks_one_refill_period():
+    clock = FakeClock()
+    s = make_scheduler(clock)
+    reserved = s.acquire(1)
+    s.throttled()
+    s.update(None, reserved)
+    assert s.wait_time(1) == pytest.approx(REFILL_PERIOD)
+    clock.sleep(REFILL_PERIOD)
+    assert s.wait_time(1) == 0
+
+
+# =========================
+# 1件あたりの消費量
+# =========================
+def test_tokens_consumed_corrects_per_item_estimate():
+    clock = FakeClock()
+    s = make_scheduler(clock, tokens_per_item=10)
+    s.update(response(tokens_left=10_000), reserved=0)
+    reserved = s.acquire(10)
+    s.update(response(tokens_left=9_980, consumed=20), reserved, n_items=10)
+
+    # 実績 2/件 に向けて指数移動平均で寄せる
+    assert s.rate() == pytest.approx(0.7 * 10 + 0.3 * 2)
+    assert s.tokens_consumed == 20
+    assert s.usage == {None: [10, 20]}
+    assert s.estimate(10) == 76
+
+
+def test_tokens_consumed_is_learned_per_kind():
+    clock = FakeClock()
+    s = make_scheduler(clock, tokens_per_item=10, kind_rates={"buybox": 2})
+    s.update(response(tokens_left=10_000), reserved=0)
+    reserved = s.acquire(10, "offers")
+    s.update(response(tokens_left=9_940, consumed=60), reserved, n_items=10, kind="offers")
+
+    assert s.rate("offers") == pytest.approx(0.7 * 10 + 0.3 * 6)
+    assert s.rate("buybox") == 2
+    assert s.rate() == 10
+
+
+def test_failed_request_returns_reservation():
+    clock = FakeClock()
+    s = make_scheduler(clock)
+    s.update(response(tokens_left=300), reserved=0)
+    reserved = s.acquire(10)
+    assert s.tokens == 200
+    s.update(None, reserved)
+    assert s.tokens == 300
+    assert s.in_flight == 0
+
+
+# =========================
+# 停止
+# =========================
+def test_stop_ends_wait_loop():
+    clock = FakeClock()
+    stopped = []
+    s = make_scheduler(clock, stop=lambda: bool(stopped))
+    s.update(response(tokens_left=0, refill_in_ms=60_000, refill_rate=1), reserved=0)
+
+    def sleep(seconds):
+        clock.sleep(seconds)
+        if clock.now - 1000.0 >= 3:
+            stopped.append(True)
+
+    s.sleep = sleep
+    assert s.acquire(10) is None
+    assert clock.now - 1000.0 < 5
+    assert s.in_flight == 0
+
+
+def test_key_pool_stop_ends_wait_loop():
+    clock = FakeClock()
+    stopped = []
+    pool = KeyPool("a,b", clock=clock, sleep=clock.sleep, stop=lambda: bool(stopped))
+    for s in pool.schedulers.values():
+        s.update(response(tokens_left=0, refill_in_ms=60_000, refill_rate=1), reserved=0)
+    stopped.append(True)
+    assert pool.acquire(10) is None
+    assert clock.slept == []
+
+
+def test_halt_wakes_waiting_acquire():
+    # sleep を渡さないときの待機は halt() ですぐ起きる（Ctrl+C で補充待ちのまま終われない、を防ぐ）
+    s = TokenScheduler(10)
+    s.update(response(tokens_left=0, refill_in_ms=60_000, refill_rate=1), reserved=0)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(s.acquire(10)))
+    worker.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    s.halt()
+    worker.join(timeout=2)
+    assert not worker.is_alive()
+    assert results == [None]
+    assert time.monotonic() - started < 0.5
+    assert s.acquire(10) is None
+
+
+def test_key_pool_halt_wakes_waiting_acquire():
+    pool = KeyPool("aaaa1111,bbbb2222")
+    for s in pool.schedulers.values():
+        s.update(response(tokens_left=0, refill_in_ms=60_000, refill_rate=1), reserved=0)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(pool.acquire(10)))
+    worker.start()
+    time.sleep(0.1)
+    pool.halt()
+    worker.join(timeout=2)
+    assert not worker.is_alive()
+    assert results == [None]
+
+
+# =========================
+# 複数キー
+# =========================
+def test_key_pool_prefers_key_with_tokens():
+    clock = FakeClock()
+    pool = KeyPool("aaaa1111,bbbb2222", clock=clock, sleep=clock.sleep)
+    pool.schedulers["aaaa1111"].update(response(tokens_left=0), reserved=0)
+    pool.schedulers["bbbb2222"].update(response(tokens_left=500), reserved=0)
+
+    key, scheduler, reserved = pool.acquire(10)
+    assert key == "bbbb2222"
+    assert reserved == 100
+    assert scheduler.tokens == 400
+    assert clock.slept == []
+
+
+def test_key_pool_waits_for_earliest_refill():
+    clock = FakeClock()
+    pool = KeyPool("aaaa1111,bbbb2222", clock=clock, sleep=clock.sleep)
+    pool.schedulers["aaaa1111"].update(response(tokens_left=0, refill_in_ms=50_000, refill_rate=100), reserved=0)
+    pool.schedulers["bbbb2222"].update(response(tokens_left=0, refill_in_ms=20_000, refill_rate=100), reserved=0)
+
+    started = clock.now
+    key, _, _ = pool.acquire(10)
+    assert key == "bbbb2222"
+    assert clock.now - started == pytest.approx(20)
+
+
+def test_key_pool_skips_disabled_keys():
+    clock = FakeClock()
+    pool = KeyPool("aaaa1111,bbbb2222", clock=clock, sleep=clock.sleep)
+    pool.disable("aaaa1111", "認証エラー")
+    key, _, _ = pool.acquire(1)
+    assert key == "bbbb2222"
+    pool.disable("bbbb2222", "認証エラー")
+    assert pool.acquire(1) is None
@@ -0,0 +1,428 @@
+# coding: utf-8
+"""
+Keepa / Yahoo!ショッピング API のローカル模擬サーバ（計測・動作確認用）
+
+本物のトークンや回数制限を使わずに、ツールのコードをそのまま流して速度を測るためのもの。
+
+    python bench/api_simulator.py --port 8765
+    → Keepa:  http://127.0.0.1:8765/product
+      Yahoo:  http://127.0.0.1:8765/ShoppingWebService/V3/itemSearch
+      集計:   http://127.0.0.1:8765/stats
+
+Keepa /product
+  ・code= は最大100件。JANごとに決まった疑似商品を返す（約1割は見つからない）
+  ・トークン: キーごとに1分ごとに refill_rate 個補充（上限 refill_rate × 60）。残りが0以下なら 429
+    invalid_keys に含まれるキー・空のキーは 401
+  ・error_rate を指定するとその割合のリクエストを 503 にする（再試行の確認用）
+    消費は 1件1 + buybox=1 なら2 + オファー10件ごとに6（offers= の範囲内）
+  ・tokensLeft / refillIn / refillRate / tokensConsumed を返す
+  ・商品の lastUpdate は直近1日以内、lastPriceChange はその平均30日前（指数分布）
+  ・history=1 なら csv（Amazon / 新品 / BuyBox 送料込み）の価格履歴を days= 日分（既定365日）返す
+  ・minute_seconds で「1分」を縮められる（補充待ちを含めて短時間で試すとき）
+    ※ クライアント側は2回目以降の補充間隔を60秒とみなすので、縮めると待ちは長めに出る
+
+Yahoo itemSearch
+  ・seller_id ごと（なければ genre_category_id ごと、それもなければ query 全体）の疑似カタログを price_from / price_to / sort=+price で絞る
+  ・start + results - 1 が 1000 を超えると 400（本物と同じ上限）
+  ・totalResultsAvailable / totalResultsReturned / firstResultsPosition / hits を返す
+  ・qps を指定すると appid ごとに1秒あたりの回数を超えた分を 429 にする
+  ・error_rate を指定するとその割合のリクエストを 503 にする（ページの取り直しの確認用）
+  ・missing_sellers に入れた seller_id は 400（存在しない販売者。一括取得の確認用）
+"""
+
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# =========================
+# 設定
+# =========================
+KEEPA_MAX_CODES = 100
+YAHOO_MAX_RESULTS = 100
+YAHOO_MAX_POSITION = 1000
+BUY_BOX_SHIPPING = 18
+KEEPA_EPOCH_MINUTES = 21564000
+
+
+# =========================
+# Keepa
+# =========================
+class _Bucket:
+    """APIキー1つ分のトークン"""
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.last_refill = now
+
+
+class KeepaSimulator:
+    def __init__(self, refill_rate=20, tokens=None, minute_seconds=60.0, latency=0.0,
+                 latency_per_code=0.0, not_found_rate=0.1, buybox_rate=0.7, invalid_keys=(),
+                 error_rate=0.0, seed=0, clock=time.monotonic):
+        self.refill_rate = refill_rate
+        self.capacity = refill_rate * 60
+        self.initial_tokens = self.capacity if tokens is None else tokens
+        self.minute_seconds = minute_seconds
+        self.latency = latency
+        self.latency_per_code = latency_per_code
+        self.not_found_rate = not_found_rate
+        self.buybox_rate = buybox_rate
+        self.invalid_keys = set(invalid_keys)
+        self.error_rate = error_rate
+        self.clock = clock
+        self._rnd = random.Random(seed)
+
+        self.requests = 0
+        self.throttled = 0
+        self.unauthorized = 0
+        self.server_errors = 0
+        self.codes = 0
+        self.tokens_consumed = 0
+        self.by_key = {}          # キー → 消費トークン
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.initial_tokens, now)
+        periods = int((now - bucket.last_refill) // self.minute_seconds)
+        if periods > 0:
+            bucket.tokens = min(self.capacity, bucket.tokens + periods * self.refill_rate)
+            bucket.last_refill += periods * self.minute_seconds
+        return bucket
+
+    def _refill_in_ms(self, bucket, now):
+        left = bucket.last_refill + self.minute_seconds - now
+        return max(0, int(left * 1000))
+
+    def _product(self, code, stats, buybox, offers, history=0, days=365):
+        """code ごとに毎回同じ疑似商品（見つからなければ None）と消費トークン"""
+        rnd = random.Random(code)
+        if rnd.random() < self.not_found_rate:
+            return None, 1
+        product = {"asin": f"B0{rnd.randint(0, 10**8 - 1):08d}", "title": f"疑似商品 {code}", "eanList": [code]}
+        has_buybox = rnd.random() < self.buybox_rate
+        n_offers = rnd.choice((0, 1, 2, 3, 5, 8, 12, 20))
+        base = rnd.randint(300, 30000)
+        cost = 1
+        if stats:
+            current = [-1] * (BUY_BOX_SHIPPING + 1)
+            if has_buybox:
+                current[BUY_BOX_SHIPPING] = base
+            product["stats"] = {"current": current}
+        if buybox:
+            cost += 2
+            if has_buybox:
+                product.setdefault("stats", {}).update({"buyBoxPrice": base, "buyBoxShipping": 0})
+        if offers:
+            shown = min(n_offers, offers)
+            cost += 6 * ((shown + 9) // 10)
+            product["offers"] = [
+                {
+                    "offerCSV": [7_000_000, base + rnd.randint(0, 2000), rnd.choice((0, 0, 350))],
+                    "isPrime": rnd.random() < 0.3,
+                    "isFBA": rnd.random() < 0.3,
+                }
+                for _ in range(shown)
+            ]
+            product["liveOffersOrder"] = list(range(shown))
+        # 時刻は段（stats / offers）によらず同じになるよう別の乱数で
+        times = random.Random(f"{code}:time")
+        now = int(time.time() // 60) - KEEPA_EPOCH_MINUTES
+        product["lastUpdate"] = now - times.randint(0, 24 * 60)
+        product["lastPriceChange"] = product["lastUpdate"] - int(times.expovariate(1 / (30 * 24 * 60)))
+        if history:
+            product["csv"] = self._history(code, base if has_buybox else -1, product["lastPriceChange"], days)
+        return product, cost
+
+    def _history(self, code, current, last_change, days):
+        """平均3日ごとに価格が変わる履歴（最後の値 = 今の BuyBox 価格）"""
+        rnd = random.Random(f"{code}:history")
+        start = last_change - days * 24 * 60
+        stamps = [last_change]
+        while stamps[-1] > start:
+            stamps.append(stamps[-1] - int(rnd.expovariate(1 / (3 * 24 * 60))) - 1)
+        stamps.reverse()
+        prices = [rnd.choice((-1, current, current + rnd.randint(-300, 1500))) for _ in stamps[:-1]] + [current]
+        csv = [None] * (BUY_BOX_SHIPPING + 1)
+        csv[0] = [v for t, p in zip(stamps, prices) for v in (t, p if rnd.random() < 0.5 else -1)]
+        csv[1] = [v for t, p in zip(stamps, prices) for v in (t, p)]
+        csv[BUY_BOX_SHIPPING] = [v for t, p in zip(stamps, prices) for v in (t, p, 0)]
+        return csv
+
+    def handle(self, params):
+        """戻り値: (HTTPステータス, JSON)"""
+        codes = [c for c in params.get("code", "").split(",") if c]
+        if not codes or len(codes) > KEEPA_MAX_CODES:
+            return 400, {"error": {"message": f"code は1〜{KEEPA_MAX_CODES}件"}}
+        stats = int(params.get("stats") or 0)
+        buybox = int(params.get("buybox") or 0)
+        offers = int(params.get("offers") or 0)
+        history = int(params.get("history") or 0)
+        days = int(params.get("days") or 365)
+        key = params.get("key") or ""
+
+        with self._lock:
+            self.requests += 1
+            if not key or key in self.invalid_keys:
+                self.unauthorized += 1
+                return 401, {"error": {"message": "invalid access key"}}
+            if self.error_rate and self._rnd.random() < self.error_rate:
+                self.server_errors += 1
+                return 503, {"error": {"message": "service unavailable"}}
+            now = self.clock()
+            bucket = self._bucket(key, now)
+            if bucket.tokens <= 0:
+                self.throttled += 1
+                return 429, {
+                    "tokensLeft": bucket.tokens, "refillIn": self._refill_in_ms(bucket, now),
+                    "refillRate": self.refill_rate, "tokensConsumed": 0,
+                }
+
+        products, cost = [], 0
+        for code in codes:
+            product, c = self._product(code, stats, buybox, offers, history, days)
+            cost += c
+            if product is not None:
+                products.append(product)
+
+        delay = self.latency + self.latency_per_code * len(codes)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            now = self.clock()
+            bucket = self._bucket(key, now)
+            bucket.tokens -= cost
+            self.codes += len(codes)
+            self.tokens_consumed += cost
+            self.by_key[key] = self.by_key.get(key, 0) + cost
+            return 200, {
+                "products": products,
+                "tokensLeft": bucket.tokens, "refillIn": self._refill_in_ms(bucket, now),
+                "refillRate": self.refill_rate, "tokensConsumed": cost,
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests, "throttled": self.throttled, "unauthorized": self.unauthorized,
+                "server_errors": self.server_errors,
+                "codes": self.codes, "tokens_consumed": self.tokens_consumed,
+                "tokens_by_key": dict(self.by_key),
+            }
+
+
+# =========================
+# Yahoo
+# =========================
+def _jan(body):
+    """12桁 + チェックディジット"""
+    odd = sum(int(d) for d in body[0::2])
+    even = sum(int(d) for d in body[1::2])
+    return body + str((10 - (odd + even * 3) % 10) % 10)
+
+
+class YahooSimulator:
+    def __init__(self, items_per_seller=5000, query_items=100_000, stores=500, latency=0.0, qps=0,
+                 error_rate=0.0, seed=0, missing_sellers=(), clock=time.monotonic):
+        self.items_per_seller = items_per_seller
+        self.missing_sellers = set(missing_sellers)
+        self.query_items = query_items
+        self.stores = stores
+        self.latency = latency
+        self.qps = qps
+        self.error_rate = error_rate
+        self.clock = clock
+
+        self.requests = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.server_errors = 0
+        self._rnd = random.Random(seed)
+        self.hits_returned = 0
+        self._catalogs = {}       # カタログ名 → (価格の昇順リスト, 商品番号の並び)
+        self._calls = {}          # appid → 直近1秒の呼び出し時刻
+        self._lock = threading.Lock()
+
+    def _catalog(self, name, size):
+        with self._lock:
+            catalog = self._catalogs.get(name)
+            if catalog is None:
+                rnd = random.Random(name)
+                items = sorted((rnd.randint(100, 100_000), k) for k in range(size))
+                catalog = ([p for p, _ in items], [k for _, k in items])
+                self._catalogs[name] = catalog
+            return catalog
+
+    def _hit(self, name, k, price, seller_id):
+        rnd = random.Random(f"{name}:{k}")
+        store = seller_id or f"store{k % self.stores:04d}"
+        return {
+            "code": f"{store}_{k}",
+            "name": f"{store} の商品 {k}",
+            "price": price,
+            "inStock": rnd.random() < 0.9,
+            "janCode": _jan(f"49{rnd.randint(0, 10**10 - 1):010d}"),
+            "seller": {"sellerId": store, "name": store},
+        }
+
+    def _over_limit(self, appid):
+        if not self.qps:
+            return False
+        with self._lock:
+            now = self.clock()
+            calls = [t for t in self._calls.get(appid, ()) if now - t < 1.0]
+            limited = len(calls) >= self.qps
+            if not limited:
+                calls.append(now)
+            self._calls[appid] = calls
+            return limited
+
+    def handle(self, params):
+        with self._lock:
+            self.requests += 1
+        appid = params.get("appid")
+        if not appid:
+            with self._lock:
+                self.rejected += 1
+            return 400, {"Error": {"Message": "appid is required"}}
+        if self._over_limit(appid):
+            with self._lock:
+                self.throttled += 1
+            return 429, {"Error": {"Message": "Too Many Requests"}}
+        with self._lock:
+            if self.error_rate and self._rnd.random() < self.error_rate:
+                self.server_errors += 1
+                return 503, {"Error": {"Message": "Service Unavailable"}}
+
+        results = int(params.get("results") or 20)
+        start = int(params.get("start") or 1)
+        if results < 1 or results > YAHOO_MAX_RESULTS or start < 1 or start + results - 1 > YAHOO_MAX_POSITION:
+            with self._lock:
+                self.rejected += 1
+            return 400, {"Error": {"Message": f"start + results must be <= {YAHOO_MAX_POSITION + 1}"}}
+
+        seller_id = params.get("seller_id")
+        if seller_id in self.missing_sellers:
+            with self._lock:
+                self.rejected += 1
+            return 400, {"Error": {"Message": f"seller_id {seller_id} not found"}}
+        if seller_id:
+            name, size = f"seller:{seller_id}", self.items_per_seller
+        elif params.get("genre_category_id"):
+            name, size = f"genre:{params['genre_category_id']}", self.query_items
+        else:
+            name, size = f"query:{params.get('query', '')}", self.query_items
+        prices, keys = self._catalog(name, size)
+
+        lo = bisect.bisect_left(prices, int(params["price_from"])) if params.get("price_from") else 0
+        hi = bisect.bisect_right(prices, int(params["price_to"])) if params.get("price_to") else len(prices)
+        total = max(0, hi - lo)
+        if params.get("sort") == "-price":
+            positions = [hi - start - j for j in range(results)]
+        else:
+            positions = [lo + start - 1 + j for j in range(results)]
+        hits = [self._hit(name, keys[p], prices[p], seller_id) for p in positions if lo <= p < hi]
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+        with self._lock:
+            self.hits_returned += len(hits)
+        return 200, {
+            "totalResultsAvailable": total,
+            "totalResultsReturned": len(hits),
+            "firstResultsPosition": start,
+            "hits": hits,
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests, "throttled": self.throttled,
+                "rejected": self.rejected, "hits_returned": self.hits_returned,
+                "server_errors": self.server_errors,
+            }
+
+
+# =========================
+# HTTP サーバ
+# =========================
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive（接続の使い回しも計測に含める）
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        sims = self.server.simulators
+        if url.path.endswith("/product"):
+            status, body = sims["keepa"].handle(params)
+        elif url.path.endswith("/itemSearch"):
+            status, body = sims["yahoo"].handle(params)
+        elif url.path == "/stats":
+            status, body = 200, {k: sim.stats() for k, sim in sims.items()}
+        else:
+            status, body = 404, {"error": "not found"}
+
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_simulator(keepa=None, yahoo=None, host="127.0.0.1", port=0):
+    """
+    別スレッドでサーバを起動する。
+    戻り値: (server, base_url)  ※終了は server.shutdown()
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.simulators = {"keepa": keepa or KeepaSimulator(), "yahoo": yahoo or YahooSimulator()}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keepa / Yahoo API の模擬サーバ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--refill-rate", type=int, default=20, help="Keepa の1分あたり補充トークン")
+    parser.add_argument("--minute-seconds", type=float, default=60.0, help="Keepa の「1分」の長さ（秒）")
+    parser.add_argument("--keepa-latency", type=float, default=0.05, help="Keepa 1リクエストの遅延（秒）")
+    parser.add_argument("--keepa-error-rate", type=float, default=0.0, help="Keepa を 503 にする割合")
+    parser.add_argument("--yahoo-latency", type=float, default=0.05, help="Yahoo 1リクエストの遅延（秒）")
+    parser.add_argument("--yahoo-items", type=int, default=5000, help="販売者ごとの商品数")
+    parser.add_argument("--yahoo-qps", type=int, default=0, help="Yahoo の1秒あたり上限（0=無制限）")
+    parser.add_argument("--yahoo-error-rate", type=float, default=0.0, help="Yahoo を 503 にする割合")
+    args = parser.parse_args(argv)
+
+    server, base_url = start_simulator(
+        KeepaSimulator(args.refill_rate, minute_seconds=args.minute_seconds, latency=args.keepa_latency,
+                       error_rate=args.keepa_error_rate),
+        YahooSimulator(args.yahoo_items, latency=args.yahoo_latency, qps=args.yahoo_qps,
+                       error_rate=args.yahoo_error_rate),
+        args.host, args.port,
+    )
+    print(f"Keepa: {base_url}/product")
+    print(f"Yahoo: {base_url}/ShoppingWebService/V3/itemSearch")
+    print(f"集計:  {base_url}/stats")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""
+ツール本体のコードを模擬サーバ（api_simulator.py）に向けて流し、処理速度を測る
+
+    python bench/bench_throughput.py                       # Keepa / Yahoo / 店舗名 すべて
+    python bench/bench_throughput.py --only keepa --sizes 1000 10000
+    python bench/bench_throughput.py --keepa-latency 0.2 --concurrency 8
+
+・keepa  … keepa_core.PriceLookup（2_ / 3. の GUI と keepa_cli と同じ処理）で n 件のJANを取得
+・yahoo  … yahoo_api.fetch_seller_catalog で n 件の商品を持つ販売者を取得（1000件超は価格帯を分けて全件）
+・stores … yahoo_stores.crawl_stores で カテゴリ × 価格帯 × 並び順 の区分を巡回して店舗IDを集める（2回目の差分巡回も）
+
+件数/秒 と トークン/件 を表にして出す。本物のAPIには一切アクセスしない。
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEEPA_DIR = os.path.join(ROOT, "Keepaapi", "最終出力したもの")
+YAHOO_DIR = os.path.join(ROOT, "●YahooAPI")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, KEEPA_DIR)
+sys.path.insert(0, YAHOO_DIR)
+
+from api_simulator import KeepaSimulator, YahooSimulator, start_simulator
+
+# =========================
+# 設定
+# =========================
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+SCENARIOS = ("keepa", "yahoo", "stores")
+YAHOO_PATH = "/ShoppingWebService/V3/itemSearch"
+STORE_CATEGORIES = 3      # stores で巡回するカテゴリ数（全区分だと1回で数千要求になる）
+
+
+def make_jans(n, seed=0):
+    """チェックディジットの正しい 49 始まりの JAN を n 件"""
+    jans = []
+    for k in range(n):
+        body = f"49{(seed * 7919 + k) % 10**10:010d}"
+        odd = sum(int(d) for d in body[0::2])
+        even = sum(int(d) for d in body[1::2])
+        jans.append(body + str((10 - (odd + even * 3) % 10) % 10))
+    return jans
+
+
+def _delta(before, after):
+    return {k: after[k] - before[k] for k in before if isinstance(before[k], (int, float))}
+
+
+# =========================
+# シナリオ
+# =========================
+def bench_keepa(n, base_url, keepa_sim, args):
+    import keepa_api
+    from keepa_core import PriceLookup
+
+    keepa_api.KEEPA_API_URL = base_url + "/product"
+    work = tempfile.mkdtemp(prefix="keepa_bench_")
+    try:
+        keys = ",".join(f"bench-key-{k}" for k in range(args.keys))
+        lookup = PriceLookup(
+            keys, os.path.join(work, "journal.jsonl"),
+            concurrency=args.concurrency, plan=args.plan,
+            cache_path=os.path.join(work, "cache.sqlite3"),
+        )
+        rows = list(enumerate(make_jans(n, seed=n)))
+        before = keepa_sim.stats()
+        t0 = time.perf_counter()
+        done = sum(1 for _ in lookup.run(rows, len(rows)))
+        elapsed = time.perf_counter() - t0
+        server = _delta(before, keepa_sim.stats())
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return {
+        "items": done, "seconds": elapsed,
+        "tokens_per_item": server["tokens_consumed"] / max(done, 1),
+        "requests": server["requests"], "throttled": server["throttled"],
+        "note": lookup.token_report(),
+    }
+
+def bench_yahoo(n, base_url, yahoo_sim, args):
+    from yahoo_api import fetch_seller_catalog
+
+    yahoo_sim.items_per_seller = n
+    before = yahoo_sim.stats()
+    t0 = time.perf_counter()
+    rows = fetch_seller_catalog("bench-app", f"seller{n}", base_url + YAHOO_PATH, lambda text: None,
+                                wait_sec=args.yahoo_wait, error_wait_sec=0)
+    elapsed = time.perf_counter() - t0
+    server = _delta(before, yahoo_sim.stats())
+    return {
+        "items": len(rows), "seconds": elapsed, "tokens_per_item": None,
+        "requests": server["requests"], "throttled": server["throttled"],
+        "note": f"販売者の全{n}件中 {len(rows)}件取得",
+    }
+
+def bench_stores(base_url, yahoo_sim, args):
+    from yahoo_api import make_limiter, make_session
+    from yahoo_stores import CATEGORIES, StoreRegistry, crawl_stores, make_shards
+
+    tmp = tempfile.mkdtemp(prefix="bench_stores_")
+    registry = StoreRegistry(os.path.join(tmp, "店舗台帳.sqlite3"))
+    session = make_session()
+    shards = make_shards(categories=CATEGORIES[:STORE_CATEGORIES])
+    try:
+        before = yahoo_sim.stats()
+        t0 = time.perf_counter()
+        summary = crawl_stores("bench-app", base_url + YAHOO_PATH, registry, lambda text: None, shards,
+                               limiter=make_limiter(args.yahoo_wait), session=session)
+        elapsed = time.perf_counter() - t0
+        server = _delta(before, yahoo_sim.stats())
+        # 2回目（結果が変わっていない区分は1ページ目だけ）
+        again = crawl_stores("bench-app", base_url + YAHOO_PATH, registry, lambda text: None, shards,
+                             limiter=make_limiter(args.yahoo_wait), session=session)
+    finally:
+        session.close()
+        registry.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        "items": server["hits_returned"], "seconds": elapsed, "tokens_per_item": None,
+        "requests": server["requests"], "throttled": server["throttled"],
+        "note": f"店舗 {summary['stores']}件・区分 {summary['shards']}"
+                f"（2回目は {again['requests']}要求・{again['skipped']}区分が変化なし）",
+    }
+
+
+# =========================
+# 実行
+# =========================
+def _print_row(name, size, r):
+    rate = r["items"] / r["seconds"] if r["seconds"] > 0 else float("inf")
+    tpi = f"{r['tokens_per_item']:.2f}" if r["tokens_per_item"] is not None else "-"
+    print(f"{name:<7} {size:>8} {r['items']:>8} {r['seconds']:>9.2f} {rate:>10.0f} {tpi:>8} "
+          f"{r['requests']:>7} {r['throttled']:>5}  {r['note']}", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模擬サーバでの処理速度の計測")
+    parser.add_argument("--only", choices=SCENARIOS, nargs="+", default=list(SCENARIOS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--concurrency", type=int, default=4, help="Keepa の同時リクエスト数")
+    parser.add_argument("--plan", default="tiered", help="Keepa の問い合わせ方（tiered / offers）")
+    parser.add_argument("--keys", type=int, default=1, help="Keepa の API キー数（キーごとに別のトークン）")
+    parser.add_argument("--refill-rate", type=int, default=1_000_000,
+                        help="Keepa の1分あたり補充トークン（既定はトークン待ちが出ない量）")
+    parser.add_argument("--start-tokens", type=int, default=None,
+                        help="Keepa の開始時の残りトークン（既定は満タン）")
+    parser.add_argument("--minute-seconds", type=float, default=60.0)
+    parser.add_argument("--keepa-latency", type=float, default=0.05, help="Keepa 1リクエストの遅延（秒）")
+    parser.add_argument("--yahoo-latency", type=float, default=0.05, help="Yahoo 1リクエストの遅延（秒）")
+    parser.add_argument("--yahoo-qps", type=int, default=0)
+    parser.add_argument("--yahoo-wait", type=float, default=0.0,
+                        help="Yahoo の最初の呼び出し間隔（ツール既定は0.8秒。以後は自動調整。0で上限の速さから）")
+    args = parser.parse_args(argv)
+
+    keepa_sim = KeepaSimulator(args.refill_rate, tokens=args.start_tokens,
+                               minute_seconds=args.minute_seconds, latency=args.keepa_latency)
+    yahoo_sim = YahooSimulator(latency=args.yahoo_latency, qps=args.yahoo_qps)
+    server, base_url = start_simulator(keepa_sim, yahoo_sim)
+
+    print(f"{'対象':<7} {'件数':>8} {'取得':>8} {'秒':>9} {'件/秒':>10} {'トークン/件':>8} "
+          f"{'要求数':>7} {'429':>5}  備考")
+    try:
+        for size in args.sizes:
+            if "keepa" in args.only:
+                _print_row("keepa", size, bench_keepa(size, base_url, keepa_sim, args))
+            if "yahoo" in args.only:
+                _print_row("yahoo", size, bench_yahoo(size, base_url, yahoo_sim, args))
+        if "stores" in args.only:
+            _print_row("stores", "-", bench_stores(base_url, yahoo_sim, args))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
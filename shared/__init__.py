@@ -0,0 +1,11 @@
+# coding: utf-8
+"""
+Keepaapi/最終出力したもの と ●YahooAPI の両方で使うモジュール（どちらのフォルダにも写しを置かない）
+
+    run_metrics … 実行中の計測（JSON / Prometheus のスナップショット）
+    gui_log     … GUI のログ欄への書き込み（ワーカースレッドから安全に呼べる）
+
+各フォルダの shared.py がこのフォルダを指しているので、どちらのフォルダからでも
+    from shared.run_metrics import RunMetrics
+で読める。
+"""
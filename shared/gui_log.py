@@ -0,0 +1,144 @@
+# coding: utf-8
+"""
+GUI のログ欄への書き込みをまとめて行う（ワーカースレッドから安全に呼べる）
+
+    pump = LogPump(log_box)
+    pump.start()                      # GUI スレッドで1回
+    pump("🕐 1/100 件処理完了\n")      # どのスレッドからでも可
+    pump.spool_to("結果_xxx.log")      # 以降のログをファイルにも全件残す
+    pump.call(messagebox.showinfo, "完了", "...")   # GUI スレッドで呼ぶ（ボタン・ダイアログ）
+    path = pump.ask(filedialog.asksaveasfilename)   # GUI スレッドで呼び、戻り値を待つ
+
+・書き込みはキューに積むだけ。GUI スレッドが root.after で INTERVAL_MS ごとに
+  まとめて取り出し、1回の insert で追記する（Tkinter をワーカーから触らない）
+・ログ欄は末尾 MAX_LINES 行だけ残し、古い行から消す（長時間の実行でも重くならない）
+・spool_to() 以降のログは全件ファイルに追記する
+・call() で渡した関数もログと同じキューに積み、GUI スレッドでログと同じ順番に呼ぶ
+  （ボタンの有効/無効やメッセージボックスもワーカーから直接触らない）
+・ask() は call() で呼んだ関数の戻り値をワーカーで待って返す（保存先の選択など。GUI スレッドからは呼ばない）
+・ログ欄を上にスクロールしているときは末尾へ飛ばさない
+"""
+
+import queue
+import threading
+
+# =========================
+# 設定
+# =========================
+INTERVAL_MS = 100          # 取り出し間隔
+MAX_BATCH = 2000           # 1回に取り出す件数の上限（残りは次の回へ）
+MAX_LINES = 3000           # ログ欄に残す行数
+
+_SPOOL = object()          # spool_to() の目印（ログと同じ順番で処理する）
+_CALL = object()           # call() の目印
+
+
+class LogPump:
+    def __init__(self, widget, max_lines=MAX_LINES, interval_ms=INTERVAL_MS, max_batch=MAX_BATCH):
+        self.widget = widget
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+        self.spool_path = None
+        self._queue = queue.SimpleQueue()
+        self._spool = None
+        self._running = False
+
+    # ---------- どのスレッドからでも ----------
+    def write(self, text):
+        self._queue.put(text)
+
+    __call__ = write
+
+    def spool_to(self, path):
+        """以降のログを path に追記する（None で止める）"""
+        self._queue.put((_SPOOL, path))
+
+    def call(self, func, *args, **kwargs):
+        """func(*args, **kwargs) を GUI スレッドで呼ぶ（それまでのログを書き出してから）"""
+        self._queue.put((_CALL, func, args, kwargs))
+
+    def ask(self, func, *args, **kwargs):
+        """func(*args, **kwargs) を GUI スレッドで呼び、終わるまで待って戻り値を返す（ワーカースレッド専用）"""
+        done = threading.Event()
+        result = []
+
+        def run():
+            try:
+                result.append(func(*args, **kwargs))
+            finally:
+                done.set()
+
+        self.call(run)
+        done.wait()
+        return result[0] if result else None
+
+    # ---------- GUI スレッド ----------
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.widget.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        """残りを書き出してからファイルを閉じる"""
+        self._running = False
+        self.drain()
+        self._set_spool(None)
+
+    def drain(self):
+        """溜まっているログを書き出す。まだ残っていれば True"""
+        chunks = []
+        for _ in range(self.max_batch):
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, tuple) and item and item[0] is _SPOOL:
+                self._flush(chunks)
+                chunks = []
+                self._set_spool(item[1])
+            elif isinstance(item, tuple) and item and item[0] is _CALL:
+                self._flush(chunks)
+                chunks = []
+                _, func, args, kwargs = item
+                func(*args, **kwargs)
+            else:
+                chunks.append(item)
+        self._flush(chunks)
+        return not self._queue.empty()
+
+    def _tick(self):
+        if not self._running:
+            return
+        try:
+            more = self.drain()
+        except Exception:
+            # ウィンドウが閉じられた後など
+            self._running = False
+            return
+        self.widget.after(1 if more else self.interval_ms, self._tick)
+
+    def _flush(self, chunks):
+        if not chunks:
+            return
+        text = "".join(chunks)
+        if self._spool is not None:
+            self._spool.write(text)
+            self._spool.flush()
+
+        widget = self.widget
+        at_bottom = widget.yview()[1] >= 1.0
+        widget.insert("end", text)
+        lines = int(widget.index("end-1c").split(".")[0])
+        if lines > self.max_lines:
+            widget.delete("1.0", f"{lines - self.max_lines + 1}.0")
+        if at_bottom:
+            widget.see("end")
+
+    def _set_spool(self, path):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        self.spool_path = path
+        if path:
+            self._spool = open(path, "a", encoding="utf-8")
@@ -0,0 +1,316 @@
+# coding: utf-8
+"""
+実行中の計測（どこに時間がかかっているかを外から見るため）
+
+    metrics = RunMetrics("keepa")
+    metrics.start("結果_xxx.metrics")      # .json と .prom を SNAPSHOT_SECONDS ごとに書き出す
+    with metrics.timer("buybox") as t:     # 段ごとの所要時間（ヒストグラム）
+        resp = session.get(...)
+        t.status = resp.status_code        # HTTP ステータスごとの件数
+    metrics.gauge("tokens_consumed", lambda: scheduler.tokens_consumed)
+    metrics.begin(0, total)                # ここから件/秒を数える
+    metrics.set_progress(done)             # 件/秒 と 残り時間（ETA）
+    metrics.close()                        # 最後のスナップショットを書いて止める
+
+・どのスレッドから呼んでもよい
+・.json は人が読む用 / ほかのツール用、.prom は Prometheus のテキスト形式
+  （node_exporter の textfile collector などでそのまま拾える）
+・ファイルは一時ファイルに書いてから置き換えるので、読み手が途中の内容を見ることはない
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# =========================
+# 設定
+# =========================
+SNAPSHOT_SECONDS = 15          # スナップショットの書き出し間隔
+RATE_WINDOW_SECONDS = 300      # 「直近の件/秒」を測る幅
+# 所要時間ヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # 最後は +Inf
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for k, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                break
+        else:
+            k = len(self.buckets)
+        self.counts[k] += 1
+        self.total += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """区切りから求めた q 分位の目安（その値を含む区切りの上端）"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        buckets = {str(b): n for b, n in zip(self.buckets, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 6),
+            "buckets": buckets,
+        }
+
+
+class _Timer:
+    """
+    timer() の戻り値。status を入れておくとステータス別の件数に数える
+    （例外で抜けた場合は例外のクラス名）
+    """
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.status = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        status = self.status
+        if status is None and exc_type is not None:
+            status = exc_type.__name__          # ReadTimeout / ConnectionError など
+        self.metrics.observe(self.stage, time.perf_counter() - self.started, status)
+        return False
+
+
+class RunMetrics:
+    def __init__(self, namespace, buckets=LATENCY_BUCKETS, clock=time.monotonic):
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self.clock = clock
+        self.started = clock()
+
+        self.histograms = {}       # 段 → _Histogram
+        self.statuses = {}         # (段, ステータス) → 件数
+        self.counters = {}         # 名前 → 値
+        self.gauges = {}           # 名前 → 値を返す関数
+        self.done = 0
+        self.done_at_start = 0     # 再開時に記録済みだった件数（件/秒には含めない）
+        self.total = None
+        self._samples = deque([(self.started, 0)])    # (時刻, 完了件数)  直近の件/秒用
+        self._lock = threading.Lock()
+
+        self.path = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- 記録 ----------
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def observe(self, stage, seconds, status=None):
+        with self._lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = _Histogram(self.buckets)
+            hist.observe(seconds)
+            if status is not None:
+                key = (stage, str(status))
+                self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def add(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, func):
+        """スナップショットのたびに func() の値を記録する（トークン残量など）"""
+        with self._lock:
+            self.gauges[name] = func
+
+    def begin(self, done=0, total=None):
+        """計測の起点（ここから件/秒を数える）"""
+        with self._lock:
+            self.started = self.clock()
+            self.done = self.done_at_start = done
+            self.total = total
+            self._samples.clear()
+            self._samples.append((self.started, done))
+
+    def set_progress(self, done, total=None):
+        with self._lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+
+    # ---------- 集計 ----------
+    def _rates(self, now):
+        elapsed = now - self.started
+        overall = (self.done - self.done_at_start) / elapsed if elapsed > 0 else 0.0
+        self._samples.append((now, self.done))
+        while len(self._samples) > 2 and now - self._samples[0][0] > RATE_WINDOW_SECONDS:
+            self._samples.popleft()
+        t0, d0 = self._samples[0]
+        recent = (self.done - d0) / (now - t0) if now > t0 else overall
+        return elapsed, overall, recent
+
+    def snapshot(self):
+        """今の計測値（dict）"""
+        gauges = {}
+        for name, func in list(self.gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception:
+                gauges[name] = None
+        with self._lock:
+            now = self.clock()
+            elapsed, overall, recent = self._rates(now)
+            rate = recent or overall
+            remaining = None if self.total is None else max(0, self.total - self.done)
+            eta = None
+            if remaining is not None and rate > 0:
+                eta = remaining / rate
+            return {
+                "namespace": self.namespace,
+                "updated": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "elapsed_seconds": round(elapsed, 3),
+                "items_done": self.done,
+                "items_total": self.total,
+                "items_per_second": round(overall, 3),
+                "items_per_second_recent": round(recent, 3),
+                "eta_seconds": None if eta is None else round(eta, 1),
+                "stages": {stage: h.to_dict() for stage, h in self.histograms.items()},
+                "statuses": [
+                    {"stage": stage, "status": status, "count": n}
+                    for (stage, status), n in sorted(self.statuses.items())
+                ],
+                "counters": dict(self.counters),
+                "gauges": gauges,
+            }
+
+    def to_prometheus(self, snap=None):
+        """Prometheus のテキスト形式"""
+        snap = snap or self.snapshot()
+        ns = self.namespace
+        lines = []
+
+        def metric(name, kind, samples):
+            lines.append(f"# TYPE {ns}_{name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+                lines.append(f"{ns}_{name}{{{label}}} {value}" if label else f"{ns}_{name} {value}")
+
+        lines.append(f"# TYPE {ns}_stage_seconds histogram")
+        with self._lock:
+            for stage, h in self.histograms.items():
+                stage = _escape(stage)
+                cumulative = 0
+                for bound, n in zip(self.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f'{ns}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{ns}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{ns}_stage_seconds_sum{{stage="{stage}"}} {h.total}')
+                lines.append(f'{ns}_stage_seconds_count{{stage="{stage}"}} {h.count}')
+
+        metric("responses_total", "counter",
+               [({"stage": s["stage"], "status": s["status"]}, s["count"]) for s in snap["statuses"]])
+        for name, value in snap["counters"].items():
+            metric(f"{name}_total", "counter", [({}, value)])
+        for name, value in snap["gauges"].items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric(name, "gauge", [({}, value)])
+        metric("items_done", "gauge", [({}, snap["items_done"])])
+        metric("items_total", "gauge", [({}, snap["items_total"])])
+        metric("items_per_second", "gauge", [({}, snap["items_per_second"])])
+        metric("items_per_second_recent", "gauge", [({}, snap["items_per_second_recent"])])
+        metric("eta_seconds", "gauge", [({}, snap["eta_seconds"])])
+        metric("elapsed_seconds", "gauge", [({}, snap["elapsed_seconds"])])
+        return "\n".join(lines) + "\n"
+
+    # ---------- 書き出し ----------
+    def write_snapshot(self, path=None):
+        """path.json と path.prom に書き出す"""
+        path = path or self.path
+        if not path:
+            return
+        snap = self.snapshot()
+        _replace(path + ".json", json.dumps(snap, ensure_ascii=False, indent=2))
+        _replace(path + ".prom", self.to_prometheus(snap))
+
+    def start(self, path, interval=SNAPSHOT_SECONDS):
+        """path（拡張子なし）へ interval 秒ごとにスナップショットを書き出す"""
+        self.path = path
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.write_snapshot()
+                except OSError:
+                    pass
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """定期書き出しを止めて最後のスナップショットを書く"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.path:
+            self.write_snapshot()
+
+    def report(self):
+        """段ごとの平均・p95 と件/秒を1行で（ログ用）"""
+        snap = self.snapshot()
+        parts = [
+            f"{stage} {h['count']}回 平均{h['avg']:.2f}s p95≦{h['p95']}s"
+            for stage, h in snap["stages"].items() if h["count"]
+        ]
+        parts.append(f"{snap['items_per_second']:.1f}件/秒")
+        return " / ".join(parts)
+
+
+def timed(metrics, stage):
+    """metrics が None でも使える timer()"""
+    return metrics.timer(stage) if metrics is not None else _NullTimer()
+
+
+class _NullTimer:
+    status = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _replace(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
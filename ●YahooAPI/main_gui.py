@@ -3,10 +3,15 @@
 # ============================================================
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from tkinterdnd2 import TkinterDnD
 import threading
+from shared.gui_log import LogPump
 from yahoo_api import run_yahoo_api   # yahooapi 内のrun yahoo関数を使えるようにする
+from yahoo_batch import run_yahoo_batch
+from yahoo_keepa_pipeline import run_pipeline
+
+LOG_FILE = "進行ログ.txt"   # 進行ログの全件（画面には直近の分だけ残す）
 
 # ============================================================
 # GUI本体
@@ -14,8 +19,8 @@ from yahoo_api import run_yahoo_api   # yahooapi 内のrun yahoo関数を使え
 root = TkinterDnD.Tk()
 root.title("Yahoo!商品情報取得ツール - Flower Edition")
 root.resizable(False, False)
-root.minsize(600, 620)        # ← ★追加：最小サイズ固定
-root.maxsize(600, 620)        # ← ★追加：最大サイズ固定
+root.minsize(600, 810)        # ← ★追加：最小サイズ固定
+root.maxsize(600, 810)        # ← ★追加：最大サイズ固定
 
 
 # スタイル設定
@@ -51,6 +56,11 @@ app_id_entry = create_input_row(frame, "Client ID：", 1, show="*")
 # start_number_combo.set("1")
 # start_number_combo.grid(row=2, column=1, padx=8, pady=8)
 
+# 応答キャッシュ（同じ条件の呼び出しは有効期限内ならAPIを呼ばない）
+use_cache_var = tk.BooleanVar(value=True)
+ttk.Checkbutton(frame, text="キャッシュを使う（60分以内の同じ検索は再取得しない）", variable=use_cache_var).grid(
+    row=2, column=1, sticky="w", padx=8, pady=4)
+
 #価格レンジ
 low_price_entry = create_input_row(frame, "下限価格：", 3)
 high_price_entry = create_input_row(frame, "上限価格：", 4)
@@ -58,9 +68,12 @@ high_price_entry = create_input_row(frame, "上限価格：", 4)
 # id
 seller_id_entry = create_input_row(frame, "販売者ID：", 5, default="hands-net")
 
+# Keepa（「Keepa 価格まで続けて取得」で使う）
+keepa_key_entry = create_input_row(frame, "Keepa APIキー：", 6, show="*")
+
 # ログ表示欄
 log_frame = ttk.LabelFrame(frame, text="進行ログ", padding=10)
-log_frame.grid(row=6, column=0, columnspan=2, sticky="nsew", pady=8)
+log_frame.grid(row=7, column=0, columnspan=2, sticky="nsew", pady=8)
 
 log_text = tk.Text(log_frame, height=12, width=65, font=("Consolas", 9), bg="#f9f9f9", wrap="word")
 log_text.pack(side="left", fill="both", expand=True)
@@ -68,9 +81,19 @@ scrollbar = ttk.Scrollbar(log_frame, orient="vertical", command=log_text.yview)
 scrollbar.pack(side="right", fill="y")
 log_text.config(yscrollcommand=scrollbar.set)
 
+# ワーカースレッドからも呼ばれるので、画面への反映は LogPump がまとめて行う
+log_pump = LogPump(log_text)
+log_pump.spool_to(LOG_FILE)
+log_pump.start()
+
 def append_log(text):
-    log_text.insert(tk.END, text + "\n")
-    log_text.see(tk.END)
+    log_pump(text + "\n")
+
+def on_close():
+    log_pump.stop()
+    root.destroy()
+
+root.protocol("WM_DELETE_WINDOW", on_close)
 
 # 実行スレッド
 def start_threaded(mode):
@@ -90,12 +113,61 @@ def start_threaded(mode):
 
     threading.Thread(
         target=run_yahoo_api,  # ← yahoo_api.py の関数を呼び出す
-        args=(client_id, mode, seller_id, api_url, append_log, low_price, high_price),
+        args=(client_id, mode, seller_id, api_url, append_log, low_price, high_price, use_cache_var.get(), log_pump),
+        daemon=True
+    ).start()
+
+# 一括取得（販売者IDの一覧ファイルを選ぶ。販売者ID欄は使わない）
+def start_batch():
+    client_id = app_id_entry.get().strip()
+    api_url = api_url_entry.get().strip()
+    if not client_id or not api_url:
+        messagebox.showwarning("入力不足", "API URL・Client IDを入力してください。")
+        return
+    ids_path = filedialog.askopenfilename(
+        filetypes=[("販売者IDの一覧", "*.txt *.csv")],
+        title="販売者IDの一覧を選択してください"
+    )
+    if not ids_path:
+        return
+
+    append_log(f"[INFO] 一括取得を開始します（{ids_path}）...\n")
+
+    threading.Thread(
+        target=run_yahoo_batch,
+        args=(client_id, api_url, ids_path, append_log, low_price_entry.get().strip(), high_price_entry.get().strip()),
+        kwargs={"use_cache": use_cache_var.get()},
         daemon=True
     ).start()
 
+# Yahoo の商品取得 → 重複除外 → Keepa の価格取得 を同時に流す
+def start_pipeline():
+    client_id = app_id_entry.get().strip()
+    seller_id = seller_id_entry.get().strip()
+    api_url = api_url_entry.get().strip()
+    keepa_key = keepa_key_entry.get().strip()
+    if not client_id or not seller_id or not api_url or not keepa_key:
+        messagebox.showwarning("入力不足", "API URL・Client ID・販売者ID・Keepa APIキーをすべて入力してください。")
+        return
+
+    append_log("[INFO] Keepa 価格まで続けて取得を開始します...\n")
+
+    def work():
+        try:
+            run_pipeline(client_id, api_url, seller_id, keepa_key, append_log,
+                         low_price_entry.get().strip(), high_price_entry.get().strip(),
+                         use_cache=use_cache_var.get())
+        except Exception as e:
+            append_log(f"[ERROR] 処理全体で例外発生: {e}")
+
+    threading.Thread(target=work, daemon=True).start()
+
 # ボタン配置
-ttk.Button(frame, text="商品数を調べる", width=30, command=lambda: start_threaded("count")).grid(row=7, column=0, columnspan=2, pady=8)
-ttk.Button(frame, text="商品取得を実行", width=30, command=lambda: start_threaded("normal")).grid(row=8, column=0, columnspan=2, pady=8)
+ttk.Button(frame, text="商品数を調べる", width=30, command=lambda: start_threaded("count")).grid(row=8, column=0, columnspan=2, pady=8)
+ttk.Button(frame, text="商品取得を実行", width=30, command=lambda: start_threaded("normal")).grid(row=9, column=0, columnspan=2, pady=8)
+# 前回の商品取得で取れなかったページだけを取り直す（販売者ID・価格範囲が同じ記録の続き）
+ttk.Button(frame, text="未取得ページを取り直す", width=30, command=lambda: start_threaded("resume")).grid(row=10, column=0, columnspan=2, pady=8)
+ttk.Button(frame, text="販売者リストで一括取得", width=30, command=start_batch).grid(row=11, column=0, columnspan=2, pady=8)
+ttk.Button(frame, text="Keepa 価格まで続けて取得", width=30, command=start_pipeline).grid(row=12, column=0, columnspan=2, pady=8)
 
 root.mainloop()
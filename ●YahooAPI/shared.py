@@ -0,0 +1,12 @@
+# coding: utf-8
+"""
+リポジトリ直下の shared/（Keepa ツールと共通のモジュール）をこのフォルダから import する入口
+
+    from shared.gui_log import LogPump
+
+・中身は shared/ の1か所だけ。ここでは __path__ をそこへ向けるだけで、sys.path は変えない
+"""
+
+import os
+
+__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "shared")]
@@ -3,16 +3,421 @@
 # ============================================================
 
 import requests
-import pandas as pd
+import os
 import time
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from tkinter import filedialog  # ✅ 追加：保存先を選択するために必要
+from shared.run_metrics import RunMetrics, timed
+from yahoo_rate import AimdLimiter, limited, MAX_CONCURRENCY, MAX_RATE
+from yahoo_pages import PageJournal, page_journal_path
+from yahoo_sink import CsvRowSink, MemorySink, export_rows
+from yahoo_cache import ResponseCache
 
-def run_yahoo_api(app_id, mode, seller_id, api_url, log_callback, low_price=None, high_price=None):
+# ============================================================
+# 設定
+# ============================================================
+TOTAL_ITEMS = 1000        # 1条件で取得できる上限（Yahoo の start + results の上限）
+RESULTS_PER_CALL = 50
+WAIT_SEC = 0.8            # 最初の呼び出し間隔（以後は応答を見て yahoo_rate が調整）
+ERROR_WAIT_SEC = 30       # エラー時の待機
+THROTTLE_RETRIES = 5      # 429 のときに減速して取り直す回数
+PAGE_RETRIES = 4          # 失敗したページを取り直す回数
+PAGE_RETRY_BASE_SEC = 2   # 取り直しまでの待ち（回数ごとに倍、上限 ERROR_WAIT_SEC）
+MAX_REORDER_PAGES = 200   # ページ順に書き出すため待たせておくページ数の上限（超えたら順不同で書く）
+METRICS_PATH = "yahoo_metrics"   # 計測値（yahoo_metrics.json / .prom を実行中に定期更新）
+
+
+def _search_params(app_id, seller_id, low_price, high_price, results, start=1, sort="+price"):
+    params = {
+        "appid": app_id,
+        "seller_id": seller_id,
+        "results": results,
+        "start": start,
+        "sort": sort,
+        "condition": "new"
+    }
+    if low_price:
+        params["price_from"] = int(low_price)
+    if high_price:
+        params["price_to"] = int(high_price)
+    return params
+
+
+def make_session(pool_size=MAX_CONCURRENCY, cache=None):
+    """
+    接続を使い回すセッション（同時接続数 = pool_size）。
+    cache（yahoo_cache.ResponseCache）を渡すと、このセッションでの呼び出しは先にキャッシュを見る（_get）
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.response_cache = cache
+    return session
+
+
+def make_limiter(wait_sec=WAIT_SEC):
+    """wait_sec 間隔（0なら上限の速さ）から始めて、応答を見ながら速度を調整する"""
+    return AimdLimiter(start_rate=1 / wait_sec if wait_sec > 0 else MAX_RATE)
+
+
+def _get(api_url, params, session=None, limiter=None, metrics=None, stage="itemSearch", fresh=False):
+    """
+    1回の呼び出し（limiter の枠を待ってから）。200 番台以外は例外。
+    limiter があるときの 429 は「速すぎた」合図なので、減速した枠で THROTTLE_RETRIES 回まで取り直す。
+    session にキャッシュ（make_session(cache=...)）があれば、有効期限内の同じ条件は呼ばずに返す。
+    fresh=True ならキャッシュは見ずに呼ぶ（応答はキャッシュに入れ直す）。
+    """
+    cache = getattr(session, "response_cache", None)
+    if cache is not None and not fresh:
+        data = cache.get(api_url, params)
+        if metrics is not None:
+            metrics.add("cache_hits" if data is not None else "cache_misses")
+        if data is not None:
+            return data
+    for attempt in range(THROTTLE_RETRIES + 1):
+        with limited(limiter) as slot, timed(metrics, stage) as timer:
+            response = (session or requests).get(api_url, params=params, timeout=10)
+            slot.status = timer.status = response.status_code
+        if response.status_code != 429 or limiter is None or attempt == THROTTLE_RETRIES:
+            break
+        if metrics is not None:
+            metrics.add("throttled")
+    response.raise_for_status()
+    data = response.json()
+    if cache is not None:
+        cache.put(api_url, params, response.content)
+    return data
+
+
+def _is_permanent(error):
+    """取り直しても変わらないエラー（429 以外の 4xx）"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+def _get_retrying(api_url, params, session=None, limiter=None, metrics=None, stage="itemSearch",
+                  log_callback=None, where="", error_wait_sec=ERROR_WAIT_SEC, fresh=False):
+    """
+    _get() を、失敗したら PAGE_RETRY_BASE_SEC × 2^(回数-1)（上限 error_wait_sec）待って
+    PAGE_RETRIES 回まで取り直す（429 以外の 4xx はすぐ打ち切り）。取り切れなければ最後の例外
+    """
+    for attempt in range(1, PAGE_RETRIES + 2):
+        try:
+            return _get(api_url, params, session, limiter, metrics, stage, fresh)
+        except Exception as e:
+            if metrics is not None:
+                metrics.add("errors")
+            if _is_permanent(e) or attempt > PAGE_RETRIES:
+                raise
+            delay = min(error_wait_sec, PAGE_RETRY_BASE_SEC * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            if log_callback is not None:
+                log_callback(f"[RETRY] {where}: {e} → {delay:.0f}秒後に再試行します（{attempt}/{PAGE_RETRIES}）")
+            if metrics is not None:
+                metrics.add("retries")
+                metrics.add("error_wait_seconds", delay)
+            time.sleep(delay)
+
+
+def count_items(app_id, seller_id, api_url, low_price=None, high_price=None, metrics=None,
+                limiter=None, session=None, log_callback=None):
+    """価格帯 [low_price, high_price] の商品数（totalResultsAvailable。失敗したら時間をおいて取り直す）"""
+    params = _search_params(app_id, seller_id, low_price, high_price, 1)
+    data = _get_retrying(api_url, params, session, limiter, metrics, "count", log_callback,
+                         f"件数確認 {low_price or 'min'}〜{high_price or 'max'}円")
+    return int(data.get("totalResultsAvailable", 0))
+
+
+def top_price(app_id, seller_id, api_url, low_price=None, metrics=None, limiter=None, session=None,
+              log_callback=None):
+    """一番高い商品の価格（商品がなければ None）"""
+    params = _search_params(app_id, seller_id, low_price, None, 1, sort="-price")
+    hits = _get_retrying(api_url, params, session, limiter, metrics, "count", log_callback,
+                         "最高価格の確認").get("hits", [])
+    return int(hits[0]["price"]) if hits and hits[0].get("price") is not None else None
+
+
+def partition_price_range(app_id, seller_id, api_url, log_callback, low_price=None, high_price=None,
+                          cap=TOTAL_ITEMS, wait_sec=WAIT_SEC, metrics=None, limiter=None, session=None):
+    """
+    件数が cap 以下になるまで価格帯を半分に分け続ける（件数確認の呼び出しを使う）。
+    右半分の件数は 全体 - 左半分 で求めるので、分けるたびの問い合わせは1回。
+    最後に、隣り合う価格帯を合計が cap を超えない範囲でまとめ直す（ページ数を減らすため）。
+    同じ価格の商品だけで cap を超える価格帯はそれ以上分けられない（cap 件までしか取れない）。
+    戻り値: [(下限価格, 上限価格, 件数)] を安い順に
+    """
+    limiter = limiter or make_limiter(wait_sec)
+    total = count_items(app_id, seller_id, api_url, low_price, high_price, metrics, limiter, session,
+                        log_callback)
+    if total <= cap:
+        return [(int(low_price) if low_price else None, int(high_price) if high_price else None,
+                 total)] if total else []
+
+    low = int(low_price) if low_price else 0
+    high = int(high_price) if high_price else top_price(app_id, seller_id, api_url, low_price, metrics,
+                                                        limiter, session, log_callback)
+    log_callback(f"[SPLIT] {total:,}件 → 1条件{cap}件までのため、価格帯を分けて取得します...")
+
+    bands = []
+    stack = [(low, high, total)]
+    calls = 0
+    while stack:
+        lo, hi, n = stack.pop()
+        if n <= cap or lo >= hi:
+            if n > cap:
+                log_callback(f"[WARN] {lo}円ちょうどの商品が{n:,}件あり、{cap}件までしか取得できません。")
+            if n:
+                bands.append((lo, hi, n))
+            continue
+        mid = (lo + hi) // 2
+        left = count_items(app_id, seller_id, api_url, lo, mid, metrics, limiter, session, log_callback)
+        calls += 1
+        stack.append((mid + 1, hi, max(0, n - left)))
+        stack.append((lo, mid, left))
+
+    merged = []
+    for lo, hi, n in bands:
+        if merged and merged[-1][2] + n <= cap:
+            merged[-1] = (merged[-1][0], hi, merged[-1][2] + n)
+        else:
+            merged.append((lo, hi, n))
+    log_callback(f"[SPLIT] 価格帯 {len(merged)}個に分けました（件数確認 {calls + 1}回）")
+    return merged
+
+
+def _page_starts(count, first=1):
+    """count 件（上限 TOTAL_ITEMS）を取るためのページの開始位置"""
+    return list(range(first, min(count, TOTAL_ITEMS) + 1, RESULTS_PER_CALL))
+
+
+def fetch_pages(app_id, seller_id, api_url, log_callback, pages, limiter, session=None,
+                error_wait_sec=ERROR_WAIT_SEC, metrics=None, total=None, done=0, journal=None, sink=None,
+                stop=None):
+    """
+    pages: [(下限価格, 上限価格, 開始位置)]。全ページを同時に投げる（実際の速さ・同時数は limiter 次第）。
+    失敗したページは時間をおいて取り直す（_get_retrying）。
+    sink（yahoo_sink の CsvRowSink など）を渡すと、届いたページのヒットをその場で書き出し、
+    応答からはヒットを捨てる（pages の順に書く。先のページが MAX_REORDER_PAGES 件溜まったら順不同で書く）。
+    journal（yahoo_pages.PageJournal）を渡すと、書き出したページ・打ち切ったページを記録する。
+    stop() が真になったら、まだ投げていないページは投げずに捨てる（記録しないので、続きの取得で取り直す）。
+    sink への書き出しで例外が出たときも同じく捨ててから抜ける（取得中のページが終わるのだけ待つ）。
+    戻り値: pages と同じ順の応答（dict。打ち切ったページは None。sink ありなら "hits" の代わりに "rows"＝書いた件数）
+    """
+    results = [None] * len(pages)
+    stop = stop or (lambda: False)
+
+    def task(k):
+        low_price, high_price, start = pages[k]
+        where = f"{low_price or 'min'}〜{high_price or 'max'}円 {start}件目〜"
+        params = _search_params(app_id, seller_id, low_price, high_price, RESULTS_PER_CALL, start)
+        try:
+            data = _get_retrying(api_url, params, session, limiter, metrics, "itemSearch",
+                                 log_callback, where, error_wait_sec)
+        except Exception as e:
+            log_callback(f"[ERROR] {where} を取得できませんでした: {e}")
+            if journal is not None:
+                journal.fail(pages[k], e)
+            return k, None
+        return k, data
+
+    # 書き出しは取得スレッドではなくここで、ページ順に（書き出してから記録する）
+    pending = {}
+    written = [False] * len(pages)
+    next_k = 0
+
+    def emit(k):
+        data = pending.pop(k)
+        written[k] = True
+        if data is None:
+            return 0
+        hits = data.get("hits", [])
+        if sink is not None:
+            n = sink.write_hits(hits)
+            data = {key: v for key, v in data.items() if key != "hits"}
+            data["rows"] = n
+        else:
+            n = len(hits)
+        if journal is not None:
+            journal.record(pages[k], n)
+        results[k] = data
+        return n
+
+    pool = ThreadPoolExecutor(max_workers=limiter.max_concurrency)
+    try:
+        futures = []
+        for k in range(len(pages)):
+            if stop():
+                break
+            futures.append(pool.submit(task, k))
+        stopping = False
+        for n, future in enumerate(as_completed(futures), 1):
+            if not stopping and stop():
+                stopping = True
+                for f in futures:
+                    f.cancel()             # 取得中のページは終わるまで待つ
+            if future.cancelled():
+                continue
+            k, data = future.result()
+            pending[k] = data
+            while next_k < len(pages) and (next_k in pending or written[next_k]):
+                if next_k in pending:
+                    done += emit(next_k)
+                next_k += 1
+            while len(pending) > MAX_REORDER_PAGES:
+                done += emit(min(pending))
+            if metrics is not None:
+                metrics.set_progress(done, total)
+            log_callback(f"[OK] {n}/{len(pages)} ページ完了")
+        for k in sorted(pending):
+            done += emit(k)
+    finally:
+        pool.shutdown(cancel_futures=True)
+    return results
+
+
+def _harvest_bands(app_id, seller_id, api_url, log_callback, bands, sink, limiter, session=None,
+                   error_wait_sec=ERROR_WAIT_SEC, metrics=None, journal=None, stop=None):
+    """
+    価格帯の全ページを取得して sink に書き出す（journal に記録済みのページは飛ばす）。
+    分けた後に件数が増えていた価格帯は、足りないページだけ追加で取る。
+    戻り値: 打ち切ったページのリスト
+    """
+    total = sum(min(n, TOTAL_ITEMS) for _, _, n in bands)
+    pages = [(lo, hi, start) for lo, hi, n in bands for start in _page_starts(n)]
+    got = {}
+    done = 0
+    if journal is not None:
+        pages = journal.all_pages(pages)
+        got.update((p, {"rows": journal.done[p]}) for p in pages if p in journal.done)
+        done = sum(journal.done.values())
+    todo = [p for p in pages if p not in got]
+    if got:
+        log_callback(f"[RESUME] 取得済みの {len(got)}ページを飛ばし、残り {len(todo)}ページを取得します...")
+    log_callback(f"[INFO] 商品取得を開始します（価格帯 {len(bands)}個・{len(todo)}ページ）...")
+    got.update(zip(todo, fetch_pages(app_id, seller_id, api_url, log_callback, todo, limiter, session,
+                                     error_wait_sec, metrics, total, done, journal, sink, stop)))
+
+    # 件数を数えた後に増えた価格帯の残り
+    by_band = {}
+    for (lo, hi, start), data in got.items():
+        if data is not None and "totalResultsAvailable" in data:
+            by_band[(lo, hi)] = max(by_band.get((lo, hi), 0), int(data["totalResultsAvailable"]))
+    extra = [(lo, hi, start) for lo, hi, n in bands
+             for start in _page_starts(by_band.get((lo, hi), n), len(_page_starts(n)) * RESULTS_PER_CALL + 1)
+             if (lo, hi, start) not in got]
+    if extra and not (stop and stop()):
+        log_callback(f"[INFO] 件数が増えた価格帯の {len(extra)}ページを追加で取得します...")
+        got.update(zip(extra, fetch_pages(app_id, seller_id, api_url, log_callback, extra, limiter, session,
+                                          error_wait_sec, metrics, journal=journal, sink=sink, stop=stop)))
+
+    return sorted((p for p, data in got.items() if data is None), key=lambda p: (p[0] or 0, p[2]))
+
+
+def fetch_seller_catalog(app_id, seller_id, api_url, log_callback, low_price=None, high_price=None,
+                         wait_sec=WAIT_SEC, error_wait_sec=ERROR_WAIT_SEC, metrics=None,
+                         limiter=None, session=None, journal=None, sink=None, stop=None):
+    """
+    販売者の全商品を取得する。TOTAL_ITEMS 件を超える場合は価格帯を自動で分け、
+    全価格帯の全ページを同時に投げて、重複（価格帯の境目で価格が変わった商品など）を除いてまとめる。
+    sink（yahoo_sink.CsvRowSink など）を渡すと、ページが届くたびに価格の安い順で書き出し、行はメモリに溜めない。
+    journal（yahoo_pages.PageJournal）を渡すと、価格帯とページごとの件数を記録する
+    （取れなかったページは journal.failed に残り、resume_seller_catalog で取り直せる）。
+    stop() が真になったら残りのページは投げずに終える（fetch_pages）。
+    戻り値: sink ありなら書き出した件数、なしなら [商品名, 在庫あり, 価格, JANコード] のリスト（安い順）
+    """
+    limiter = limiter or make_limiter(wait_sec)
+    bands = partition_price_range(app_id, seller_id, api_url, log_callback, low_price, high_price,
+                                  metrics=metrics, limiter=limiter, session=session)
+    if journal is not None:
+        journal.update_meta(bands=bands)
+    target = sink if sink is not None else MemorySink()
+    _harvest_bands(app_id, seller_id, api_url, log_callback, bands, target, limiter, session,
+                   error_wait_sec, metrics, journal, stop)
+    return target.count if sink is not None else target.rows
+
+
+def resume_seller_catalog(app_id, api_url, log_callback, journal, sink, wait_sec=WAIT_SEC,
+                          error_wait_sec=ERROR_WAIT_SEC, metrics=None, limiter=None, session=None, stop=None):
+    """
+    記録（yahoo_pages.PageJournal）の続きから、取れていないページだけを取り直して sink に書き足す。
+    価格帯は記録したものを使う（分け直さない）。sink は前回の書き出し先を resume=True で開いたもの。
+    戻り値: 前回の分を含めた書き出し件数
+    """
+    limiter = limiter or make_limiter(wait_sec)
+    _harvest_bands(app_id, journal.meta["seller_id"], api_url, log_callback, journal.bands, sink,
+                   limiter, session, error_wait_sec, metrics, journal, stop)
+    return sink.count
+
+
+def harvest_seller(app_id, seller_id, api_url, log_callback, low_price=None, high_price=None, out_dir="",
+                   resume=False, wait_sec=WAIT_SEC, error_wait_sec=ERROR_WAIT_SEC, metrics=None,
+                   limiter=None, session=None, on_rows=None, stop=None):
+    """
+    販売者1つぶんを out_dir の CSV（{販売者ID}_商品情報_{価格範囲}.csv）に取得し、ページ記録を残す。
+    resume=True なら前回の記録の続きから取れていないページだけを取り直す
+    （記録や CSV が無い・使えないときは ValueError。メッセージはそのままログに出せる）。
+    on_rows(rows) を渡すと、CSV に書いた行（[商品名, 在庫あり, 価格, JANコード, 商品コード]）をページごとに渡す。
+    stop() が真になったら、まだ投げていないページは投げずに終える（残りは resume=True で取り直せる）。
+    戻り値: (CSV のパス, 件数, 取得できなかったページ数, 記録のパス)
+    """
+    journal_path = os.path.join(out_dir, page_journal_path(seller_id, low_price, high_price))
+    if resume:
+        if not os.path.exists(journal_path):
+            raise ValueError(f"前回の記録（{journal_path}）がありません。商品取得を実行してください。")
+        journal = PageJournal(journal_path)
+        if not journal.bands:
+            journal.close()
+            raise ValueError("前回は価格帯を分ける途中で止まっています。商品取得を実行してください。")
+        if not os.path.exists(journal.meta.get("sink") or ""):
+            journal.close()
+            raise ValueError(f"前回の取得結果（{journal.meta.get('sink')}）がありません。商品取得を実行してください。")
+        sink = CsvRowSink(journal.meta["sink"], resume=True, on_rows=on_rows)
+        try:
+            count = resume_seller_catalog(app_id, api_url, log_callback, journal, sink, wait_sec, error_wait_sec,
+                                          metrics, limiter, session, stop)
+        finally:
+            sink.close()
+            journal.close()
+    else:
+        # ✅ 取れたページから CSV に書き足す（途中で止まってもそこまでは開ける）
+        sink = CsvRowSink(os.path.join(
+            out_dir, f"{seller_id}_商品情報_{low_price or 'min'}-{high_price or 'max'}.csv"), on_rows=on_rows)
+        journal = PageJournal(journal_path, meta={
+            "seller_id": seller_id, "low_price": low_price, "high_price": high_price, "sink": sink.path,
+        })
+        try:
+            count = fetch_seller_catalog(app_id, seller_id, api_url, log_callback, low_price, high_price,
+                                         wait_sec, error_wait_sec, metrics, limiter, session, journal, sink, stop)
+        finally:
+            sink.close()
+            journal.close()
+    return sink.path, count, len(journal.failed), journal_path
+
+
+def run_yahoo_api(app_id, mode, seller_id, api_url, log_callback, low_price=None, high_price=None,
+                  use_cache=True, log_pump=None):
     """
     Yahoo!ショッピングAPIから商品情報を取得・件数確認を行うメイン処理。
-    mode: "count"（件数確認）または "normal"（商品取得）
+    mode: "count"（件数確認）/ "normal"（商品取得）/ "resume"（前回取れなかったページだけ取り直す）
     log_callback: GUI側から渡されるログ出力用関数
+    log_pump: GUI の gui_log.LogPump（渡すと保存先の選択ダイアログを GUI スレッドで開く）
+    use_cache: 同じ条件の呼び出しを応答キャッシュ（yahoo_cache）から返す
+    計測値は METRICS_PATH.json / .prom に定期的に書き出す。
+    商品は取れたページから順に CSV（yahoo_sink.CsvRowSink）へ書き足し、ページごとの件数は
+    page_journal_path() の記録に残す。Excel / Parquet への書き出しは取得が終わった後に選べる。
     """
+    metrics = RunMetrics("yahoo")
+    metrics.start(METRICS_PATH)
+    # ✅ 接続は使い回し、呼び出し速度は応答を見ながら調整する
+    cache = ResponseCache() if use_cache else None
+    session = make_session(cache=cache)
+    limiter = make_limiter()
+    metrics.gauge("rate_per_second", lambda: round(limiter.rate, 3))
+    metrics.gauge("concurrency", lambda: int(limiter.limit))
+    metrics.gauge("backoffs", lambda: limiter.backoffs)
 
     try:
         result_log = "result.txt"  # 実行結果ログファイル
@@ -23,26 +428,13 @@ def run_yahoo_api(app_id, mode, seller_id, api_url, log_callback, low_price=None
         if mode == "count":
             log_callback(f"[INFO] 商品数を調べています（販売者ID: {seller_id}）...")
 
-            params = {
-                "appid": app_id,
-                "seller_id": seller_id,
-                "results": 1,
-                "start": 1,
-                "sort": "+price",
-                "condition": "new"
-            }
-
-            if low_price:
-                params["price_from"] = int(low_price)
-            if high_price:
-                params["price_to"] = int(high_price)
-
             try:
-                response = requests.get(api_url, params=params, timeout=10)
-                data = response.json()
-                total_available = data.get("totalResultsAvailable", 0)
+                total_available = count_items(app_id, seller_id, api_url, low_price, high_price, metrics,
+                                              limiter, session)
 
                 result_text = f"[RESULT] 条件に一致した全体のヒット件数: {total_available:,} 件"
+                if total_available > TOTAL_ITEMS:
+                    result_text += f"\n[INFO] {TOTAL_ITEMS}件を超える分は、商品取得で価格帯を自動で分けて取得します。"
                 log_callback(result_text)
                 with open(result_log, "w", encoding="utf-8") as f:
                     f.write(result_text)
@@ -55,80 +447,51 @@ def run_yahoo_api(app_id, mode, seller_id, api_url, log_callback, low_price=None
             return  # 件数モード終了
 
         # ============================================================
-        # 通常モード（商品情報取得）
+        # 通常モード（商品情報取得。1000件を超える販売者は価格帯を分けて全件）
+        # 続きモード（記録に残った取れなかったページだけ取り直す）
         # ============================================================
-        total_items = 1000
-        results_per_call = 50
-        calls = total_items // results_per_call
-        wait_sec = 0.8
-
-        log_callback(f"[INFO] 商品取得を開始します...")
-        all_rows = []
-
-        for i in range(calls):
-            start = 1 + results_per_call * i
-            params = {
-                "appid": app_id,
-                "seller_id": seller_id,
-                "results": results_per_call,
-                "start": start,
-                "sort": "+price",
-                "condition": "new"
-            }
-            if low_price:
-                params["price_from"] = int(low_price)
-            if high_price:
-                params["price_to"] = int(high_price)
-
-            try:
-                response = requests.get(api_url, params=params, timeout=10)
-                data = response.json()
-                hits = data.get("hits", [])
-                total_available = data.get("totalResultsAvailable", 0)
-
-                if not hits:
-                    log_callback("これ以上商品データがありません。終了します。")
-                    break
-
-                for h in hits:
-                    name = h.get("name") or ""
-                    in_stock = h.get("inStock")
-                    price = h.get("price") or ""
-                    jan = h.get("janCode") or ""
-                    all_rows.append([name, in_stock, price, jan])
-
-                log_callback(f"[OK] {i+1}/{calls} ページ完了")
-                time.sleep(wait_sec)
-
-            except Exception as e:
-                log_callback(f"[ERROR] エラー発生: {e}")
-                log_callback("[WAIT] 30秒待機して再試行します...")
-                time.sleep(30)
+        try:
+            csv_path, total_rows, failed, journal_path = harvest_seller(
+                app_id, seller_id, api_url, log_callback, low_price, high_price, resume=(mode == "resume"),
+                metrics=metrics, limiter=limiter, session=session)
+        except ValueError as e:
+            log_callback(f"[ERROR] {e}")
+            return
+        log_callback(f"[RATE] {limiter.report()}")
+        if cache is not None:
+            log_callback(f"[CACHE] {cache.report()}")
+        log_callback(f"[FILE] 取得結果（CSV）: {os.path.abspath(csv_path)}")
+        if failed:
+            log_callback(f"[WARN] 取得できなかったページが {failed}件あります"
+                         f"（{journal_path}）。「未取得ページを取り直す」で続きから取得できます。")
 
         # ============================================================
-        # 保存処理（保存先をユーザーが選択）
+        # 書き出し（保存先をユーザーが選択。キャンセルしても CSV は残る）
         # ============================================================
-        df = pd.DataFrame(all_rows, columns=["商品名", "在庫あり", "価格", "JANコード"])
-
-        # ✅ 保存先ダイアログ
-        save_path = filedialog.asksaveasfilename(
+        ask = log_pump.ask if log_pump is not None else (lambda func, *args, **kwargs: func(*args, **kwargs))
+        save_path = ask(
+            filedialog.asksaveasfilename,
             defaultextension=".xlsx",
-            filetypes=[("Excelファイル", "*.xlsx")],
+            filetypes=[("Excelファイル", "*.xlsx"), ("Parquetファイル", "*.parquet"), ("CSVファイル", "*.csv")],
             initialfile=f"{seller_id}_商品情報_{low_price or 'min'}-{high_price or 'max'}.xlsx",
             title="保存先を選択してください"
         )
 
         if save_path:
-            df.to_excel(save_path, index=False)
+            with timed(metrics, "excel_write"):
+                export_rows(csv_path, save_path)
             summary_text = (
-                f"[DONE] 取得完了: {len(all_rows)}件\n"
+                f"[DONE] 取得完了: {total_rows}件\n"
                 f"[FILE] 保存先: {save_path}\n"
+                f"[TIME] {metrics.report()}\n"
             )
         else:
             summary_text = (
-                f"[CANCELLED] 保存がキャンセルされました。\n"
-                f"[INFO] 取得件数: {len(all_rows)}件（未保存）\n"
+                f"[CANCELLED] 書き出しがキャンセルされました。\n"
+                f"[INFO] 取得件数: {total_rows}件（CSV のみ: {csv_path}）\n"
             )
+        if failed:
+            summary_text += f"[WARN] 未取得ページ: {failed}件（{journal_path}）\n"
 
         log_callback(summary_text)
         with open(result_log, "w", encoding="utf-8") as f:
@@ -136,3 +499,9 @@ def run_yahoo_api(app_id, mode, seller_id, api_url, log_callback, low_price=None
 
     except Exception as e:
         log_callback(f"[ERROR] 処理全体で例外発生: {e}")
+
+    finally:
+        session.close()
+        if cache is not None:
+            cache.close()
+        metrics.close()
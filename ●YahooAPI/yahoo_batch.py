@@ -0,0 +1,247 @@
+# coding: utf-8
+"""
+複数の販売者をまとめて取得する（一括取得）
+
+    python yahoo_batch.py 店舗ID一覧.txt --app-id ... [--api-url ...] [--low 1000] [--high 50000]
+
+・販売者IDの一覧（.txt は1行に1つ、.csv は1列目。空行と # で始まる行は飛ばす）を
+  BATCH_WORKERS 店ずつ同時に取得する。呼び出し速度は全販売者で1つの limiter を共有する
+・販売者ごとに out_dir/{販売者ID}_商品情報_{価格範囲}.csv（と BATCH_EXPORT_EXT の書き出し）を作り、
+  全体の一覧 out_dir/一覧.csv（販売者ID・状態・件数・未取得ページ・ファイル・所要秒・エラー）を
+  1店終わるごとに書き直す
+・1店が失敗しても他の店はそのまま続ける。同じ一覧でもう一度実行すると、
+  「完了」の店は飛ばし、途中の店はページ記録の続きから取り直す
+"""
+
+import argparse
+import csv
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from shared.run_metrics import RunMetrics, timed
+from yahoo_api import harvest_seller, make_limiter, make_session
+from yahoo_cache import ResponseCache
+from yahoo_sink import export_rows
+
+# =========================
+# 設定
+# =========================
+API_URL = "https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch"
+BATCH_WORKERS = 4              # 同時に取得する販売者の数（呼び出しの速さは limiter 全体で決まる）
+BATCH_EXPORT_EXT = ".xlsx"     # 販売者ごとに CSV から書き出す形式（None なら CSV のみ）
+INDEX_NAME = "一覧.csv"
+INDEX_COLUMNS = ("販売者ID", "状態", "件数", "未取得ページ", "ファイル", "所要秒", "エラー")
+DONE, PARTIAL, FAILED = "完了", "一部未取得", "失敗"
+METRICS_PATH = "yahoo_batch_metrics"
+
+
+def read_seller_ids(path):
+    """販売者IDの一覧を読む（重複は最初の1つだけ、順番はそのまま）"""
+    ids = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = csv.reader(f) if path.lower().endswith(".csv") else ([line] for line in f)
+        for row in rows:
+            value = row[0].strip() if row else ""
+            if value and not value.startswith("#") and value != INDEX_COLUMNS[0] and value not in ids:
+                ids.append(value)
+    return ids
+
+
+def batch_dir(ids_path):
+    """一覧ファイルの隣の 一括取得_{一覧の名前} フォルダ"""
+    stem = os.path.splitext(os.path.basename(ids_path))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(ids_path)), f"一括取得_{stem}")
+
+
+class BatchIndex:
+    """一覧.csv（販売者ごとの結果）。書き直しは一時ファイル経由なので、途中で開いても壊れていない"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, newline="", encoding="utf-8-sig") as f:
+                for row in csv.DictReader(f):
+                    self.entries[row["販売者ID"]] = row
+
+    def status(self, seller_id):
+        return self.entries.get(seller_id, {}).get("状態")
+
+    def update(self, seller_id, **values):
+        with self._lock:
+            entry = self.entries.setdefault(seller_id, {k: "" for k in INDEX_COLUMNS})
+            entry.update({"販売者ID": seller_id, **values})
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", newline="", encoding="utf-8-sig") as f:
+                writer = csv.DictWriter(f, fieldnames=INDEX_COLUMNS, extrasaction="ignore")
+                writer.writeheader()
+                writer.writerows(self.entries.values())
+            os.replace(tmp, self.path)
+
+
+class _Progress:
+    """販売者ごとの 取得件数 / 件数 を足し合わせて、全体の進捗として metrics に渡す"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.done = {}
+        self.total = {}
+        self._lock = threading.Lock()
+
+    def update(self, seller_id, done, total=None):
+        with self._lock:
+            self.done[seller_id] = done
+            if total is not None:
+                self.total[seller_id] = total
+            self.metrics.set_progress(sum(self.done.values()), sum(self.total.values()) or None)
+
+
+class _SellerMetrics:
+    """RunMetrics をそのまま使い、set_progress だけ販売者ごとの進捗として足し合わせる"""
+
+    def __init__(self, metrics, progress, seller_id):
+        self._metrics = metrics
+        self._progress = progress
+        self._seller_id = seller_id
+
+    def set_progress(self, done, total=None):
+        self._progress.update(self._seller_id, done, total)
+
+    def __getattr__(self, name):
+        return getattr(self._metrics, name)
+
+
+def _error_text(error):
+    """一覧に残すエラー文（requests の例外文に付く URL には appid が入るので落とす）"""
+    return str(error).split(" for url:")[0]
+
+
+def _seller_log(log_callback, seller_id):
+    """販売者IDを付けてログに出す（ページごとの [OK] は多すぎるので出さない）"""
+    def log(text):
+        if not text.startswith("[OK]"):
+            log_callback(f"[{seller_id}] {text}")
+    return log
+
+
+def run_batch(app_id, api_url, seller_ids, log_callback, low_price=None, high_price=None, out_dir=".",
+              workers=BATCH_WORKERS, export_ext=BATCH_EXPORT_EXT, metrics=None, limiter=None, session=None):
+    """
+    seller_ids を workers 店ずつ同時に取得する（limiter・session は全店で共有）。
+    戻り値: BatchIndex（販売者ID → 一覧の行）
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    limiter = limiter or make_limiter()
+    index = BatchIndex(os.path.join(out_dir, INDEX_NAME))
+    progress = _Progress(metrics) if metrics is not None else None
+    todo = [s for s in seller_ids if index.status(s) != DONE]
+    if len(todo) < len(seller_ids):
+        log_callback(f"[RESUME] 完了済みの {len(seller_ids) - len(todo)}店を飛ばします。")
+    log_callback(f"[INFO] {len(todo)}店を {workers}店ずつ同時に取得します（保存先: {out_dir}）...")
+
+    def task(seller_id):
+        log = _seller_log(log_callback, seller_id)
+        seller_metrics = _SellerMetrics(metrics, progress, seller_id) if metrics is not None else None
+        started = time.monotonic()
+        index.update(seller_id, 状態="取得中")
+        try:
+            try:
+                result = harvest_seller(app_id, seller_id, api_url, log, low_price, high_price, out_dir,
+                                        resume=True, metrics=seller_metrics, limiter=limiter, session=session)
+            except ValueError:
+                # 前回の記録が無い・使えない → 最初から
+                result = harvest_seller(app_id, seller_id, api_url, log, low_price, high_price, out_dir,
+                                        metrics=seller_metrics, limiter=limiter, session=session)
+            csv_path, count, failed, _ = result
+            out_path = csv_path
+            if export_ext:
+                out_path = os.path.splitext(csv_path)[0] + export_ext
+                with timed(metrics, "export"):
+                    export_rows(csv_path, out_path)
+            index.update(seller_id, 状態=PARTIAL if failed else DONE, 件数=count, 未取得ページ=failed,
+                         ファイル=os.path.basename(out_path), 所要秒=round(time.monotonic() - started, 1),
+                         エラー="")
+            return seller_id, None
+        except Exception as e:
+            index.update(seller_id, 状態=FAILED, 所要秒=round(time.monotonic() - started, 1), エラー=_error_text(e))
+            return seller_id, e
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(task, s) for s in todo]
+        for n, future in enumerate(as_completed(futures), 1):
+            seller_id, error = future.result()
+            entry = index.entries[seller_id]
+            if error is not None:
+                if metrics is not None:
+                    metrics.add("sellers_failed")
+                log_callback(f"[ERROR] {n}/{len(todo)} {seller_id}: {_error_text(error)}")
+            else:
+                if metrics is not None:
+                    metrics.add("sellers_done")
+                tag = "[WARN]" if entry["状態"] == PARTIAL else "[OK]"
+                log_callback(f"{tag} {n}/{len(todo)} {seller_id}: {entry['件数']}件"
+                             + (f"（未取得ページ {entry['未取得ページ']}件）" if entry["状態"] == PARTIAL else ""))
+    return index
+
+
+def run_yahoo_batch(app_id, api_url, ids_path, log_callback, low_price=None, high_price=None,
+                    workers=BATCH_WORKERS, use_cache=True):
+    """GUI・コマンドラインから呼ぶ一括取得。ids_path の隣の 一括取得_{名前} フォルダに保存する"""
+    metrics = RunMetrics("yahoo_batch")
+    metrics.start(METRICS_PATH)
+    cache = ResponseCache() if use_cache else None
+    session = make_session(cache=cache)
+    limiter = make_limiter()
+    metrics.gauge("rate_per_second", lambda: round(limiter.rate, 3))
+    metrics.gauge("concurrency", lambda: int(limiter.limit))
+    metrics.gauge("backoffs", lambda: limiter.backoffs)
+    try:
+        seller_ids = read_seller_ids(ids_path)
+        if not seller_ids:
+            log_callback(f"[ERROR] 販売者IDがありません（{ids_path}）")
+            return
+        out_dir = batch_dir(ids_path)
+        metrics.begin(0)
+        index = run_batch(app_id, api_url, seller_ids, log_callback, low_price, high_price, out_dir, workers,
+                          metrics=metrics, limiter=limiter, session=session)
+        statuses = [index.status(s) for s in seller_ids]
+        summary_text = (
+            f"[DONE] 一括取得: 完了 {statuses.count(DONE)}店 / 一部未取得 {statuses.count(PARTIAL)}店"
+            f" / 失敗 {statuses.count(FAILED)}店\n"
+            f"[FILE] 一覧: {index.path}\n"
+            f"[RATE] {limiter.report()}\n"
+            f"[TIME] {metrics.report()}\n"
+        )
+        if cache is not None:
+            summary_text += f"[CACHE] {cache.report()}\n"
+        if statuses.count(DONE) < len(seller_ids):
+            summary_text += "[INFO] もう一度実行すると、完了していない店だけを続きから取得します。\n"
+        log_callback(summary_text)
+    except Exception as e:
+        log_callback(f"[ERROR] 一括取得で例外発生: {e}")
+    finally:
+        session.close()
+        if cache is not None:
+            cache.close()
+        metrics.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Yahoo!ショッピング 複数販売者の一括取得")
+    parser.add_argument("ids", help="販売者IDの一覧（.txt は1行に1つ / .csv は1列目）")
+    parser.add_argument("--app-id", required=True, help="Client ID")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--low", default=None, help="下限価格")
+    parser.add_argument("--high", default=None, help="上限価格")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="同時に取得する販売者の数")
+    parser.add_argument("--no-cache", action="store_true", help="応答キャッシュを使わない")
+    args = parser.parse_args(argv)
+    run_yahoo_batch(args.app_id, args.api_url, args.ids, print, args.low, args.high, args.workers,
+                    use_cache=not args.no_cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# coding: utf-8
+"""
+Yahoo!ショッピングAPI の応答キャッシュ（SQLite・gzip 圧縮）
+
+    cache = ResponseCache()                        # ~/.yahoo_cache/yahoo_responses.sqlite3
+    session = make_session(cache=cache)            # yahoo_api._get がこの session のキャッシュを使う
+    ...
+    print(cache.report())                          # ヒット・ミスの件数
+
+・キーは URL と、appid を除いた検索条件を名前順に並べたもの（条件の順番や appid が違っても同じ応答を使う）
+・200 の応答の本文だけを gzip で圧縮して保存する（エラーは保存しない）
+・ttl_minutes を過ぎた応答は使わない。合計サイズが max_megabytes を超えたら最終参照が古いものから削除する（LRU）
+・どのスレッドから呼んでもよい
+"""
+
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+# =========================
+# 設定
+# =========================
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".yahoo_cache", "yahoo_responses.sqlite3")
+DEFAULT_TTL_MINUTES = 60
+DEFAULT_MAX_MEGABYTES = 512
+EVICT_TO = 0.9                 # 削除するときは上限のこの割合まで減らす
+IGNORED_PARAMS = ("appid",)
+
+
+def cache_key(api_url, params):
+    """URL + appid を除いた検索条件（名前順）"""
+    items = sorted((k, str(v)) for k, v in params.items() if k not in IGNORED_PARAMS and v is not None)
+    return f"{api_url}?{urlencode(items)}"
+
+
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_minutes=DEFAULT_TTL_MINUTES,
+                 max_megabytes=DEFAULT_MAX_MEGABYTES, clock=time.time):
+        self.path = path
+        self.ttl_seconds = ttl_minutes * 60
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key         TEXT PRIMARY KEY,
+                body        BLOB    NOT NULL,
+                size        INTEGER NOT NULL,
+                stored_at   REAL    NOT NULL,
+                last_access REAL    NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+        self.bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, api_url, params):
+        """有効期限内の応答（dict）。無ければ None"""
+        key = cache_key(api_url, params)
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] >= self.ttl_seconds:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(gzip.decompress(row[0]))
+
+    def put(self, api_url, params, content):
+        """content: 応答の本文（bytes）"""
+        key = cache_key(api_url, params)
+        body = gzip.compress(content)
+        now = self.clock()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, body, size, stored_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, body, len(body), now, now),
+            )
+            self.bytes += len(body) - (old[0] if old else 0)
+            if self.bytes > self.max_bytes:
+                self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        """期限切れをすべて消し、まだ多ければ最終参照が古いものから EVICT_TO まで消す"""
+        self._conn.execute("DELETE FROM responses WHERE stored_at <= ?", (now - self.ttl_seconds,))
+        self.bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = self.max_bytes * EVICT_TO
+        if self.bytes <= target:
+            return
+        removed = 0
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            keys.append((key,))
+            removed += size
+            if self.bytes - removed <= target:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self.bytes -= removed
+
+    def report(self):
+        total = self.hits + self.misses
+        rate = f"{self.hits / total:.0%}" if total else "-"
+        return f"キャッシュ ヒット {self.hits}件 / ミス {self.misses}件（ヒット率 {rate}・{self.bytes / 1024 / 1024:.1f}MB）"
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,256 @@
+# coding: utf-8
+"""
+Yahoo の商品取得 → Keepa の価格取得 → 重複除外 を1回でつなげて流す（Excel を経由しない）
+
+    python yahoo_keepa_pipeline.py hands-net --app-id ... --keepa-key ... [--low 1000] [--high 50000]
+
+    Yahoo（harvest_seller）──[パイプ]──> Keepa（keepa_cli.py --input - --layout jsonl・子プロセス）
+        │                                                        │
+        └ {販売者}_商品情報_{範囲}.csv                           └ {販売者}_Keepa照合_{範囲}.csv
+
+・Keepa の取得は Keepaapi/最終出力したもの/keepa_cli.py を子プロセスで動かす
+  （Keepa 側のモジュールはこちらで import しない。JAN は標準入力へ1行ずつ、結果は標準出力から
+   JSON の1行ずつ受け取り、keepa_cli のログ（標準エラー）は [Keepa] を付けてそのまま流す）
+  ※ 依頼は「同じプロセスの中で、上限付きのキューでつないで重複除外する」形だったが、子プロセスと
+    パイプでつないでいる。Yahoo → Keepa の間の上限は、keepa_cli 側の読み込みキュー
+    （keepa_core.STREAM_BUFFER_ROWS 行）と OS のパイプのバッファ（Windows / Linux で 4〜64KB 程度）の合計で、
+    キューの長さとしてこちらで決めてはいない
+・Yahoo の1ページが CSV に書かれた時点で、その行の JAN が Keepa に渡り、取得が始まる
+  （これまでのように Yahoo の全件 → Excel → 重複除外ソフト → Keepa と前の段の完了を待たない）
+・Keepa が追いつかないときはパイプが詰まり、Yahoo の書き出しが待つ
+・Yahoo 側の情報（商品名・価格・在庫）は Keepa の結果が返るまで行番号ごとに持っておく。
+  keepa_cli（--layout jsonl）は取れなかった行・不正な JAN の行も含めて全行の結果を返すので、
+  返った時点で消える（持っているのは Keepa に渡して結果待ちの行だけ。上の上限＋取得中・再試行待ちの分）
+・JAN の正規化と重複まとめは keepa_cli（keepa_core.JanFanOut）が行い、同じ JAN は1回だけ問い合わせる。
+  結果の CSV には 重複除外ソフト と同じく JAN ごとに最初の1行だけ残す（不正な JAN の行は除く）
+・入力が途切れたら keepa_cli が keepa_api.FLUSH を挟み、100件に満たなくても今ある分で問い合わせる
+・Keepa 側が止まったら（エラーで終了・stop()）、Yahoo のまだ投げていないページは投げずに終える
+・Keepa のジャーナル（{販売者}_Keepa記録_{範囲}.jsonl）は実行のたびに作り直す
+・結果の CSV は Keepa の結果が出るたびに1行ずつ書き足す（JAN・Yahoo の商品名/価格/在庫・Keepa の価格/商品名/備考）
+  再試行しても取れなかった JAN も備考（通信エラー等）付きで残し、件数と再取得用 CSV の場所を最後に出す
+"""
+
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from yahoo_api import harvest_seller, make_limiter, make_session
+from yahoo_cache import ResponseCache
+
+# =========================
+# 設定
+# =========================
+API_URL = "https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch"
+KEEPA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Keepaapi", "最終出力したもの")
+KEEPA_CLI = os.path.join(KEEPA_DIR, "keepa_cli.py")
+KEEPA_KEY_ENV = "KEEPA_API_KEY"  # 子プロセスに API キーを渡す環境変数（コマンドラインには出さない）
+STOP_POLL_SEC = 0.5              # stop() を見に行く間隔
+RESULT_COLUMNS = ("JANコード", "Yahoo商品名", "Yahoo価格", "在庫あり", "Keepa価格", "Keepa商品名", "備考")
+INVALID_JAN = "JAN不正"          # keepa_core.JanFanOut が不正な JAN の行に付ける備考
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _KeepaFeed:
+    """Yahoo の行 → keepa_cli の標準入力（1行に1つの JAN）。Yahoo 側の情報は yahoo[行番号] に取っておく"""
+
+    def __init__(self, stdin):
+        self.stdin = stdin
+        self.yahoo = {}          # 行番号 → (商品名, 価格, 在庫あり)（Keepa の結果が出たら消す）
+        self.rows_in = 0
+        self._lock = threading.Lock()
+
+    def on_rows(self, rows):
+        # Yahoo の取得スレッドから同時に呼ばれる。行番号（keepa_cli が数える順番）と書く順番をそろえる
+        with self._lock:
+            lines = []
+            for name, in_stock, price, jan, _ in rows:
+                self.yahoo[self.rows_in] = (name, price, in_stock)
+                self.rows_in += 1
+                lines.append(f"{str(jan).strip()}\n")
+            try:
+                self.stdin.write("".join(lines))
+                self.stdin.flush()
+            except (OSError, ValueError):
+                # keepa_cli が先に終わった（パイプが閉じている）
+                raise _Cancelled()
+
+    def close(self):
+        with self._lock:
+            try:
+                self.stdin.close()
+            except OSError:
+                pass
+
+
+def pipeline_paths(seller_id, low_price=None, high_price=None, out_dir=""):
+    """(結果 CSV, Keepa のジャーナル, Keepa で取れなかった JAN の再取得用 CSV)"""
+    span = f"{low_price or 'min'}-{high_price or 'max'}"
+    journal_path = os.path.join(out_dir, f"{seller_id}_Keepa記録_{span}.jsonl")
+    return (os.path.join(out_dir, f"{seller_id}_Keepa照合_{span}.csv"), journal_path,
+            os.path.splitext(journal_path)[0] + "_再取得用.csv")     # keepa_cli がジャーナルの名前から決める
+
+
+def _keepa_args(options):
+    """{"concurrency": 8, "cache_mode": "incremental"} → ["--concurrency", "8", "--cache-mode", "incremental"]"""
+    args = []
+    for name, value in (options or {}).items():
+        flag = "--" + name.replace("_", "-")
+        if value is True:
+            args.append(flag)
+        elif value is not None and value is not False:
+            args += [flag, str(value)]
+    return args
+
+
+def _start_keepa(keepa_api_key, journal_path, out_dir, keepa_options):
+    env = dict(os.environ, PYTHONIOENCODING="utf-8")
+    env[KEEPA_KEY_ENV] = keepa_api_key
+    return subprocess.Popen(
+        [sys.executable, KEEPA_CLI, "--input", "-", "--layout", "jsonl", "--journal", os.path.abspath(journal_path),
+         "--output-dir", os.path.abspath(out_dir or "."), "--api-key-env", KEEPA_KEY_ENV,
+         *_keepa_args(keepa_options)],
+        cwd=KEEPA_DIR, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, encoding="utf-8", errors="replace",
+        creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0),   # GUI から起動したとき黒い画面を出さない
+    )
+
+
+def run_pipeline(app_id, api_url, seller_id, keepa_api_key, log_callback, low_price=None, high_price=None,
+                 out_dir="", use_cache=True, keepa_options=None, stop=None):
+    """
+    seller_id の全商品を Yahoo から取りながら、JAN を Keepa（keepa_cli の子プロセス）で価格取得する。
+    keepa_options は keepa_cli のオプションとして渡す（{"concurrency": 8, "cache_mode": "incremental"} など）。
+    戻り値: {"yahoo_rows", "unique_jans", "duplicates", "invalid", "keepa_done", "keepa_failed",
+             "first_result_seconds", "seconds", "keepa_exit_code", "result_path", "retry_path"}
+    keepa_failed は再試行しても Keepa で取れなかった行（結果の CSV には備考付きで残り、retry_path にも出る）
+    """
+    stop = stop or (lambda: False)
+    result_path, journal_path, retry_path = pipeline_paths(seller_id, low_price, high_price, out_dir)
+    errors = []
+    written = set()
+    counts = {"keepa_done": 0, "duplicates": 0, "invalid": 0, "keepa_failed": 0}
+    cache = ResponseCache() if use_cache else None
+    session = make_session(cache=cache)
+    limiter = make_limiter()
+    halted = threading.Event()          # Keepa 側が終わった・止めた → Yahoo の残りのページは投げない
+
+    def yahoo_log(text):
+        if not text.startswith("[OK]"):          # ページごとの [OK] は多すぎるので出さない
+            log_callback(f"[Yahoo] {text}")
+
+    def keepa_log():
+        for line in proc.stderr:
+            if not line.startswith("🕐"):         # 100件ごとの進捗は多すぎるので出さない
+                log_callback(f"[Keepa] {line.rstrip()}")
+
+    def yahoo_stage():
+        try:
+            harvest_seller(app_id, seller_id, api_url, yahoo_log, low_price, high_price, out_dir,
+                           limiter=limiter, session=session, on_rows=feed.on_rows,
+                           stop=lambda: halted.is_set() or stop())
+        except _Cancelled:
+            pass
+        except Exception as e:
+            errors.append(e)
+            log_callback(f"[ERROR] Yahoo の取得で例外発生: {str(e).split(' for url:')[0]}")
+        finally:
+            feed.close()                 # keepa_cli は残りを問い合わせてから終わる
+
+    def watch_stop():
+        while not halted.wait(STOP_POLL_SEC):
+            if stop():
+                halted.set()
+                proc.terminate()
+
+    started = time.monotonic()
+    first_result = None
+    finished = False
+    proc = _start_keepa(keepa_api_key, journal_path, out_dir, keepa_options)
+    feed = _KeepaFeed(proc.stdin)
+    threads = [threading.Thread(target=f, daemon=True) for f in (yahoo_stage, keepa_log, watch_stop)]
+    log_callback(f"[INFO] Yahoo（{seller_id}）→ Keepa → 重複除外 を同時に流します...")
+    for t in threads:
+        t.start()
+    try:
+        with open(result_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(RESULT_COLUMNS)
+            for line in proc.stdout:
+                record = json.loads(line)
+                counts["keepa_done"] += 1
+                name, price, in_stock = feed.yahoo.pop(record["row"], ("", "", ""))
+                jan = record["JANコード"]
+                if record.get("再取得"):
+                    counts["keepa_failed"] += 1
+                if record["備考"].startswith(INVALID_JAN):
+                    counts["invalid"] += 1
+                    continue
+                if jan in written:
+                    counts["duplicates"] += 1
+                    continue
+                written.add(jan)
+                if first_result is None:
+                    first_result = time.monotonic() - started
+                    log_callback(f"[INFO] 最初の Keepa の結果: 開始から {first_result:.1f}秒")
+                writer.writerow([jan, name, price, in_stock, record["価格"], record["商品名"], record["備考"]])
+                f.flush()
+        finished = True
+    finally:
+        halted.set()
+        if not finished:
+            # 結果を読み終える前に抜けた（例外・Ctrl+C）。Keepa を止めると、書き込み待ちの Yahoo も抜ける
+            proc.terminate()
+        for t in threads:
+            t.join()
+        proc.wait()
+        session.close()
+        if cache is not None:
+            cache.close()
+
+    summary = {
+        "yahoo_rows": feed.rows_in, "unique_jans": len(written), **counts,
+        "first_result_seconds": first_result, "seconds": time.monotonic() - started,
+        "keepa_exit_code": proc.returncode, "result_path": result_path, "retry_path": retry_path,
+    }
+    log_callback(
+        f"[DONE] Yahoo {summary['yahoo_rows']}件 → Keepa {counts['keepa_done']}件 → JAN {len(written)}件"
+        f"（重複 {counts['duplicates']}件・JAN不正 {counts['invalid']}件を除外。{summary['seconds']:.1f}秒）\n"
+        f"[FILE] 保存先: {result_path}\n"
+        f"[RATE] {limiter.report()}"
+    )
+    if counts["keepa_failed"]:
+        log_callback(f"[WARN] Keepa で取れなかった行が {counts['keepa_failed']}件あります（結果には備考付きで残しています）。\n"
+                     f"[FILE] 再取得用: {os.path.abspath(retry_path)}")
+    if errors:
+        log_callback("[WARN] Yahoo の取得が途中で止まりました。取れた分までの結果です。")
+    if proc.returncode not in (0, None) and not stop():
+        log_callback(f"[WARN] Keepa の取得が途中で終わりました（終了コード {proc.returncode}）。取れた分までの結果です。")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Yahoo の商品取得から Keepa の価格取得まで続けて流す")
+    parser.add_argument("seller_id", help="販売者ID")
+    parser.add_argument("--app-id", required=True, help="Yahoo の Client ID")
+    parser.add_argument("--keepa-key", required=True, help="Keepa の API キー（カンマ区切りで複数可）")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--low", default=None, help="下限価格")
+    parser.add_argument("--high", default=None, help="上限価格")
+    parser.add_argument("--concurrency", type=int, default=None, help="Keepa の同時リクエスト数")
+    parser.add_argument("--no-cache", action="store_true", help="Yahoo の応答キャッシュを使わない")
+    args = parser.parse_args(argv)
+    options = {"concurrency": args.concurrency} if args.concurrency else {}
+    run_pipeline(args.app_id, args.api_url, args.seller_id, args.keepa_key, print, args.low, args.high,
+                 use_cache=not args.no_cache, keepa_options=options)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# coding: utf-8
+"""
+Yahoo 商品取得のページ記録（JSON Lines・追記のみ）
+
+・1ページ取れるごと（または取れないと確定するごと）に1行追記する
+  商品そのものは書き出し先（yahoo_sink の CSV）に書き、ここには件数だけ残す
+  （書き出し先に書いてから記録するので、記録済みのページは必ず書き出し先にある）
+・メタ情報 {"_meta": {"seller_id", "low_price", "high_price", "sink", "bands": [[下限, 上限, 件数], ...]}}
+  （1行目に販売者・価格範囲・書き出し先、価格帯を分け終えたら bands を追記）
+  以降は {"page": [下限, 上限, 開始位置], "rows": 件数} か {"page": [...], "error": "..."}
+  同じページの行が複数あれば後の行が有効（取り直して成功したら成功になる）
+・中断・失敗したページは「未取得ページを取り直す」で、記録済みのページを飛ばして取り直せる
+
+    journal = PageJournal(page_journal_path(seller_id, low, high), meta={...})   # 新しく始める
+    journal = PageJournal(path)                                                 # 続きから（読み込む）
+"""
+
+import json
+import os
+import threading
+
+def page_journal_path(seller_id, low_price=None, high_price=None):
+    return f"{seller_id}_{low_price or 'min'}-{high_price or 'max'}_ページ記録.jsonl"
+
+
+def _page_key(page):
+    low_price, high_price, start = page
+    return (low_price, high_price, int(start))
+
+
+class PageJournal:
+    def __init__(self, path, meta=None):
+        """meta を渡すと新しい記録として作り直す。省略すると既存の記録を読み込んで追記する"""
+        self.path = path
+        self.meta = meta or {}
+        self.done = {}             # ページ → 書き出した件数
+        self.failed = {}           # ページ → 最後のエラー
+        self._lock = threading.Lock()
+        torn = False
+        if meta is None:
+            self._load()
+            # 前回が書き込み途中で落ちていたら、その行を閉じてから追記する
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+        self._f = open(path, "w" if meta is not None else "a", encoding="utf-8")
+        if torn:
+            self._f.write("\n")
+        if meta is not None:
+            self._write({"_meta": meta})
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    continue            # 書き込み途中で落ちた行
+                if "_meta" in obj:
+                    self.meta.update(obj["_meta"])
+                elif "rows" in obj:
+                    page = _page_key(obj["page"])
+                    self.done[page] = obj["rows"]
+                    self.failed.pop(page, None)
+                elif "error" in obj:
+                    page = _page_key(obj["page"])
+                    if page not in self.done:
+                        self.failed[page] = obj["error"]
+
+    def _write(self, obj):
+        self._f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def update_meta(self, **values):
+        """メタ情報を追加する（後から分かった価格帯など。読み込み時は後の行で上書き）"""
+        with self._lock:
+            self.meta.update(values)
+            self._write({"_meta": values})
+
+    @property
+    def bands(self):
+        return [tuple(b) for b in self.meta.get("bands", [])]
+
+    def record(self, page, rows):
+        with self._lock:
+            page = _page_key(page)
+            self.done[page] = rows
+            self.failed.pop(page, None)
+            self._write({"page": list(page), "rows": rows})
+
+    def fail(self, page, error):
+        with self._lock:
+            page = _page_key(page)
+            self.failed[page] = str(error)
+            self._write({"page": list(page), "error": str(error)})
+
+    def all_pages(self, pages=()):
+        """pages と、記録にあるページ（重複なし・安い順・開始位置順）"""
+        keys = {_page_key(p) for p in pages} | set(self.done) | set(self.failed)
+        return sorted(keys, key=lambda p: (p[0] or 0, p[2]))
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
@@ -0,0 +1,129 @@
+# coding: utf-8
+"""
+Yahoo!ショッピングAPI の呼び出し速度を、応答を見ながら自動で調整する（AIMD）
+
+    limiter = AimdLimiter(start_rate=1 / WAIT_SEC)
+    with limiter.slot() as slot:          # 速度・同時数の枠が空くまで待つ
+        resp = session.get(...)
+        slot.status = resp.status_code    # 200 番台で遅延が普段どおりなら「健全」
+
+・健全な応答が続くあいだは 回数/秒 と 同時リクエスト数 を少しずつ上げる（加算）
+・429 / 5xx / 通信エラー / 遅延の急増（普段の LATENCY_SPIKE 倍超）が来たら半分に下げる（乗算）
+・それ以外の 4xx（400 / 404 など）は呼び出し側の問題なので、上げも下げもしない
+  同時に飛んでいたリクエストの失敗で何度も下げないよう、下げるのは応答時間1回ぶんに1度だけ
+・429 のときは下げた速度で次の枠まで全体を止める
+・どのスレッドから呼んでもよい
+"""
+
+import threading
+import time
+
+# =========================
+# 設定
+# =========================
+MIN_RATE = 0.2             # 回/秒 の下限
+MAX_RATE = 10.0            # 回/秒 の上限
+MAX_CONCURRENCY = 8        # 同時リクエスト数の上限
+RATE_STEP = 0.5            # 健全な応答1秒ぶんで上げる 回/秒
+DECREASE = 0.5             # 異常時に掛ける割合
+LATENCY_SPIKE = 3.0        # 普段の何倍の遅延で「急増」とみなすか
+BASELINE_DRIFT = 0.02      # 普段の遅延の見積もりを、1回ごとにこの割合だけ上に戻す
+
+
+class _Slot:
+    """slot() の戻り値。status を入れておくと健全かどうかの判定に使う（例外で抜けたら異常）"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.status = None
+
+    def __enter__(self):
+        self.started = self.limiter.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        status = self.status if exc_type is None else exc_type.__name__
+        self.limiter.release(self.started, status)
+        return False
+
+
+class AimdLimiter:
+    def __init__(self, start_rate=1.0, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 max_concurrency=MAX_CONCURRENCY, clock=time.monotonic, sleep=time.sleep):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.rate = min(max_rate, max(min_rate, start_rate))
+        self.limit = 1.0                 # 同時リクエスト数（小数で持って切り捨てて使う）
+        self.clock = clock
+        self.sleep = sleep
+
+        self.baseline = None             # 普段の遅延（秒）
+        self.healthy = 0
+        self.backoffs = 0
+        self.peak_rate = self.rate
+        self._inflight = 0
+        self._next = clock()             # 次に送ってよい時刻
+        self._calm_until = 0.0           # これより前の異常では下げない
+        self._cond = threading.Condition()
+
+    def slot(self):
+        return _Slot(self)
+
+    def acquire(self):
+        """枠が空くまで待つ。戻り値: 送信時刻（release に渡す）"""
+        with self._cond:
+            while self._inflight >= int(self.limit):
+                self._cond.wait()
+            self._inflight += 1
+            now = self.clock()
+            send_at = max(now, self._next)
+            self._next = send_at + 1.0 / self.rate
+        if send_at > now:
+            self.sleep(send_at - now)
+        return send_at
+
+    def release(self, started, status):
+        """応答を受けたら必ず呼ぶ。status は HTTP ステータスか例外名"""
+        with self._cond:
+            now = self.clock()
+            latency = max(0.0, now - started)
+            ok = isinstance(status, int) and 200 <= status < 300
+            overloaded = not isinstance(status, int) or status == 429 or status >= 500
+            spike = self.baseline is not None and latency > self.baseline * LATENCY_SPIKE
+            if ok and not spike:
+                self.healthy += 1
+                self.baseline = latency if self.baseline is None else min(
+                    latency, self.baseline * (1 + BASELINE_DRIFT))
+                self.rate = min(self.max_rate, self.rate + RATE_STEP / self.rate)
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+                self.peak_rate = max(self.peak_rate, self.rate)
+            elif (overloaded or spike) and now >= self._calm_until:
+                self.backoffs += 1
+                self.rate = max(self.min_rate, self.rate * DECREASE)
+                self.limit = max(1.0, self.limit * DECREASE)
+                self._calm_until = now + max(latency, 1.0 / self.rate)
+                if status == 429:
+                    self._next = max(self._next, now + 1.0 / self.rate)
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def report(self):
+        """今の速度と調整の回数を1行で（ログ用）"""
+        return (f"速度 {self.rate:.1f}回/秒・同時{int(self.limit)}本"
+                f"（最高 {self.peak_rate:.1f}回/秒・減速 {self.backoffs}回）")
+
+
+def limited(limiter):
+    """limiter が None でも使える slot()"""
+    return limiter.slot() if limiter is not None else _NullSlot()
+
+
+class _NullSlot:
+    status = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
@@ -0,0 +1,201 @@
+# coding: utf-8
+"""
+取得した商品を、ページが届くたびにファイルへ書き足す（全件をメモリに溜めない）
+
+    sink = CsvRowSink("hands-net_商品情報_min-max.csv")
+    sink.write_hits(data["hits"])         # 1ページぶん（重複は飛ばす）
+    sink.close()
+    export_rows(sink.path, "hands-net_商品情報.xlsx")   # 必要なら後から Excel / Parquet に
+
+・CSV は1ページごとに flush するので、途中で落ちてもそこまでの行がそのまま読める
+  （Excel・Parquet は閉じるまで読めない形式なので、書き出しは終わった後の別手順にする）
+・重複の判定に商品コードだけは全件ぶん覚えておく（行そのものは持たない）。
+  このぶんのメモリは商品コードの数に比例して増える（100万件でおよそ 100MB）
+・resume=True で既存の CSV に書き足す（既にある商品コードは飛ばす）
+・MemorySink は同じ使い方で行をリストに溜める（ファイルを作らない呼び出し用）
+・on_rows(rows) を渡すと、書いた行（重複を除く）をページごとに渡す（後の処理へ流すため）。
+  呼ぶのはロックを外してから（on_rows が待っても、ほかのページの書き込みは止めない）
+"""
+
+import csv
+import os
+import threading
+
+# =========================
+# 設定
+# =========================
+COLUMNS = ("商品名", "在庫あり", "価格", "JANコード", "商品コード")
+EXPORT_COLUMNS = COLUMNS[:4]     # Excel / Parquet に出す列（従来の Excel と同じ）
+EXPORT_CHUNK_ROWS = 50_000       # Parquet へ書き出すときに一度に読む行数
+
+
+def hit_code(h):
+    """重複判定に使う商品コード（無ければ 商品名・価格・JAN の組）"""
+    return h.get("code") or f"{h.get('name')}\t{h.get('price')}\t{h.get('janCode')}"
+
+
+def hit_row(h):
+    return [h.get("name") or "", h.get("inStock"), h.get("price") or "", h.get("janCode") or "", hit_code(h)]
+
+
+class MemorySink:
+    """行を self.rows（[商品名, 在庫あり, 価格, JANコード]）に溜める"""
+
+    def __init__(self):
+        self.rows = []
+        self.count = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def write_hits(self, hits):
+        with self._lock:
+            written = 0
+            for h in hits:
+                code = hit_code(h)
+                if code in self._seen:
+                    continue
+                self._seen.add(code)
+                self.rows.append(hit_row(h)[:4])
+                written += 1
+            self.count += written
+            return written
+
+    def close(self):
+        pass
+
+
+class CsvRowSink:
+    """
+    行を path の CSV に書き足す。重複判定用の商品コード（_seen）は閉じるまで全件ぶん持つ
+    （メモリは商品コードの数に比例して増える）
+    """
+
+    def __init__(self, path, resume=False, on_rows=None):
+        self.path = path
+        self.on_rows = on_rows
+        self.count = 0
+        self._seen = set()
+        self._lock = threading.Lock()
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if resume and exists:
+            self._load_codes()
+            self._f = open(path, "a", newline="", encoding="utf-8")
+        else:
+            self._f = open(path, "w", newline="", encoding="utf-8-sig")
+            csv.writer(self._f).writerow(COLUMNS)
+        self._writer = csv.writer(self._f)
+
+    def _load_codes(self):
+        """前回までに書いた商品コード（書き込み途中で落ちた最後の行は切り捨てる。そのページは取り直しになる）"""
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - 65536))
+            tail = f.read()
+            if not tail.endswith(b"\n") and b"\n" in tail:
+                f.truncate(size - len(tail) + tail.rindex(b"\n") + 1)
+        with open(self.path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) == len(COLUMNS):
+                    self._seen.add(row[-1])
+                    self.count += 1
+
+    def write_hits(self, hits):
+        """1ページぶんを書き足す。戻り値: 書いた行数（重複を除く）"""
+        with self._lock:
+            rows = []
+            for h in hits:
+                row = hit_row(h)
+                if row[-1] in self._seen:
+                    continue
+                self._seen.add(row[-1])
+                rows.append(row)
+            self._writer.writerows(rows)
+            self._f.flush()
+            self.count += len(rows)
+        if self.on_rows is not None and rows:
+            self.on_rows(rows)
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+
+
+# =========================
+# 書き出し（後から）
+# =========================
+def _iter_csv_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) != len(COLUMNS):
+                continue
+            name, in_stock, price, jan, _ = row
+            yield [
+                name,
+                {"True": True, "False": False}.get(in_stock, in_stock or None),
+                int(price) if price.isdigit() else price,
+                jan,
+            ]
+
+
+def export_rows(csv_path, out_path):
+    """
+    CSV → out_path（拡張子で形式を決める: .xlsx / .parquet / .csv）。
+    xlsx は openpyxl の書き込み専用モード、parquet は EXPORT_CHUNK_ROWS 行ずつ書くので、
+    件数が多くても使うメモリは増えない。戻り値: 書いた行数
+    """
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext == ".parquet":
+        return _export_parquet(csv_path, out_path)
+    if ext == ".csv":
+        n = 0
+        with open(out_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            for row in _iter_csv_rows(csv_path):
+                writer.writerow(row)
+                n += 1
+        return n
+
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(EXPORT_COLUMNS))
+    n = 0
+    for row in _iter_csv_rows(csv_path):
+        ws.append(row)
+        n += 1
+    wb.save(out_path)
+    return n
+
+
+def _export_parquet(csv_path, out_path):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet の書き出しには pyarrow が必要です（pip install pyarrow）")
+
+    schema = pa.schema([("商品名", pa.string()), ("在庫あり", pa.bool_()),
+                        ("価格", pa.int64()), ("JANコード", pa.string())])
+    n = 0
+    with pq.ParquetWriter(out_path, schema) as writer:
+        chunk = []
+        for row in _iter_csv_rows(csv_path):
+            name, in_stock, price, jan = row
+            chunk.append((name, in_stock if isinstance(in_stock, bool) else None,
+                          price if isinstance(price, int) else None, jan))
+            if len(chunk) >= EXPORT_CHUNK_ROWS:
+                writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, r)) for r in chunk], schema))
+                n += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, r)) for r in chunk], schema))
+            n += len(chunk)
+    return n
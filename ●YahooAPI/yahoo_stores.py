@@ -0,0 +1,250 @@
+# coding: utf-8
+"""
+店舗（販売者ID）を集める巡回と、集めた店舗の台帳（SQLite）
+
+    registry = StoreRegistry()                       # 店舗台帳.sqlite3
+    crawl_stores(app_id, api_url, registry, print)   # カテゴリ × 価格帯 × 並び順 の区分ごとに検索
+    registry.export("店舗ID一覧.csv")                 # yahoo_batch.py の一括取得にそのまま渡せる
+
+・1つの検索で取れるのは TOTAL_ITEMS 件までなので、検索を カテゴリ × 価格帯 × 並び順 の
+  「区分」に分け、区分ごとに最大 TOTAL_ITEMS 件ぶんのページを見る。区分は同時に回す（速度は limiter 次第）
+・台帳には 販売者ID・店舗名・初めて見た時刻・最後に見た時刻 と、区分ごとの結果を残す
+・2回目以降は区分の1ページ目だけを見て、件数と並びが前回と同じなら残りのページは飛ばす
+  （その区分で前回見た店舗は「最後に見た時刻」だけ更新する）。
+  1ページ目が同じでも奥のページだけ変わることはあるので、SHARD_RECHECK_HOURS を過ぎた区分は全ページ見直す
+・1ページ目は応答キャッシュを通さずに毎回取り直す（キャッシュの古い応答で「変化なし」と判定しない）
+"""
+
+import csv
+import hashlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from yahoo_api import RESULTS_PER_CALL, TOTAL_ITEMS, _get_retrying, make_limiter
+
+# =========================
+# 設定
+# =========================
+DEFAULT_REGISTRY_PATH = "店舗台帳.sqlite3"
+QUERY = "全商品"                  # カテゴリを指定しない区分の検索語（query かカテゴリのどちらかが必須）
+# 第1階層のカテゴリ（genre_category_id）。None はカテゴリ指定なし（QUERY で検索）
+# カテゴリが増減したら差し替える（存在しない ID は0件になるだけ）
+CATEGORIES = (None, 13457, 2494, 2495, 2496, 2497, 2498, 2499, 2500, 2501, 2502, 2503, 2504, 2505, 2506,
+              2507, 2508, 2509, 2510, 2511, 2512, 2513, 2514, 2516, 2517, 10002)
+# 価格帯（下限, 上限。None は指定なし）
+PRICE_BANDS = ((None, 999), (1000, 2999), (3000, 9999), (10000, 29999), (30000, None))
+SORTS = ("-score", "+price", "-price")
+SHARD_RECHECK_HOURS = 24 * 7    # これより前に全ページ見た区分は、1ページ目が同じでも見直す
+EXPORT_COLUMNS = ("販売者ID", "店舗名", "初めて見た日時", "最後に見た日時")
+
+
+def shard_key(category, low_price, high_price, sort):
+    return f"{category or '-'}|{low_price or ''}-{high_price or ''}|{sort}"
+
+
+def make_shards(categories=CATEGORIES, price_bands=PRICE_BANDS, sorts=SORTS):
+    """[(カテゴリ, 下限, 上限, 並び順)]"""
+    return [(c, lo, hi, s) for c in categories for lo, hi in price_bands for s in sorts]
+
+
+def _shard_params(app_id, shard, start):
+    category, low_price, high_price, sort = shard
+    params = {
+        "appid": app_id,
+        "results": RESULTS_PER_CALL,
+        "start": start,
+        "sort": sort,
+        "availability": "1",       # 文字列で指定（整数だと400エラーになる場合あり）
+        "condition": "new",
+    }
+    if category:
+        params["genre_category_id"] = category
+    else:
+        params["query"] = QUERY
+    if low_price:
+        params["price_from"] = low_price
+    if high_price:
+        params["price_to"] = high_price
+    return params
+
+
+def _fingerprint(data):
+    """件数と1ページ目の並び（商品コード）から作る目印。変わっていなければ区分の結果も同じとみなす"""
+    codes = ",".join(str(h.get("code") or h.get("name")) for h in data.get("hits", []))
+    return f"{data.get('totalResultsAvailable', 0)}:{hashlib.sha1(codes.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _sellers(hits):
+    """ヒット → {販売者ID: 店舗名}"""
+    found = {}
+    for h in hits:
+        seller = h.get("seller") or {}
+        store = seller.get("sellerId")
+        if store:
+            found[store] = seller.get("name") or found.get(store) or ""
+    return found
+
+
+class StoreRegistry:
+    def __init__(self, path=DEFAULT_REGISTRY_PATH, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS stores (
+                seller_id   TEXT PRIMARY KEY,
+                name        TEXT,
+                first_seen  REAL NOT NULL,
+                last_seen   REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS shards (
+                shard       TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                total       INTEGER,
+                checked_at  REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS shard_stores (
+                shard       TEXT NOT NULL,
+                seller_id   TEXT NOT NULL,
+                PRIMARY KEY (shard, seller_id)
+            );
+            """
+        )
+        self._conn.commit()
+
+    def shard(self, key):
+        """前回の (目印, 全ページを見た時刻)。無ければ None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT fingerprint, checked_at FROM shards WHERE shard = ?", (key,)).fetchone()
+
+    def record_shard(self, key, fingerprint, total, sellers):
+        """区分を全ページ見た結果を保存する。sellers: {販売者ID: 店舗名}。戻り値: 新しく見つかった店舗数"""
+        now = self.clock()
+        with self._lock:
+            before = self._conn.execute("SELECT COUNT(*) FROM stores").fetchone()[0]
+            self._conn.executemany(
+                "INSERT INTO stores (seller_id, name, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(seller_id) DO UPDATE SET last_seen = excluded.last_seen, "
+                " name = COALESCE(NULLIF(excluded.name, ''), stores.name)",
+                [(store, name, now, now) for store, name in sellers.items()],
+            )
+            self._conn.execute("DELETE FROM shard_stores WHERE shard = ?", (key,))
+            self._conn.executemany("INSERT INTO shard_stores (shard, seller_id) VALUES (?, ?)",
+                                   [(key, store) for store in sellers])
+            self._conn.execute(
+                "INSERT INTO shards (shard, fingerprint, total, checked_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(shard) DO UPDATE SET fingerprint = excluded.fingerprint, "
+                " total = excluded.total, checked_at = excluded.checked_at",
+                (key, fingerprint, total, now),
+            )
+            self._conn.commit()
+            return self._conn.execute("SELECT COUNT(*) FROM stores").fetchone()[0] - before
+
+    def touch_shard(self, key):
+        """結果が変わっていない区分の店舗を「今回も見た」ことにする"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE stores SET last_seen = ? WHERE seller_id IN "
+                "(SELECT seller_id FROM shard_stores WHERE shard = ?)",
+                (self.clock(), key),
+            )
+            self._conn.commit()
+
+    def seller_ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT seller_id FROM stores ORDER BY seller_id")]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM stores").fetchone()[0]
+
+    def export(self, path):
+        """CSV（販売者ID・店舗名・初めて見た日時・最後に見た日時）。戻り値: 行数"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seller_id, name, first_seen, last_seen FROM stores ORDER BY seller_id").fetchall()
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            for store, name, first_seen, last_seen in rows:
+                writer.writerow([store, name or "", _format_time(first_seen), _format_time(last_seen)])
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _format_time(t):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+
+
+def crawl_stores(app_id, api_url, registry, log_callback, shards=None, force=False, metrics=None,
+                 limiter=None, session=None):
+    """
+    区分（make_shards()）ごとに検索して、見つかった店舗を registry に足す。
+    force=True なら前回と同じ区分も全ページ見直す。1区分の失敗は記録して次へ進む（次回また見る）。
+    戻り値: {"shards", "crawled", "skipped", "failed", "new_stores", "stores", "requests"}
+    """
+    shards = make_shards() if shards is None else shards
+    limiter = limiter or make_limiter()
+    recheck_before = registry.clock() - SHARD_RECHECK_HOURS * 3600
+    summary = {"shards": len(shards), "crawled": 0, "skipped": 0, "failed": 0, "new_stores": 0, "requests": 0}
+    lock = threading.Lock()
+
+    def fetch(shard, start, fresh=False):
+        with lock:
+            summary["requests"] += 1
+        where = f"区分 {shard_key(*shard)} {start}件目〜"
+        return _get_retrying(api_url, _shard_params(app_id, shard, start), session, limiter, metrics,
+                             "stores", log_callback, where, fresh=fresh)
+
+    def task(shard):
+        key = shard_key(*shard)
+        # 1ページ目は変化の目印なので、応答キャッシュ（有効期限内なら前回の応答を返す）を通さない
+        first = fetch(shard, 1, fresh=True)
+        fingerprint = _fingerprint(first)
+        previous = registry.shard(key)
+        if not force and previous and previous[0] == fingerprint and previous[1] >= recheck_before:
+            registry.touch_shard(key)
+            return key, None
+        total = min(int(first.get("totalResultsAvailable", 0)), TOTAL_ITEMS)
+        sellers = _sellers(first.get("hits", []))
+        for start in range(1 + RESULTS_PER_CALL, total + 1, RESULTS_PER_CALL):
+            hits = fetch(shard, start).get("hits", [])
+            if not hits:
+                break
+            sellers.update(_sellers(hits))
+        return key, registry.record_shard(key, fingerprint, total, sellers)
+
+    log_callback(f"[INFO] {len(shards)}区分を巡回します（台帳: {registry.path}・登録済み {registry.count()}店）...")
+    with ThreadPoolExecutor(max_workers=limiter.max_concurrency) as pool:
+        futures = {pool.submit(task, shard): shard for shard in shards}
+        for n, future in enumerate(as_completed(futures), 1):
+            try:
+                key, new = future.result()
+            except Exception as e:
+                summary["failed"] += 1
+                log_callback(f"[ERROR] {n}/{len(shards)} 区分 {shard_key(*futures[future])}: "
+                             f"{str(e).split(' for url:')[0]}")
+                continue
+            if new is None:
+                summary["skipped"] += 1
+            else:
+                summary["crawled"] += 1
+                summary["new_stores"] += new
+            if metrics is not None:
+                metrics.set_progress(n, len(shards))
+            log_callback(f"[OK] {n}/{len(shards)} 区分 {key}"
+                         + ("（変化なし）" if new is None else f"（新しい店舗 {new}件）"))
+    summary["stores"] = registry.count()
+    log_callback(f"[DONE] 区分 {summary['crawled']}件を巡回・{summary['skipped']}件は変化なし・"
+                 f"失敗 {summary['failed']}件 / 新しい店舗 {summary['new_stores']}件（合計 {summary['stores']}店）")
+    return summary
@@ -1,54 +1,45 @@
-import requests
-import time
+import argparse
 
 API_URL = "https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch"
 APP_ID = "dj00aiZpPXlkOGd5bDlUcTlWRyZzPWNvbnN1bWVyc2VjcmV0Jng9MmE-"
 
-store_ids = set()
+IDS_PATH = "店舗ID一覧.csv"   # 台帳の店舗ID（yahoo_batch.py の一括取得にそのまま渡せる）
 
-for i in range(20):  # 試しに10ページ分
-    start = i * 50 + 50  # ページ先頭位置
-    params = {
-        "appid": APP_ID,
-        "query": "全商品",  # キーワードは必須
-        "results": 50,             # 最大50件
-        "start": start,
-        "sort": "-score",          # 人気順
-        "availability": "1",       # 文字列で指定（整数だと400エラーになる場合あり）
-        "condition": "new"         # これも "new" / "used" の文字列指定
-    }
 
-    try:
-        response = requests.get(API_URL, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-
-        hits = data.get("hits", [])
-        if not hits:
-            print(f"{i+1}ページ目にデータがありません。終了します。")
-            break
+def main(argv=None):
+    """カテゴリ × 価格帯 × 並び順 で巡回して台帳に足し、台帳の店舗ID一覧を書き出す"""
+    from yahoo_api import make_session
+    from yahoo_cache import ResponseCache
+    from yahoo_stores import DEFAULT_REGISTRY_PATH, StoreRegistry, crawl_stores
 
-        for h in hits:
-            seller = h.get("seller", {})
-            store = seller.get("sellerId")
-            if store:
-                store_ids.add(store)
+    parser = argparse.ArgumentParser(description="Yahoo!ショッピングの店舗IDを集める")
+    parser.add_argument("--app-id", default=APP_ID)
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--registry", default=DEFAULT_REGISTRY_PATH, help="店舗台帳（SQLite）")
+    parser.add_argument("--out", default=IDS_PATH, help="書き出す店舗ID一覧（CSV）")
+    parser.add_argument("--force", action="store_true", help="前回と変わっていない区分も全ページ見直す")
+    parser.add_argument("--no-cache", action="store_true", help="応答キャッシュを使わない")
+    args = parser.parse_args(argv)
 
-        print(f"{i+1}ページ目完了。現在の店舗数: {len(store_ids)}")
-
-        time.sleep(0.5)
+    registry = StoreRegistry(args.registry)
+    cache = None if args.no_cache else ResponseCache()
+    session = make_session(cache=cache)
+    try:
+        crawl_stores(args.app_id, args.api_url, registry, print, force=args.force, session=session)
+        print(f"\n最終的に台帳にある店舗数: {registry.export(args.out)}")
+        print(f"保存先: {args.out}")
+        if cache is not None:
+            print(cache.report())
+    finally:
+        session.close()
+        if cache is not None:
+            cache.close()
+        registry.close()
 
-    except requests.exceptions.RequestException as e:
-        print(f"{i+1}ページ目でリクエストエラー: {e}")
-        print(f"レスポンス: {response.text if 'response' in locals() else 'なし'}")
-        break
-    except Exception as e:
-        print(f"予期せぬエラー: {e}")
-        break
 
-print(f"\n最終的に取得した店舗数: {len(store_ids)}")
-print(store_ids)
+if __name__ == "__main__":
+    main()
 
 
 # dj00aiZpPXlkOGd5bDlUcTlWRyZzPWNvbnN1bWVyc2VjcmV0Jng9MmE-
-# https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch
\ No newline at end of file
+# https://shopping.yahooapis.jp/ShoppingWebService/V3/itemSearch